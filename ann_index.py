@@ -0,0 +1,567 @@
+import os
+import math
+import time
+import uuid
+import tempfile
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+STORAGE_TYPES = ("float32", "float16", "int8")
+
+# Corpus sizes where exact search stops being "fast enough"
+FLAT_MAX = 20_000
+HNSW_MAX = 500_000
+
+# Share of dead slots (HNSW tombstones, stale re-scoring rows) that triggers a compaction
+COMPACT_FRACTION = float(os.getenv("RAG_COMPACT_FRACTION", "0.2"))
+
+
+def choose_index_type(n_vectors, recall_target=0.95):
+    """
+    Pick an index type from corpus size and recall/latency target
+    - small corpora: exact flat search
+    - medium: HNSW (best recall per millisecond, but vectors stay uncompressed)
+    - large: IVF-Flat when recall matters most, IVF-PQ (compressed) otherwise
+    """
+    if n_vectors < FLAT_MAX:
+        return "flat"
+    if n_vectors < HNSW_MAX:
+        return "hnsw"
+    return "ivf_flat" if recall_target >= 0.97 else "ivf_pq"
+
+
+def resolve_config(n_vectors, dim, index_type="auto", recall_target=0.95, overrides=None,
+                   storage="float32", rescore=False):
+    """
+    Full build + search settings for an index; `overrides` wins over the defaults.
+    storage: how vectors are held in the index (float16/int8 scalar quantization).
+    rescore: keep float32 vectors on disk and re-rank the top candidates exactly.
+    """
+    overrides = dict(overrides or {})
+    if index_type in (None, "auto"):
+        index_type = choose_index_type(n_vectors, recall_target)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type} (choose from {', '.join(INDEX_TYPES)})")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown storage: {storage} (choose from {', '.join(STORAGE_TYPES)})")
+
+    config = {
+        "index_type": index_type,
+        "recall_target": recall_target,
+        # PQ is already compressed; scalar quantization applies to the other types
+        "storage": "float32" if index_type == "ivf_pq" else storage,
+        "rescore": bool(rescore),
+        "rescore_factor": 4,
+    }
+    if index_type == "hnsw":
+        config["hnsw_m"] = 32
+        config["ef_construction"] = 80
+        config["ef_search"] = 128 if recall_target >= 0.97 else 64
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        # ~4*sqrt(n) lists, with at least 39 training points per list
+        nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+        config["nlist"] = max(1, min(nlist, n_vectors // 39 or 1))
+        config["nprobe"] = max(1, min(config["nlist"], config["nlist"] // (8 if recall_target >= 0.97 else 32) or 1))
+        if index_type == "ivf_pq":
+            # Sub-quantizers must divide the dimension; aim for ~8 dims each
+            m = max(1, dim // 8)
+            while dim % m:
+                m -= 1
+            config["pq_m"] = m
+            config["pq_bits"] = 8
+    config.update(overrides)
+    return config
+
+
+def build_index(vectors, config):
+    """Build (and train if needed) a FAISS index over float32 vectors (L2, like FAISS.from_documents)"""
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, dim = vectors.shape
+    index_type = config["index_type"]
+    start_time = time.time()
+
+    qtype = {
+        "float16": faiss.ScalarQuantizer.QT_fp16,
+        "int8": faiss.ScalarQuantizer.QT_8bit,
+    }.get(config.get("storage", "float32"))
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim) if qtype is None else faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    elif index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, config["hnsw_m"])
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, config["hnsw_m"])
+        index.hnsw.efConstruction = config["ef_construction"]
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, config["nlist"], config["pq_m"], config["pq_bits"])
+        elif qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dim, config["nlist"])
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, config["nlist"], qtype, faiss.METRIC_L2)
+
+    if not index.is_trained:
+        # IVF lists and int8 value ranges are learned; a sample is plenty
+        nlist = config.get("nlist", 1)
+        sample_size = min(n, config.get("train_size", max(nlist * 256, 50_000)))
+        sample = vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)] if sample_size < n else vectors
+        index.train(sample)
+
+    apply_search_params(index, config)
+    if n:
+        index.add(vectors)
+    print(f"[INDEX] Built {index_type}/{config.get('storage', 'float32')} index over {n} vectors "
+          f"in {time.time() - start_time:.2f}s")
+    return index
+
+
+def apply_search_params(index, config):
+    """Set nprobe / efSearch on a built or freshly loaded index"""
+    import faiss
+
+    if "nprobe" in config:
+        try:
+            faiss.extract_index_ivf(index).nprobe = int(config["nprobe"])
+        except RuntimeError:
+            pass
+    if "ef_search" in config and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = int(config["ef_search"])
+
+
+def search_params(index):
+    """nprobe / ef_search currently set on an index (apply_search_params restores them)"""
+    import faiss
+
+    params = {}
+    try:
+        params["nprobe"] = faiss.extract_index_ivf(index).nprobe
+    except RuntimeError:
+        pass
+    if hasattr(index, "hnsw"):
+        params["ef_search"] = index.hnsw.efSearch
+    return params
+
+
+def supports_compacting_remove(index):
+    """Flat indexes renumber on remove_ids, which is what FAISS.delete assumes"""
+    import faiss
+
+    return isinstance(index, faiss.IndexFlatCodes)
+
+
+def _ivf(index):
+    import faiss
+
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def uses_tombstones(index):
+    """HNSW graphs cannot remove vectors; deleted positions are skipped at search time"""
+    return hasattr(index, "hnsw")
+
+
+def reconstruct_all(index, positions=None):
+    """Stored vectors by position (lossy for PQ indexes)"""
+    import faiss
+
+    if positions is None:
+        positions = range(index.ntotal)
+    ivf = _ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        # A hashtable map also works once removals have left gaps in the ids
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    positions = np.asarray(list(positions), dtype=np.int64)
+    try:
+        return index.reconstruct_batch(positions)
+    except (AttributeError, RuntimeError):
+        out = np.empty((len(positions), index.d), dtype=np.float32)
+        for row, position in enumerate(positions):
+            out[row] = index.reconstruct(int(position))
+        return out
+
+
+def next_position(vectorstore):
+    """Index position the next added vector gets"""
+    if uses_tombstones(vectorstore.index) or not vectorstore.index_to_docstore_id:
+        return vectorstore.index.ntotal
+    return max(vectorstore.index_to_docstore_id) + 1
+
+
+def add_vectors(vectorstore, vectors, ids):
+    """Add vectors for docstore ids that are already in the docstore"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    start = next_position(vectorstore)
+    positions = np.arange(start, start + len(vectors), dtype=np.int64)
+    if start == vectorstore.index.ntotal:
+        vectorstore.index.add(vectors)
+    else:
+        # IVF ids are not renumbered by remove_ids, so new ones continue after the highest
+        vectorstore.index.add_with_ids(vectors, positions)
+    vectorstore.index_to_docstore_id.update(zip(positions.tolist(), ids))
+    vectorstore.put_full_vectors(start, vectors)
+    vectorstore.positions_changed()
+
+
+def delete_ids(vectorstore, ids):
+    """
+    Remove docstore ids from a FAISS vectorstore of any index type.
+    Flat indexes are compacted, IVF lists drop the entries (other ids keep their
+    positions) and HNSW positions become tombstones that searches skip; none of
+    them re-adds the remaining vectors. Compaction reclaims tombstones later.
+    """
+    import faiss
+
+    if supports_compacting_remove(vectorstore.index):
+        if getattr(vectorstore, "full_vectors", None) is not None:
+            doomed = set(ids)
+            vectorstore.keep_full_vectors([
+                position for position, doc_id in sorted(vectorstore.index_to_docstore_id.items())
+                if doc_id not in doomed
+            ])
+        vectorstore.delete(ids)
+        vectorstore.positions_changed()
+        return
+
+    doomed = set(ids)
+    positions = [position for position, doc_id in vectorstore.index_to_docstore_id.items() if doc_id in doomed]
+    if not uses_tombstones(vectorstore.index):
+        ivf = _ivf(vectorstore.index)
+        if ivf is not None and ivf.direct_map.type == faiss.DirectMap.Array:
+            # An array direct map cannot remove; a hashtable one can
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        vectorstore.index.remove_ids(np.asarray(positions, dtype=np.int64))
+    for position in positions:
+        del vectorstore.index_to_docstore_id[position]
+    vectorstore.docstore.delete(list(doomed))
+    vectorstore.positions_changed()
+
+
+def dead_fraction(vectorstore):
+    """Share of index positions (or re-scoring rows) that no longer hold a live chunk"""
+    live = len(vectorstore.index_to_docstore_id)
+    if uses_tombstones(vectorstore.index):
+        slots = vectorstore.index.ntotal
+    elif getattr(vectorstore, "full_vectors", None) is not None:
+        slots = len(vectorstore.full_vectors)
+    else:
+        slots = live
+    return 1 - live / slots if slots else 0.0
+
+
+def live_vectors(vectorstore, directory=None):
+    """
+    (ids, VectorBuffer) of the live chunks in position order. Uses the float32
+    re-scoring copy when there is one, else the index's own (possibly
+    quantized) vectors. With `directory`, the buffer is paged to disk there.
+    """
+    items = sorted(vectorstore.index_to_docstore_id.items())
+    positions = np.asarray([position for position, _ in items], dtype=np.int64)
+    full_vectors = getattr(vectorstore, "full_vectors", None)
+    buffer = VectorBuffer(vectorstore.index.d, directory, capacity=max(len(items), 1))
+    for start in range(0, len(positions), 65536):
+        block = positions[start:start + 65536]
+        if full_vectors is not None:
+            buffer.extend(full_vectors[block])
+        else:
+            buffer.extend(reconstruct_all(vectorstore.index, block))
+    return [doc_id for _, doc_id in items], buffer
+
+
+class Compaction:
+    """
+    Rebuilds an index without its dead positions, in three steps so that only
+    copying runs under the index lock:
+        job = Compaction(vectorstore)   # under the lock: copy live vectors
+        job.build()                     # unlocked: re-add them (the slow part)
+        job.apply(vectorstore)          # under the lock: catch up and swap in
+    IVF-PQ is only compacted from its float32 re-scoring vectors, never by
+    re-adding reconstructed PQ codes.
+    """
+
+    def __init__(self, vectorstore):
+        import faiss
+
+        self.source = vectorstore.index
+        full_vectors = getattr(vectorstore, "full_vectors", None)
+        self.rescore = full_vectors is not None
+        if not uses_tombstones(self.source) and not self.rescore:
+            raise ValueError("Only HNSW indexes and re-scoring vectors leave anything to compact")
+        self.ids, self.buffer = live_vectors(vectorstore, getattr(vectorstore, "buffer_dir", None))
+        self.params = search_params(self.source)
+        # Keeps the trained quantizer / scalar ranges; only the vectors are re-added
+        self.index = faiss.clone_index(self.source)
+        self.index.reset()
+
+    def build(self, block=65536):
+        start_time = time.time()
+        rows = self.buffer.rows
+        for start in range(0, len(rows), block):
+            self.index.add(np.ascontiguousarray(rows[start:start + block]))
+        apply_search_params(self.index, self.params)
+        print(f"[INDEX] Compacted {self.source.ntotal} positions to {len(rows)} in {time.time() - start_time:.2f}s")
+
+    def apply(self, vectorstore):
+        """Swap the new index in, with the chunks added or removed since the copy; False if it was rebuilt"""
+        if vectorstore.index is not self.source:
+            return False
+        current = vectorstore.index_to_docstore_id
+        live = set(current.values())
+        copied = set(self.ids)
+        index_map = {position: doc_id for position, doc_id in enumerate(self.ids) if doc_id in live}
+        if not uses_tombstones(self.index) and len(index_map) < len(self.ids):
+            gone = [position for position, doc_id in enumerate(self.ids) if doc_id not in live]
+            self.index.remove_ids(np.asarray(gone, dtype=np.int64))
+        added = sorted((position, doc_id) for position, doc_id in current.items() if doc_id not in copied)
+        if added:
+            positions = np.asarray([position for position, _ in added], dtype=np.int64)
+            if self.rescore:
+                vectors = np.asarray(vectorstore.full_vectors[positions], dtype=np.float32)
+            else:
+                vectors = reconstruct_all(self.source, positions)
+            start = self.index.ntotal
+            self.index.add(vectors)
+            self.buffer.extend(vectors)
+            index_map.update(zip(range(start, start + len(added)), [doc_id for _, doc_id in added]))
+        vectorstore.index = self.index
+        vectorstore.index_to_docstore_id = index_map
+        if self.rescore:
+            vectorstore.use_vector_buffer(self.buffer)
+        vectorstore.positions_changed()
+        return True
+
+
+class VectorBuffer:
+    """
+    Growable float32 matrix. Capacity doubles, so appends copy O(n) rows in
+    total instead of O(n^2) with np.vstack. Given a directory, the rows live
+    in an anonymous memory-mapped temp file that is extended in place, so the
+    OS pages them instead of the process holding a second copy in RAM.
+    """
+
+    def __init__(self, dim, directory=None, capacity=1024):
+        self.dim = dim
+        self.size = 0
+        self._file = None
+        self._data = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._file = tempfile.TemporaryFile(dir=directory, prefix="vectors-", suffix=".buffer")
+        self._reserve(capacity)
+
+    def _reserve(self, capacity):
+        current = 0 if self._data is None else len(self._data)
+        if capacity <= current:
+            return
+        capacity = max(capacity, 2 * current)
+        if self._file is not None:
+            # Growing the file keeps the rows already written; only the mapping is redone
+            self._file.truncate(capacity * self.dim * 4)
+            self._data = np.memmap(self._file, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        else:
+            data = np.empty((capacity, self.dim), dtype=np.float32)
+            if self._data is not None:
+                data[:self.size] = self._data[:self.size]
+            self._data = data
+
+    @property
+    def rows(self):
+        return self._data[:self.size]
+
+    def truncate(self, size):
+        self.size = min(self.size, size)
+
+    def extend(self, vectors, block=65536):
+        """Append rows (a memmap source is copied a block at a time)"""
+        n = len(vectors)
+        self._reserve(self.size + n)
+        for start in range(0, n, block):
+            part = np.asarray(vectors[start:start + block], dtype=np.float32)
+            self._data[self.size + start:self.size + start + len(part)] = part
+        self.size += n
+
+    def keep(self, positions, block=65536):
+        """Compact in place to the rows at `positions` (ascending)"""
+        positions = np.asarray(positions, dtype=np.int64)
+        # positions[i] >= i, so a block never overwrites rows a later block still reads
+        for start in range(0, len(positions), block):
+            part = positions[start:start + block]
+            self._data[start:start + len(part)] = self._data[part]
+        self.size = len(positions)
+
+
+class RescoringFAISS(FAISS):
+    """
+    FAISS vectorstore that can re-rank with exact distances.
+    When `full_vectors` (float32, one row per index position - usually a
+    read-only memmap) is set, searches over-fetch `rescore_factor * k`
+    candidates from the quantized index and keep the k closest by exact L2.
+    Positions may have gaps: HNSW positions of deleted chunks stay in the
+    graph as tombstones (missing from index_to_docstore_id) and are excluded
+    from every search with an IDSelector.
+    """
+
+    rescore_factor = 4
+    index_path = None   # snapshot file the index is memory-mapped from, if any
+    buffer_dir = None   # where changed full_vectors are paged to (RAM if None)
+    _full_vectors = None
+    _vector_buffer = None
+    _search_params = None
+
+    @property
+    def full_vectors(self):
+        if self._vector_buffer is not None:
+            return self._vector_buffer.rows
+        return self._full_vectors
+
+    @full_vectors.setter
+    def full_vectors(self, value):
+        self._vector_buffer = None
+        self._full_vectors = value
+
+    def use_vector_buffer(self, buffer):
+        self._vector_buffer = buffer
+        self._full_vectors = None
+
+    def positions_changed(self):
+        self._search_params = None
+
+    def search_index(self, query, n):
+        """index.search that skips tombstoned HNSW positions"""
+        import faiss
+
+        index = self.index
+        if not uses_tombstones(index) or index.ntotal == len(self.index_to_docstore_id):
+            return index.search(query, n)
+        if self._search_params is None:
+            live = np.fromiter(self.index_to_docstore_id, dtype=np.int64, count=len(self.index_to_docstore_id))
+            dead = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), live)
+            params = faiss.SearchParametersHNSW()
+            # The selectors are referenced, not owned, by the parameters: keep them alive here
+            params.dead = faiss.IDSelectorBatch(dead)
+            params.sel = params.not_dead = faiss.IDSelectorNot(params.dead)
+            self._search_params = params
+        self._search_params.efSearch = index.hnsw.efSearch
+        return index.search(query, n, params=self._search_params)
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None, **kwargs):
+        """Add (text, vector) pairs at the next free positions (FAISS.add_embeddings assumes no gaps)"""
+        text_embeddings = list(text_embeddings)
+        texts = [text for text, _ in text_embeddings]
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Duplicate ids found in the ids list.")
+        self.docstore.add({
+            doc_id: Document(page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        })
+        add_vectors(self, [vector for _, vector in text_embeddings], ids)
+        return ids
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, fetch_k=20, **kwargs):
+        query = np.asarray([embedding], dtype=np.float32)
+        if self.full_vectors is None or filter is not None:
+            scores, positions = self.search_index(query, k if filter is None else fetch_k)
+            filter_func = self._create_filter_func(filter) if filter is not None else None
+            results = []
+            for score, position in zip(scores[0], positions[0]):
+                if position < 0:
+                    continue
+                doc = self.docstore.search(self.index_to_docstore_id[int(position)])
+                if filter_func is None or filter_func(doc.metadata):
+                    results.append((doc, float(score)))
+            score_threshold = kwargs.get("score_threshold")
+            if score_threshold is not None:
+                results = [(doc, score) for doc, score in results if score <= score_threshold]
+            return results[:k]
+
+        _, positions = self.search_index(query, k * self.rescore_factor)
+        positions = np.sort(positions[0][positions[0] >= 0])   # sorted reads are page-friendly
+        if not len(positions):
+            return []
+
+        exact = ((np.asarray(self.full_vectors[positions]) - query) ** 2).sum(axis=1)
+        results = []
+        for row in np.argsort(exact)[:k]:
+            doc = self.docstore.search(self.index_to_docstore_id[int(positions[row])])
+            results.append((doc, float(exact[row])))
+        return results
+
+    def _buffer(self, extra=0):
+        """Switch full_vectors to a VectorBuffer on their first change"""
+        if self._vector_buffer is None:
+            current = self._full_vectors
+            buffer = VectorBuffer(current.shape[1], self.buffer_dir, capacity=len(current) + extra)
+            buffer.extend(current)
+            self._vector_buffer = buffer
+            self._full_vectors = None
+        return self._vector_buffer
+
+    def put_full_vectors(self, start, vectors):
+        """Write rows for positions start.. (rows past `start` belong to removed positions)"""
+        if self.full_vectors is not None:
+            buffer = self._buffer(len(vectors))
+            buffer.truncate(start)
+            buffer.extend(vectors)
+
+    def keep_full_vectors(self, positions):
+        """Drop every row not in `positions` (ascending index positions)"""
+        if self.full_vectors is not None:
+            self._buffer().keep(positions)
+
+
+def quantization_report(vectors, config, n_queries=200, k=10):
+    """
+    Compare a quantized index against exact search on a sample of the corpus:
+    memory per index and recall@k with and without exact re-scoring.
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(n, min(n_queries, n), replace=False)]
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    index = build_index(vectors, config)
+    _, approx = index.search(queries, k)
+
+    factor = config.get("rescore_factor", 4)
+    _, candidates = index.search(queries, k * factor)
+    rescored = []
+    for query, row in zip(queries, candidates):
+        row = row[row >= 0]
+        dist = ((vectors[row] - query) ** 2).sum(axis=1)
+        rescored.append(row[np.argsort(dist)[:k]])
+
+    def _recall(found):
+        return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+    full_bytes = vectors.nbytes
+    index_bytes = faiss.serialize_index(index).nbytes
+    report = {
+        "index_type": config["index_type"],
+        "storage": config.get("storage", "float32"),
+        "vectors": n,
+        "float32_mb": round(full_bytes / 1e6, 2),
+        "index_mb": round(index_bytes / 1e6, 2),
+        "memory_saved_pct": round(100 * (1 - index_bytes / full_bytes), 1),
+        f"recall@{k}": round(_recall(approx), 4),
+        f"recall@{k}_rescored": round(_recall(rescored), 4),
+    }
+    print(f"[INDEX] Quantization report: {report}")
+    return report
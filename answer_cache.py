@@ -0,0 +1,87 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Answers to recent questions, matched by question-embedding similarity
+    - A hit needs the same LLM, the same retrieval settings, the same index
+      generation (no chunks added or removed since) and cosine >= threshold
+    - Entries expire after `ttl` seconds; beyond `max_entries` the least
+      recently used are dropped
+    Embeddings are expected to be L2-normalised, so dot product == cosine.
+    """
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=512):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> entry
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _purge_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, embedding, model, index_version, settings=None):
+        """Return the closest cached entry above the threshold, or None"""
+        now = time.time()
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._purge_expired(now)
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry["model"] == model and entry["index_version"] == index_version
+                and entry["settings"] == settings
+            ]
+            if candidates:
+                matrix = np.stack([entry["embedding"] for _, entry in candidates])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(entry, similarity=float(scores[best]))
+            self.misses += 1
+            return None
+
+    def store(self, embedding, model, index_version, question, answer, sources, settings=None):
+        with self._lock:
+            self._entries[self._next_key] = {
+                "embedding": np.asarray(embedding, dtype=np.float32),
+                "model": model,
+                "index_version": index_version,
+                "settings": settings,
+                "question": question,
+                "answer": answer,
+                "source_documents": list(sources),
+                "created": time.time(),
+            }
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop everything (the corpus changed)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,381 @@
+"""
+Headless HTTP API for RAGEngine (asyncio + aiohttp).
+
+    python api_server.py --port 8080
+    OLLAMA_BASE_URL=http://127.0.0.1:11435 python api_server.py   # with benchmarks/fake_ollama.py
+
+POST /ingest?namespace=ns        multipart files, or JSON {"files": [{"name", "content_base64"}]}
+POST /query                      {"question", "namespace"?, "model"?, "session_id"?}
+POST /query/stream               same body; NDJSON: sources, token..., done
+GET  /health                     engine/queue state and Ollama reachability
+GET  /metrics                    Prometheus text format
+
+Concurrent queries have their embeddings micro-batched into one encode call.
+Requests beyond --max-concurrent wait in a bounded queue and are rejected with
+503 once it is full; Ollama calls pass through a second, smaller gate.
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+import argparse
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from aiohttp import web, ClientSession, ClientTimeout
+
+from rag_engine import RAGEngine, DEFAULT_NAMESPACE, get_shared_embeddings, warm_up
+from llm_pool import base_url
+from metrics import metrics
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionControl:
+    """At most `max_concurrent` holders; up to `max_queue` more may wait, the rest are refused"""
+
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.active >= self.max_concurrent and self.waiting >= self.max_queue:
+            metrics.inc("api_rejected", gate=self.name)
+            raise Overloaded(f"{self.name} queue is full ({self.max_queue} waiting)")
+        self.waiting += 1
+        metrics.set_gauge("api_queue_depth", self.waiting, gate=self.name)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("api_queue_depth", self.waiting, gate=self.name)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def state(self):
+        return {"active": self.active, "waiting": self.waiting,
+                "max_concurrent": self.max_concurrent, "max_queue": self.max_queue}
+
+
+class EmbeddingBatcher:
+    """
+    Collects query embeddings from concurrent requests for up to `max_wait`
+    seconds (or `max_batch` texts) and encodes them in one call.
+    """
+
+    def __init__(self, embeddings, max_batch=32, max_wait=0.005):
+        self.embeddings = embeddings
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    async def __call__(self, text):
+        if self._worker is None:
+            self._worker = asyncio.ensure_future(self._run())
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(None, self.embeddings.embed_queries, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            metrics.inc("api_embed_batches")
+            metrics.inc("api_embed_texts", len(texts))
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+
+
+class _Upload:
+    """The bits of Streamlit's UploadedFile that RAGEngine uses"""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+        self.size = len(data)
+
+    def getvalue(self):
+        return self._data
+
+
+def _source_summary(doc):
+    return {
+        "source": doc.metadata.get("source"),
+        "page": doc.metadata.get("page"),
+        "sheet": doc.metadata.get("sheet"),
+        "rows": doc.metadata.get("rows"),
+        "preview": doc.page_content[:200],
+    }
+
+
+class RAGService:
+    def __init__(self, args):
+        self.args = args
+        self.engines = {}                 # (namespace, model) -> RAGEngine
+        self.sessions = OrderedDict()     # session id -> ChatMemory
+        self.queries = None
+        self.ingests = None
+        self.ollama_gate = None
+        self.batcher = None
+        self._engine_lock = None
+        self._ingest_locks = {}
+
+    async def start(self, app):
+        # Created inside the running loop (asyncio primitives bind to it on 3.8/3.9)
+        self.queries = AdmissionControl("query", self.args.max_concurrent, self.args.max_queue)
+        self.ingests = AdmissionControl("ingest", 1, self.args.max_ingest_queue)
+        self.ollama_gate = AdmissionControl("ollama", self.args.ollama_parallel, self.args.ollama_queue)
+        self._engine_lock = asyncio.Lock()
+        loop = asyncio.get_event_loop()
+        self.batcher = EmbeddingBatcher(
+            await loop.run_in_executor(None, get_shared_embeddings),
+            max_batch=self.args.max_batch, max_wait=self.args.batch_wait_ms / 1000
+        )
+        loop.run_in_executor(None, lambda: warm_up(DEFAULT_NAMESPACE, model=self.args.model))
+
+    async def stop(self, app):
+        if self.batcher:
+            self.batcher.stop()
+
+    async def engine(self, namespace, model):
+        key = (namespace, model)
+        async with self._engine_lock:
+            if key not in self.engines:
+                loop = asyncio.get_event_loop()
+                self.engines[key] = await loop.run_in_executor(
+                    None, lambda: RAGEngine(model=model, namespace=namespace)
+                )
+            engine = self.engines[key]
+        if engine.vectorstore and engine.llm is None:
+            # Documents were ingested through another engine on this namespace
+            await asyncio.get_event_loop().run_in_executor(None, engine.setup_chain)
+        return engine
+
+    def session_memory(self, engine, session_id):
+        if not session_id:
+            return None
+        memory = self.sessions.get(session_id)
+        if memory is None:
+            memory = engine._new_memory(engine.memory_strategy)
+            self.sessions[session_id] = memory
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.args.max_sessions:
+            self.sessions.popitem(last=False)
+        return memory
+
+    # -- handlers --------------------------------------------------------
+
+    async def health(self, request):
+        reachable = False
+        try:
+            async with ClientSession(timeout=ClientTimeout(total=1)) as session:
+                async with session.get(f"{base_url()}/api/version") as response:
+                    reachable = response.status == 200
+        except Exception:
+            pass
+        return web.json_response({
+            "status": "ok" if reachable else "degraded",
+            "ollama": {"url": base_url(), "reachable": reachable},
+            "engines": [{"namespace": ns, "model": model, "files": len(engine.indexed_files())}
+                        for (ns, model), engine in self.engines.items()],
+            "sessions": len(self.sessions),
+            "queries": self.queries.state(),
+            "ollama_gate": self.ollama_gate.state(),
+            "ingests": self.ingests.state(),
+        })
+
+    async def metrics_text(self, request):
+        return web.Response(text=metrics.prometheus_text(), content_type="text/plain",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def ingest(self, request):
+        namespace = request.query.get("namespace", DEFAULT_NAMESPACE)
+        uploads = []
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    uploads.append(_Upload(part.filename, await part.read(decode=False)))
+            namespace = request.query.get("namespace", namespace)
+        else:
+            body = await request.json()
+            namespace = body.get("namespace", namespace)
+            for item in body.get("files", []):
+                uploads.append(_Upload(item["name"], base64.b64decode(item["content_base64"])))
+        if not uploads:
+            return web.json_response({"error": "no files"}, status=400)
+
+        engine = await self.engine(namespace, self.args.model)
+        lock = self._ingest_locks.setdefault(namespace, asyncio.Lock())
+        async with self.ingests.slot(), lock:
+            result = await asyncio.get_event_loop().run_in_executor(None, self._ingest_sync, engine, uploads)
+        return web.json_response(dict(result, namespace=namespace))
+
+    @staticmethod
+    def _ingest_sync(engine, uploads):
+        start_time = time.time()
+        new_files = [u for u in uploads if not engine.is_file_indexed(u.name, engine.file_fingerprint(u))]
+        large_files = [u for u in new_files if engine.should_stream(u)]
+        small_files = [u for u in new_files if u not in large_files]
+        chunks, errors = engine.process_uploaded_files(small_files) if small_files else ([], {})
+        if chunks:
+            engine.update_vectorstore(chunks)
+        streamed = 0
+        for upload in large_files:
+            try:
+                streamed += engine.ingest_file_streaming(upload)
+            except Exception as e:
+                errors[upload.name] = str(e)
+        if engine.vectorstore and engine.llm is None:
+            engine.setup_chain()
+        return {
+            "files": len(new_files) - len(errors),
+            "skipped": [u.name for u in uploads if u not in new_files],
+            "chunks": len(chunks) + streamed,
+            "errors": errors,
+            "seconds": round(time.time() - start_time, 3),
+        }
+
+    async def _query_args(self, request):
+        body = await request.json()
+        question = (body.get("question") or "").strip()
+        if not question:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "question is required"}),
+                                     content_type="application/json")
+        engine = await self.engine(body.get("namespace", DEFAULT_NAMESPACE), body.get("model", self.args.model))
+        if engine.llm is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": "no documents in this namespace"}),
+                                   content_type="application/json")
+        return engine, question, self.session_memory(engine, body.get("session_id"))
+
+    async def query(self, request):
+        engine, question, memory = await self._query_args(request)
+        async with self.queries.slot():
+            result = await engine.aask_question(
+                question, memory=memory, embedder=self.batcher, llm_gate=self.ollama_gate.slot
+            )
+        return web.json_response({
+            "answer": result["answer"],
+            "cached": result["cached"],
+            "sources": [_source_summary(doc) for doc in result["source_documents"]],
+            "trace": result["trace"],
+        })
+
+    async def query_stream(self, request):
+        engine, question, memory = await self._query_args(request)
+        async with self.queries.slot():
+            result = await engine.aask_question_stream(
+                question, memory=memory, embedder=self.batcher, llm_gate=self.ollama_gate.slot
+            )
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+
+            async def _send(payload):
+                await response.write((json.dumps(payload) + "\n").encode("utf-8"))
+
+            await _send({"type": "sources", "cached": result["cached"],
+                         "sources": [_source_summary(doc) for doc in result["source_documents"]]})
+            try:
+                async for token in result["answer_stream"]:
+                    await _send({"type": "token", "text": token})
+            except Overloaded as e:
+                await _send({"type": "error", "error": str(e)})
+            else:
+                await _send({"type": "done"})
+            await response.write_eof()
+            return response
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Overloaded as e:
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": "1"})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        print(f"[API] {request.method} {request.path} failed: {e}")
+        return web.json_response({"error": "internal error"}, status=500)
+
+
+def create_app(args):
+    service = RAGService(args)
+    app = web.Application(middlewares=[error_middleware], client_max_size=args.max_upload_mb * 1024 * 1024)
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    app.router.add_get("/health", service.health)
+    app.router.add_get("/metrics", service.metrics_text)
+    app.router.add_post("/ingest", service.ingest)
+    app.router.add_post("/query", service.query)
+    app.router.add_post("/query/stream", service.query_stream)
+    app["service"] = service
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RAGEngine HTTP API")
+    parser.add_argument("--host", default=os.getenv("RAG_API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RAG_API_PORT", "8080")))
+    parser.add_argument("--model", default=os.getenv("RAG_API_MODEL", "qwen2.5:7b"))
+    parser.add_argument("--max-concurrent", type=int, default=int(os.getenv("RAG_API_MAX_CONCURRENT", "8")),
+                        help="queries processed at once")
+    parser.add_argument("--max-queue", type=int, default=int(os.getenv("RAG_API_MAX_QUEUE", "32")),
+                        help="queries allowed to wait before 503")
+    parser.add_argument("--ollama-parallel", type=int, default=int(os.getenv("OLLAMA_NUM_PARALLEL", "2")),
+                        help="concurrent generations sent to Ollama")
+    parser.add_argument("--ollama-queue", type=int, default=int(os.getenv("RAG_API_OLLAMA_QUEUE", "16")))
+    parser.add_argument("--max-ingest-queue", type=int, default=4)
+    parser.add_argument("--max-batch", type=int, default=32, help="query embeddings per encode call")
+    parser.add_argument("--batch-wait-ms", type=float, default=5.0, help="how long to gather a batch")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--max-upload-mb", type=int, default=200)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    print(f"[API] Serving on http://{args.host}:{args.port} (Ollama: {base_url()})")
+    web.run_app(create_app(args), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import streamlit as st
 import os
-from rag_engine import RAGEngine
+import secrets
+import threading
+from rag_engine import RAGEngine, warm_up, namespace_dir, DEFAULT_NAMESPACE, CONDENSE_STRATEGIES, MEMORY_STRATEGIES
+from metrics import metrics
+from llm_pool import warm_up_model_async, warm_state
+from ingest_jobs import get_ingest_queue
 import time
 
 FORMAT_ICONS = {
@@ -17,6 +22,72 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    """Runs once per server process: load the embedder, saved index and default model in the background"""
+    thread = threading.Thread(target=warm_up, kwargs={"model": "qwen2.5:7b"}, name="rag-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+start_warm_up()
+
+
+JOB_ICONS = {'queued': '🕒', 'running': '⏳', 'done': '✅', 'failed': '❌', 'cancelled': '⏹️'}
+
+
+def _ingest_jobs_panel():
+    """This workspace's recent ingest jobs with per-file progress"""
+    queue = get_ingest_queue()
+    jobs = queue.jobs(st.session_state.workspace, limit=3)
+    active_ids = {job["id"] for job in jobs if job["status"] in ("queued", "running")}
+    
+    for job in jobs:
+        files = job["files"]
+        finished = sum(f["status"] not in ("queued", "running") for f in files)
+        chunks = sum(f["chunks"] for f in files)
+        st.caption(f"{JOB_ICONS.get(job['status'], '🔎')} Job {job['id'][:6]}: {job['status']} "
+                   f"({finished}/{len(files)} files, {chunks} chunks)")
+        if job["id"] in active_ids:
+            st.progress(finished / len(files) if files else 0.0)
+            for f in files:
+                if f["status"] == "running":
+                    st.caption(f"⏳ {f['name']}: {f['chunks']} chunks indexed")
+            if st.button("⏹️ Cancel", key=f"cancel_{job['id']}"):
+                queue.cancel(job["id"])
+        for f in files:
+            if f["status"] == "failed":
+                st.caption(f"⚠️ {f['name']}: {f['error']}")
+    
+    # Refresh the whole page when a job ends or the first chunks become searchable
+    engine = st.session_state.rag_engine
+    finished_jobs = st.session_state.get("active_jobs", set()) - active_ids
+    first_chunks = engine is not None and engine.llm is None and engine.vectorstore
+    st.session_state.active_jobs = active_ids
+    if finished_jobs or first_chunks:
+        st.rerun()
+
+
+def show_ingest_jobs():
+    """Jobs panel, polled every 2s while a job is active (or refreshed by hand on old Streamlit)"""
+    active = bool(get_ingest_queue().active(st.session_state.workspace))
+    fragment = getattr(st, "fragment", None)
+    if fragment is None:
+        _ingest_jobs_panel()
+        if active:
+            st.button("🔄 Refresh progress")
+        return
+    fragment(run_every=2 if active else None)(_ingest_jobs_panel)()
+
+
+def source_location(metadata):
+    """Where a cited chunk comes from: a page, or a sheet's row range for spreadsheets"""
+    if metadata.get('rows'):
+        sheet = f"Sheet: {metadata['sheet']}, " if metadata.get('sheet') else ""
+        return f"{sheet}Rows: {metadata['rows']}"
+    return f"Page: {metadata.get('page', 'N/A')}"
+
 st.markdown("""
 <style>
     .main-header {
@@ -62,6 +133,35 @@ if 'processed_files' not in st.session_state:
     st.session_state.processed_files = []
 if 'current_model' not in st.session_state:
     st.session_state.current_model = "qwen2.5:7b"
+if 'condense_strategy' not in st.session_state:
+    st.session_state.condense_strategy = "llm"
+if 'memory_strategy' not in st.session_state:
+    st.session_state.memory_strategy = "window"
+if 'workspace' not in st.session_state:
+    # Sessions share the default (pre-warmed) index; a private workspace is opt-in
+    # and kept in the URL so a refresh reopens it
+    st.session_state.workspace = st.query_params.get("workspace") or DEFAULT_NAMESPACE
+
+# A warm server already holds the saved index - make new sessions queryable at once
+if st.session_state.rag_engine is None and os.path.exists(namespace_dir(st.session_state.workspace)):
+    engine = RAGEngine(
+        model=st.session_state.current_model,
+        namespace=st.session_state.workspace,
+        condense_strategy=st.session_state.condense_strategy,
+        memory_strategy=st.session_state.memory_strategy
+    )
+    if engine.llm is not None:
+        st.session_state.rag_engine = engine
+        st.session_state.document_processed = True
+        st.session_state.processed_files = engine.indexed_files()
+
+# Background ingest jobs fill the shared index while sessions keep running:
+# chat opens with the first indexed chunks and the file list follows along
+if st.session_state.rag_engine is not None and st.session_state.rag_engine.vectorstore:
+    if st.session_state.rag_engine.llm is None:
+        st.session_state.rag_engine.setup_chain()
+    st.session_state.document_processed = True
+    st.session_state.processed_files = st.session_state.rag_engine.indexed_files()
 
 st.markdown('<h1 class="main-header">🚀 TTZ.KT AI Platform 2025</h1>', unsafe_allow_html=True)
 st.markdown("### *Multi-Format Document Assistant - Your Models*")
@@ -74,6 +174,30 @@ with st.sidebar:
     st.success("✅ Ollama Local")
     st.caption("🔗 http://localhost:11434")
     
+    workspace = st.text_input(
+        "🗂️ Workspace",
+        value=st.session_state.workspace,
+        help="Documents are indexed per workspace. Reuse a name to reopen its files. "
+             "Anyone who knows a workspace name can open its documents."
+    ).strip()
+    if st.button("🆕 New private workspace", help="Start an empty workspace under a random name"):
+        workspace = secrets.token_urlsafe(16)
+    if workspace and workspace != st.session_state.workspace:
+        try:
+            namespace_dir(workspace)
+            st.session_state.workspace = workspace
+            if workspace == DEFAULT_NAMESPACE:
+                st.query_params.pop("workspace", None)
+            else:
+                st.query_params["workspace"] = workspace
+            st.session_state.rag_engine = None
+            st.session_state.chat_history = []
+            st.session_state.document_processed = False
+            st.session_state.processed_files = []
+            st.rerun()
+        except ValueError as e:
+            st.error(f"⚠️ {str(e)}")
+    
     st.markdown("---")
     
     st.subheader("🤖 Select AI Model")
@@ -132,6 +256,8 @@ with st.sidebar:
     )
     
     selected_model = all_models[selected_model_idx]
+    # Start loading the model in Ollama as soon as it is picked, so Switch is instant
+    warm_up_model_async(selected_model)
     
     model_info = {
         "qwen3": "🌟 Latest Qwen 3 (2025)",
@@ -154,6 +280,49 @@ with st.sidebar:
             break
     
     st.markdown(f'<div class="model-info">📌 {info_text}</div>', unsafe_allow_html=True)
+    load_state = warm_state(selected_model) or {}
+    if load_state.get("status") == "loading":
+        st.caption("⏳ Loading model in Ollama...")
+    elif load_state.get("status") == "ready":
+        st.caption(f"✅ Model loaded ({load_state['seconds']:.1f}s)")
+    elif load_state.get("status") == "error":
+        st.caption(f"⚠️ Could not load model: {load_state['error']}")
+    
+    condense_labels = {
+        "llm": "Full model rewrite (most accurate)",
+        "fast_llm": "Small model rewrite",
+        "concat": "Recent turns, no rewrite (fastest)",
+        "none": "Question as typed"
+    }
+    condense_strategy = st.selectbox(
+        "💬 Follow-up questions",
+        CONDENSE_STRATEGIES,
+        index=CONDENSE_STRATEGIES.index(st.session_state.condense_strategy),
+        format_func=lambda key: condense_labels[key],
+        help="How follow-ups are turned into a search query. Skipped on the first question."
+    )
+    if condense_strategy != st.session_state.condense_strategy:
+        st.session_state.condense_strategy = condense_strategy
+        if st.session_state.rag_engine:
+            st.session_state.rag_engine.set_condense_strategy(condense_strategy)
+    
+    memory_labels = {
+        "window": "Last few turns",
+        "tokens": "Recent turns within a token cap",
+        "summary": "Recent turns + running summary",
+        "buffer": "Entire conversation (slows down over time)"
+    }
+    memory_strategy = st.selectbox(
+        "🧠 Conversation memory",
+        MEMORY_STRATEGIES,
+        index=MEMORY_STRATEGIES.index(st.session_state.memory_strategy),
+        format_func=lambda key: memory_labels[key],
+        help="How much chat history follow-ups can refer to. Summaries are updated in the background."
+    )
+    if memory_strategy != st.session_state.memory_strategy:
+        st.session_state.memory_strategy = memory_strategy
+        if st.session_state.rag_engine:
+            st.session_state.rag_engine.set_memory_strategy(memory_strategy)
     
     if st.session_state.rag_engine and selected_model != st.session_state.current_model:
         if st.button("🔄 Switch Model", type="secondary"):
@@ -212,63 +381,37 @@ with st.sidebar:
         st.caption(f"**Total: {total_size:.1f} KB**")
         
         if st.button("🚀 Process All Files", type="primary"):
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
             try:
-                status_text.text("Initializing RAG Engine...")
-                progress_bar.progress(0.1)
-                
                 if not st.session_state.rag_engine:
-                    st.session_state.rag_engine = RAGEngine(model=selected_model)
+                    with st.spinner("Initializing RAG Engine..."):
+                        st.session_state.rag_engine = RAGEngine(
+                            model=selected_model,
+                            namespace=st.session_state.workspace,
+                            condense_strategy=st.session_state.condense_strategy,
+                            memory_strategy=st.session_state.memory_strategy
+                        )
                     st.session_state.current_model = selected_model
                 
-                status_text.text("Processing files...")
-                progress_bar.progress(0.2)
-                
-                all_chunks = []
-                for idx, uploaded_file in enumerate(uploaded_files):
-                    file_name = uploaded_file.name
-                    status_text.text(f"Processing {file_name}... ({idx+1}/{len(uploaded_files)})")
-                    progress_bar.progress(0.2 + (idx + 1) / len(uploaded_files) * 0.5)
-                    
-                    try:
-                        chunks = st.session_state.rag_engine.process_uploaded_file(uploaded_file)
-                        all_chunks.extend(chunks)
-                    except Exception as e:
-                        st.warning(f"⚠️ {file_name}: {str(e)}")
-                        continue
-                
-                if not all_chunks:
-                    st.error("❌ No content extracted")
-                    progress_bar.empty()
-                    status_text.empty()
-                    st.stop()
-                
-                status_text.text("Creating vectorstore...")
-                progress_bar.progress(0.75)
-                st.session_state.rag_engine.create_vectorstore(all_chunks)
-                
-                status_text.text("Setting up AI chain...")
-                progress_bar.progress(0.9)
-                st.session_state.rag_engine.setup_chain()
-                
-                progress_bar.progress(1.0)
-                status_text.text("✅ Complete!")
-                
-                st.session_state.document_processed = True
-                st.session_state.processed_files = [f.name for f in uploaded_files]
+                engine = st.session_state.rag_engine
                 
-                st.success(f"✅ Processed {len(uploaded_files)} file(s)!")
-                st.info(f"📊 {len(all_chunks)} chunks | 🤖 {selected_model}")
+                # Unchanged files are already embedded - skip them
+                pending_files = [
+                    f for f in uploaded_files
+                    if not engine.is_file_indexed(f.name, engine.file_fingerprint(f))
+                ]
+                skipped = len(uploaded_files) - len(pending_files)
                 
-                time.sleep(1)
-                st.rerun()
+                if pending_files:
+                    # Ingestion runs in the server's background worker; the page stays usable
+                    get_ingest_queue().submit(st.session_state.workspace, pending_files, model=selected_model)
+                    st.success(f"📥 Queued {len(pending_files)} file(s), {skipped} unchanged")
+                else:
+                    st.info(f"✅ All {skipped} file(s) already indexed")
                 
             except Exception as e:
                 st.error(f"Error: {str(e)}")
-                progress_bar.empty()
-                status_text.empty()
+    
+    show_ingest_jobs()
     
     st.markdown("---")
     
@@ -284,24 +427,66 @@ with st.sidebar:
                 for file in st.session_state.processed_files:
                     ext = file.split('.')[-1].lower()
                     icon = FORMAT_ICONS.get(ext, '🔎')
-                    st.caption(f"{icon} {file}")
+                    file_col, remove_col = st.columns([4, 1])
+                    file_col.caption(f"{icon} {file}")
+                    if remove_col.button("✖", key=f"remove_{file}", help=f"Remove {file}"):
+                        st.session_state.rag_engine.remove_source(file)
+                        st.session_state.processed_files = st.session_state.rag_engine.indexed_files()
+                        st.rerun()
         else:
             st.warning("🟡 No files")
         
         st.info(f"💬 {len(st.session_state.chat_history)} messages")
+        
+        for strategy, latency in st.session_state.rag_engine.condense_latency().items():
+            st.caption(f"✏️ Condense ({strategy}): {latency['avg_seconds']:.2f}s avg over {latency['calls']}")
+        
+        for retriever, latency in st.session_state.rag_engine.retrieval_latency().items():
+            st.caption(f"🔎 Search ({retriever}): {latency['avg_seconds'] * 1000:.0f}ms avg over {latency['calls']}")
+        
+        cache_stats = st.session_state.rag_engine.answer_cache_stats()
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        if lookups:
+            st.caption(f"⚡ Answer cache: {cache_stats['hits']}/{lookups} hits ({cache_stats['hit_rate']:.0%})")
+        
+        last_query = st.session_state.rag_engine.last_trace
+        if last_query:
+            with st.expander(f"⏱️ Last query: {last_query['seconds']:.2f}s", expanded=False):
+                averages = metrics.stage_summary("query")
+                for stage in last_query["stages"]:
+                    average = averages.get(stage["stage"], {}).get("avg_seconds", 0)
+                    st.caption(f"{stage['stage']}: {stage['seconds'] * 1000:.0f}ms (avg {average * 1000:.0f}ms)")
+                if "prompt_tokens" in last_query:
+                    st.caption(f"🧮 {last_query['prompt_tokens']} prompt tokens, "
+                               f"{last_query.get('packed_chunks', 0)}/{last_query.get('retrieved_chunks', 0)} chunks used")
+                ingest = metrics.stage_summary("ingest")
+                if ingest:
+                    st.caption("📥 Ingest: " + ", ".join(
+                        f"{stage} {entry['avg_seconds']:.2f}s" for stage, entry in ingest.items()
+                    ))
+                st.download_button(
+                    "📈 Prometheus metrics",
+                    metrics.prometheus_text(),
+                    file_name="rag_metrics.prom",
+                    mime="text/plain"
+                )
     else:
         st.error("🔴 Offline")
     
     if st.session_state.document_processed:
         st.markdown("---")
         if st.button("🔄 Reset", type="secondary"):
-            st.session_state.chat_history = []
-            st.session_state.document_processed = False
-            st.session_state.processed_files = []
-            if st.session_state.rag_engine:
-                st.session_state.rag_engine.clear_documents()
-                st.session_state.rag_engine = None
-            st.rerun()
+            # Wait for the background worker to leave this workspace before clearing it
+            if not get_ingest_queue().cancel_namespace(st.session_state.workspace):
+                st.warning("⏳ An upload is still stopping - try Reset again in a moment")
+            else:
+                st.session_state.chat_history = []
+                st.session_state.document_processed = False
+                st.session_state.processed_files = []
+                if st.session_state.rag_engine:
+                    st.session_state.rag_engine.clear_documents()
+                    st.session_state.rag_engine = None
+                st.rerun()
 
 if not st.session_state.document_processed:
     st.info("👈 Upload files to start")
@@ -351,6 +536,8 @@ if not st.session_state.document_processed:
         """)
 else:
     st.info(f"🤖 **{st.session_state.current_model}** | {len(st.session_state.processed_files)} file(s) | 💾 Local")
+    if get_ingest_queue().active(st.session_state.workspace):
+        st.caption("📥 Still indexing - answers use the chunks indexed so far")
     
     for message in st.session_state.chat_history:
         with st.chat_message(message["role"]):
@@ -359,10 +546,9 @@ else:
                 with st.expander("📚 Sources"):
                     for idx, source in enumerate(message["sources"], 1):
                         source_file = source.metadata.get('source', 'Unknown')
-                        source_page = source.metadata.get('page', 'N/A')
                         file_ext = source_file.split('.')[-1].lower() if '.' in source_file else ''
                         icon = FORMAT_ICONS.get(file_ext, '🔎')
-                        st.caption(f"**{idx}.** {icon} {source_file} (Page: {source_page})")
+                        st.caption(f"**{idx}.** {icon} {source_file} ({source_location(source.metadata)})")
                         st.caption(f"_{source.page_content[:200]}..._")
     
     if prompt := st.chat_input("Ask about your files..."):
@@ -375,31 +561,31 @@ else:
             st.markdown(prompt)
         
         with st.chat_message("assistant"):
-            with st.spinner(f"🤔 {st.session_state.current_model} thinking..."):
-                try:
-                    response = st.session_state.rag_engine.ask_question(prompt)
-                    
-                    st.markdown(response["answer"])
-                    
-                    sources = response.get("source_documents", [])
-                    if sources:
-                        with st.expander("📚 Sources"):
-                            for idx, source in enumerate(sources, 1):
-                                source_file = source.metadata.get('source', 'Unknown')
-                                source_page = source.metadata.get('page', 'N/A')
-                                file_ext = source_file.split('.')[-1].lower() if '.' in source_file else ''
-                                icon = FORMAT_ICONS.get(file_ext, '🔎')
-                                st.caption(f"**{idx}.** {icon} {source_file} (Page: {source_page})")
-                                st.caption(f"_{source.page_content[:200]}..._")
-                    
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": response["answer"],
-                        "sources": sources
-                    })
-                    
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+            try:
+                with st.spinner(f"🤔 {st.session_state.current_model} thinking..."):
+                    response = st.session_state.rag_engine.ask_question_stream(prompt)
+                
+                # Tokens render as Ollama produces them
+                answer = st.write_stream(response["answer_stream"])
+                
+                sources = response.get("source_documents", [])
+                if sources:
+                    with st.expander("📚 Sources"):
+                        for idx, source in enumerate(sources, 1):
+                            source_file = source.metadata.get('source', 'Unknown')
+                            file_ext = source_file.split('.')[-1].lower() if '.' in source_file else ''
+                            icon = FORMAT_ICONS.get(file_ext, '🔎')
+                            st.caption(f"**{idx}.** {icon} {source_file} ({source_location(source.metadata)})")
+                            st.caption(f"_{source.page_content[:200]}..._")
+                
+                st.session_state.chat_history.append({
+                    "role": "assistant",
+                    "content": answer,
+                    "sources": sources
+                })
+                
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
 
 st.markdown("---")
 col1, col2, col3 = st.columns(3)
@@ -0,0 +1,220 @@
+"""
+Answer a whole question file against an indexed namespace, without the UI.
+
+    python batch_qa.py checklist.csv --namespace support --output answers.jsonl
+    python batch_qa.py questions.jsonl --concurrency 4        # re-run to resume
+
+Questions come from CSV (a "question" column, else the first column; optional
+"id") or JSONL (objects with "question"/"id", or plain strings). Questions
+without an id get one from a hash of their text, so edits elsewhere in the
+file do not change which answers a resumed run skips. All questions
+are embedded in one batched pass and retrieved up front; generation then runs
+with bounded concurrency against Ollama. Every answer is appended to the
+output JSONL as soon as it arrives, and that file is the checkpoint: ids
+already answered there are skipped on the next run.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from rag_engine import RAGEngine, DEFAULT_NAMESPACE
+
+
+def question_id(text, seen):
+    """Stable id for a question without one: a hash of its text, numbered on repeats"""
+    qid = "q-" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    seen[qid] = seen.get(qid, 0) + 1
+    return qid if seen[qid] == 1 else f"{qid}-{seen[qid]}"
+
+
+def read_questions(path, question_column="question", id_column="id"):
+    """[(id, question)] in file order"""
+    rows = []
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            if not reader.fieldnames:
+                raise ValueError(f"{path} is empty; expected a header row with a '{question_column}' column")
+            column = question_column if question_column in reader.fieldnames else reader.fieldnames[0]
+            for row in reader:
+                rows.append((row.get(id_column), row.get(column)))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                if isinstance(item, str):
+                    item = {"question": item}
+                rows.append((item.get(id_column), item.get(question_column)))
+
+    questions = []
+    ids = set()
+    seen = {}
+    for qid, text in rows:
+        text = (text or "").strip()
+        if not text:
+            continue
+        qid = str(qid).strip() if qid not in (None, "") else question_id(text, seen)
+        if qid in ids:
+            raise ValueError(f"{path}: duplicate question id '{qid}'")
+        ids.add(qid)
+        questions.append((qid, text))
+    return questions
+
+
+def answered_ids(output_path):
+    """Ids with a successful answer in an earlier (possibly interrupted) run"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue   # half-written last line of a killed run
+            if "error" not in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def _sources(docs):
+    return [
+        {"source": doc.metadata.get("source"), "page": doc.metadata.get("page"),
+         "rows": doc.metadata.get("rows"), "preview": doc.page_content[:200]}
+        for doc in docs
+    ]
+
+
+def run_batch(engine, questions, output_path, concurrency=2, embed_batch=256):
+    """Answer `questions` ([(id, text)]), appending JSONL records; returns a summary dict"""
+    start_time = time.time()
+    done = answered_ids(output_path)
+    pending = [(qid, text) for qid, text in questions if qid not in done]
+    print(f"[BATCH] {len(questions)} questions, {len(done)} already answered, {len(pending)} to go")
+    summary = {"questions": len(questions), "skipped": len(questions) - len(pending),
+               "answered": 0, "cached": 0, "errors": 0}
+    if not pending:
+        return dict(summary, seconds=0.0, questions_per_minute=0.0)
+
+    # 1) One batched embedding pass for every question
+    embed_start = time.time()
+    texts = [text for _, text in pending]
+    embeddings = []
+    for start in range(0, len(texts), embed_batch):
+        embeddings.extend(engine.embeddings.embed_queries(texts[start:start + embed_batch]))
+    summary["embed_seconds"] = round(time.time() - embed_start, 3)
+    print(f"[BATCH] Embedded {len(texts)} questions in {summary['embed_seconds']:.2f}s")
+
+    # 2) Cache lookup + retrieval + prompt for all of them (CPU only, no LLM yet)
+    retrieve_start = time.time()
+    queries = []
+    for (qid, text), embedding in zip(pending, embeddings):
+        query_start = time.time()
+        query = engine._query_context(text, text, embedding, query_start)
+        queries.append((qid, text, query))
+    summary["retrieve_seconds"] = round(time.time() - retrieve_start, 3)
+    print(f"[BATCH] Retrieved context for {len(queries)} questions in {summary['retrieve_seconds']:.2f}s")
+
+    # 3) Generation with bounded concurrency; each answer is checkpointed on arrival
+    write_lock = threading.Lock()
+    out = open(output_path, "a", encoding="utf-8")
+
+    def _answer(qid, text, query):
+        llm_start = time.time()
+        if query["cached"]:
+            answer = query["cached"]["answer"]
+        else:
+            answer = engine.llm.invoke(query["prompt"]).content
+            engine._remember_answer(query, answer)
+        return {
+            "id": qid,
+            "question": text,
+            "answer": answer,
+            "sources": _sources(query["source_documents"]),
+            "cached": bool(query["cached"]),
+            "retrieval_ms": round(query["retrieval_time"] * 1000, 1),
+            "llm_ms": round((time.time() - llm_start) * 1000, 1),
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(_answer, qid, text, query): (qid, text) for qid, text, query in queries}
+            for n, future in enumerate(as_completed(futures), 1):
+                qid, text = futures[future]
+                try:
+                    record = future.result()
+                    summary["answered"] += 1
+                    summary["cached"] += record["cached"]
+                except Exception as e:
+                    record = {
+                        "id": qid,
+                        "question": text,
+                        "error": f"{type(e).__name__}: {e}",
+                        "error_type": type(e).__name__,
+                        "traceback": traceback.format_exc(),
+                    }
+                    summary["errors"] += 1
+                    print(f"[BATCH] Question {qid} failed: {record['error']}")
+                with write_lock:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                if n % 10 == 0 or n == len(futures):
+                    elapsed = time.time() - start_time
+                    print(f"[BATCH] {n}/{len(futures)} done, {n / elapsed * 60:.1f} questions/min")
+    finally:
+        out.close()
+
+    elapsed = time.time() - start_time
+    summary["seconds"] = round(elapsed, 2)
+    summary["questions_per_minute"] = round(summary["answered"] / elapsed * 60, 2) if elapsed else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch question answering over an indexed namespace")
+    parser.add_argument("questions", help="CSV or JSONL question file")
+    parser.add_argument("--output", help="answers JSONL (default: <questions>.answers.jsonl)")
+    parser.add_argument("--namespace", default=DEFAULT_NAMESPACE)
+    parser.add_argument("--model", default="qwen2.5:7b")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("OLLAMA_NUM_PARALLEL", "2")),
+                        help="generations in flight against Ollama")
+    parser.add_argument("--question-column", default="question")
+    parser.add_argument("--id-column", default="id")
+    parser.add_argument("--restart", action="store_true", help="ignore earlier answers in the output file")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.questions)[0] + ".answers.jsonl"
+    if args.restart and os.path.exists(output):
+        os.unlink(output)
+
+    try:
+        questions = read_questions(args.questions, args.question_column, args.id_column)
+    except ValueError as e:
+        print(f"[BATCH] {e}")
+        sys.exit(1)
+    if not questions:
+        print("[BATCH] No questions found")
+        sys.exit(1)
+
+    engine = RAGEngine(model=args.model, namespace=args.namespace, condense_strategy="none")
+    if engine.llm is None:
+        print(f"[BATCH] Namespace '{args.namespace}' has no indexed documents")
+        sys.exit(1)
+
+    summary = run_batch(engine, questions, output, concurrency=args.concurrency)
+    print(json.dumps(summary, indent=2))
+    print(f"[BATCH] Answers written to {output}")
+
+
+if __name__ == "__main__":
+    main()
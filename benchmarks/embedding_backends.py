@@ -0,0 +1,160 @@
+"""
+Throughput and parity of the embedding backends (embedders.py) on a mix of
+short CSV-like rows, paragraphs and full 1200-character chunks:
+
+    python benchmarks/embedding_backends.py --output embed.json
+    python benchmarks/embedding_backends.py --backends hf torch onnx onnx-int8 --texts 5000
+    python benchmarks/embedding_backends.py --backends onnx-int8 --workers 1 2 4 8
+
+The first backend is the reference: every other one reports its speedup and
+how closely its vectors match (cosine per text, and overlap of the top-10
+neighbours of sample queries). --workers adds a scaling table for the first
+backend sharded over that many processes (RAG_EMBED_WORKERS).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_corpus import make_records  # noqa: E402
+from embedders import EMBEDDER_BACKENDS, backend_name, create_embedder  # noqa: E402
+
+
+def make_texts(count, seed=13):
+    """Thirds of CSV rows (~70 chars), paragraphs (~250) and chunks (~1200), shuffled"""
+    rng = random.Random(seed)
+    records = make_records(rng, count)
+    texts = []
+    for n, r in enumerate(records):
+        row = f"{r['part']} | {r['name']} | {r['owner']} | {r['status']} | {r['error_code']}"
+        paragraph = (f"Part {r['part']} ({r['name']}) is owned by {r['owner']} and is currently "
+                     f"{r['status']}. {r['description']} Faults are reported as {r['error_code']}.")
+        if n % 3 == 0:
+            texts.append(row)
+        elif n % 3 == 1:
+            texts.append(paragraph)
+        else:
+            others = rng.sample(records, 4)
+            texts.append(" ".join([paragraph] + [
+                f"Part {o['part']} is handled by {o['owner']}. {o['description']}" for o in others
+            ])[:1200])
+    rng.shuffle(texts)
+    questions = [f"Who owns part {r['part']}?" for r in rng.sample(records, min(200, count))]
+    return texts, questions
+
+
+def bench_backend(backend, texts, questions, repeat, workers=0):
+    from rag_engine import EMBEDDING_MODEL
+    start_time = time.perf_counter()
+    embedder = create_embedder(EMBEDDING_MODEL, backend, workers=workers)
+    load_seconds = time.perf_counter() - start_time
+    if backend_name(embedder) != backend:
+        return None, None, None
+    # First call initialises kernels / threads (and the worker pool when sharded)
+    embedder.embed_documents(texts[:max(32, getattr(embedder, "min_texts", 0))])
+
+    best = None
+    vectors = None
+    for _ in range(repeat):
+        if hasattr(embedder, "stats"):
+            embedder.stats.update(texts=0, batches=0, tokens=0, padded_tokens=0, seconds=0.0)
+        start_time = time.perf_counter()
+        vectors = np.asarray(embedder.embed_documents(texts), dtype=np.float32)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    query_vectors = np.asarray(embedder.embed_documents(questions), dtype=np.float32)
+    if hasattr(embedder, "close"):
+        embedder.close()
+
+    result = {
+        "load_seconds": round(load_seconds, 2),
+        "seconds": round(best, 3),
+        "chunks_per_s": round(len(texts) / best, 1),
+        "chars_per_s": round(sum(map(len, texts)) / best),
+    }
+    stats = getattr(embedder, "stats", None)
+    if stats and stats["tokens"]:
+        result["batches"] = stats["batches"]
+        result["padding_overhead"] = round(stats["padded_tokens"] / stats["tokens"], 3)
+    return result, vectors, query_vectors
+
+
+def parity(reference, vectors, reference_queries, queries, k=10):
+    """Cosine between matching vectors and top-k neighbour overlap vs the reference"""
+    cosine = (reference * vectors).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1)
+    )
+    expected = np.argsort(-(reference_queries @ reference.T), axis=1)[:, :k]
+    found = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(expected, found)]
+    return {
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_p1": round(float(np.percentile(cosine, 1)), 5),
+        f"top{k}_overlap": round(float(np.mean(overlap)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend throughput + parity report")
+    parser.add_argument("--backends", nargs="+", default=["hf", "onnx-int8"], choices=EMBEDDER_BACKENDS)
+    parser.add_argument("--texts", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=2, help="timed runs per backend (best is kept)")
+    parser.add_argument("--workers", nargs="+", type=int, default=[],
+                        help="process counts for a sharding scaling run of the first backend")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", default="embedding_backends.json")
+    args = parser.parse_args()
+
+    texts, questions = make_texts(args.texts, args.seed)
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "cpu_count": os.cpu_count(), "config": vars(args)},
+        "backends": {},
+    }
+    reference = None
+    for backend in args.backends:
+        print(f"[BENCH] Embedding {len(texts)} texts with {backend}...")
+        result, vectors, query_vectors = bench_backend(backend, texts, questions, args.repeat)
+        if result is None:
+            report["backends"][backend] = {"error": "unavailable"}
+            continue
+        if reference is None:
+            reference = (backend, result, vectors, query_vectors)
+        else:
+            result["speedup"] = round(result["chunks_per_s"] / reference[1]["chunks_per_s"], 2)
+            result["parity_vs"] = reference[0]
+            result.update(parity(reference[2], vectors, reference[3], query_vectors))
+        report["backends"][backend] = result
+        print(f"[BENCH] {backend}: {json.dumps(result)}")
+
+    if args.workers and reference is not None:
+        report["scaling"] = {"backend": reference[0], "runs": []}
+        single = None
+        for workers in args.workers:
+            print(f"[BENCH] Embedding {len(texts)} texts with {reference[0]} on {workers} worker(s)...")
+            result, vectors, _ = bench_backend(reference[0], texts, questions, args.repeat, workers=workers)
+            single = single or result["chunks_per_s"] / max(workers, 1)
+            result["workers"] = workers
+            # 1.0 = perfectly linear against the first run's per-worker rate
+            result["efficiency"] = round(result["chunks_per_s"] / (single * max(workers, 1)), 3)
+            result["max_abs_diff"] = float(np.abs(vectors - reference[2]).max())
+            report["scaling"]["runs"].append(result)
+            print(f"[BENCH] {workers} worker(s): {json.dumps(result)}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
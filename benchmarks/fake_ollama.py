@@ -0,0 +1,185 @@
+"""
+Minimal stand-in for the Ollama HTTP API, for offline and deterministic benchmarks.
+
+Serves /api/chat and /api/generate (streaming NDJSON or single JSON) at a
+fixed token rate, plus /api/tags, /api/show and /api/version. Answers are
+canned text, so only timing matters.
+
+    python benchmarks/fake_ollama.py --port 11435 --tokens-per-second 40
+    OLLAMA_BASE_URL=http://127.0.0.1:11435 streamlit run app.py
+"""
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+ANSWER_WORDS = (
+    "Based on the provided context the documents describe the requested items "
+    "including identifiers part numbers and error codes together with their "
+    "descriptions owners and current status as listed in the source files"
+).split()
+
+
+class FakeOllama:
+    """
+    Token timing: `first_token_delay` seconds before the first token (prompt
+    processing), then one token every 1 / `tokens_per_second` seconds.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, tokens_per_second=50.0, first_token_delay=0.2,
+                 answer_tokens=64):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.answer_tokens = answer_tokens
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def tokens(self, limit=None):
+        count = self.answer_tokens if not limit or limit < 0 else min(self.answer_tokens, limit)
+        return [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(count)]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, payload, status=200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._json({"models": []})
+                elif self.path == "/api/version":
+                    self._json({"version": "0.0.0-fake"})
+                elif self.path == "/":
+                    self._json({"status": "Ollama is running"})
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/show":
+                    self._json({"modelfile": "", "parameters": "", "template": "", "details": {}})
+                elif self.path in ("/api/chat", "/api/generate"):
+                    fake.requests += 1
+                    self._generate(request, chat=self.path == "/api/chat")
+                else:
+                    self._json({"error": "not found"}, 404)
+
+            def _generate(self, request, chat):
+                model = request.get("model", "fake")
+                limit = (request.get("options") or {}).get("num_predict")
+                tokens = fake.tokens(limit)
+                if chat:
+                    prompt = " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+                else:
+                    prompt = request.get("prompt", "")
+                start = time.perf_counter()
+
+                def _chunk(text, done):
+                    chunk = {
+                        "model": model,
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "done": done,
+                    }
+                    if chat:
+                        chunk["message"] = {"role": "assistant", "content": text}
+                    else:
+                        chunk["response"] = text
+                    if done:
+                        elapsed = int((time.perf_counter() - start) * 1e9)
+                        chunk.update({
+                            "done_reason": "stop",
+                            "total_duration": elapsed,
+                            "load_duration": 0,
+                            "prompt_eval_count": len(prompt) // 4,
+                            "prompt_eval_duration": int(fake.first_token_delay * 1e9),
+                            "eval_count": len(tokens),
+                            "eval_duration": max(0, elapsed - int(fake.first_token_delay * 1e9)),
+                        })
+                    return chunk
+
+                time.sleep(fake.first_token_delay)
+                interval = 1.0 / fake.tokens_per_second if fake.tokens_per_second else 0.0
+                if not request.get("stream", True):
+                    time.sleep(interval * len(tokens))
+                    self._json(_chunk("".join(tokens), True))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def _send(payload):
+                    line = (json.dumps(payload) + "\n").encode("utf-8")
+                    self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                    self.wfile.flush()
+
+                # Pace against the start time so the rate does not drift with write overhead
+                for i, token in enumerate(tokens):
+                    delay = start + fake.first_token_delay + i * interval - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    _send(_chunk(token, False))
+                _send(_chunk("", True))
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="seconds")
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    server = FakeOllama(args.host, args.port, args.tokens_per_second, args.first_token_delay, args.answer_tokens)
+    print(f"[FAKE-OLLAMA] Serving on {server.url} at {args.tokens_per_second} tokens/s")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+End-to-end RAGEngine benchmark on a synthetic corpus, offline.
+
+Runs in a scratch directory (its own vectors/ and embedding cache), against a
+fake Ollama server with a fixed token rate, and writes one JSON report:
+
+    python benchmarks/run_benchmark.py --output bench.json
+    python benchmarks/run_benchmark.py --files-per-format 5 --questions 50 --index-type hnsw
+
+Compare two reports with --baseline to flag regressions.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import FakeOllama  # noqa: E402
+from synthetic_corpus import FORMATS, generate_corpus, make_questions  # noqa: E402
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p90_ms": round(float(np.percentile(values, 90)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def bench_load_split(files):
+    """Per-format parse + chunk throughput (single process, so formats are comparable)"""
+    from rag_engine import load_and_split
+
+    by_format = {}
+    all_chunks = []
+    for path, file_type in files:
+        with open(path, "rb") as f:
+            data = f.read()
+        start_time = time.perf_counter()
+        chunks, _ = load_and_split(path, os.path.basename(path), hashlib.sha256(data).hexdigest())
+        elapsed = time.perf_counter() - start_time
+        stats = by_format.setdefault(file_type, {"files": 0, "bytes": 0, "chunks": 0, "seconds": 0.0})
+        stats["files"] += 1
+        stats["bytes"] += len(data)
+        stats["chunks"] += len(chunks)
+        stats["seconds"] += elapsed
+        # The loader returns an "[Error: ...]" placeholder rather than raising
+        if any(chunk.page_content.startswith("[Error:") for chunk in chunks[:1]):
+            stats["load_errors"] = stats.get("load_errors", 0) + 1
+        all_chunks.extend(chunks)
+
+    for stats in by_format.values():
+        seconds = stats["seconds"] or 1e-9
+        stats["seconds"] = round(stats["seconds"], 4)
+        stats["mb_per_s"] = round(stats["bytes"] / 1e6 / seconds, 3)
+        stats["chunks_per_s"] = round(stats["chunks"] / seconds, 1)
+    return by_format, all_chunks
+
+
+def run(args):
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="rag-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)   # vectors/ and the embedding cache are relative to the cwd
+    print(f"[BENCH] Working in {workdir}")
+
+    report = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": vars(args),
+        }
+    }
+
+    corpus = generate_corpus(
+        os.path.join(workdir, "corpus"), args.files_per_format, args.records_per_file,
+        formats=args.formats, seed=args.seed
+    )
+    report["corpus"] = {
+        "files": len(corpus["files"]),
+        "records": len(corpus["records"]),
+        "skipped_formats": corpus["skipped"],
+    }
+
+    report["load_split"], chunks = bench_load_split(corpus["files"])
+    texts = [chunk.page_content for chunk in chunks]
+    print(f"[BENCH] {len(corpus['files'])} files -> {len(chunks)} chunks")
+
+    with FakeOllama(
+        tokens_per_second=args.tokens_per_second,
+        first_token_delay=args.first_token_delay,
+        answer_tokens=args.answer_tokens,
+    ) as ollama:
+        os.environ["OLLAMA_BASE_URL"] = ollama.url
+        if args.embed_backend:
+            os.environ["RAG_EMBED_BACKEND"] = args.embed_backend
+        import ann_index
+        from embedders import backend_name
+        from rag_engine import RAGEngine
+
+        start_time = time.perf_counter()
+        engine = RAGEngine(model=args.model, namespace="bench", index_type=args.index_type)
+        report["engine_init_seconds"] = round(time.perf_counter() - start_time, 3)
+
+        # Raw model throughput, bypassing the embedding cache
+        base = engine.embeddings.embeddings
+        start_time = time.perf_counter()
+        vectors = np.asarray(base.embed_documents(texts), dtype=np.float32)
+        elapsed = time.perf_counter() - start_time
+        report["embedding"] = {
+            "backend": backend_name(base),
+            "chunks": len(texts),
+            "seconds": round(elapsed, 3),
+            "chunks_per_s": round(len(texts) / elapsed, 1) if elapsed else None,
+            "chars_per_s": round(sum(map(len, texts)) / elapsed) if elapsed else None,
+        }
+
+        config = engine._resolve_index_config(len(vectors), vectors.shape[1])
+        start_time = time.perf_counter()
+        ann_index.build_index(vectors, config)
+        report["index_build"] = {
+            "index_type": config["index_type"],
+            "storage": config["storage"],
+            "vectors": len(vectors),
+            "seconds": round(time.perf_counter() - start_time, 4),
+        }
+
+        start_time = time.perf_counter()
+        engine.create_vectorstore(chunks)
+        report["ingest_seconds"] = round(time.perf_counter() - start_time, 3)
+        engine.setup_chain()
+
+        questions = make_questions(corpus["records"], args.questions, seed=args.seed)
+        embed_times = []
+        retrieval_times = []
+        hits = 0
+        for q in questions:
+            start_time = time.perf_counter()
+            embedding = engine.embeddings.embed_query(q["question"])
+            embed_times.append(time.perf_counter() - start_time)
+            start_time = time.perf_counter()
+            docs = engine._retrieve(q["question"], embedding)
+            retrieval_times.append(time.perf_counter() - start_time)
+            hits += any(q["expected"] in doc.page_content for doc in docs)
+        report["query_embedding"] = percentiles(embed_times)
+        report["retrieval"] = dict(
+            percentiles(retrieval_times),
+            mode=engine.retrieval_mode,
+            k=engine.retrieval_k,
+            answer_in_context=round(hits / len(questions), 3) if questions else None,
+        )
+
+        def ask(question):
+            start_time = time.perf_counter()
+            result = engine.ask_question_stream(question)
+            first = None
+            for _ in result["answer_stream"]:
+                if first is None:
+                    first = time.perf_counter() - start_time
+            total = time.perf_counter() - start_time
+            return (first if first is not None else total), total
+
+        # Every question is asked twice: first with an empty answer cache so the
+        # numbers include retrieval and generation, then again to time a cache hit
+        cache = engine._index.answer_cache
+        timings = {"uncached": ([], []), "cached": ([], [])}
+        cache_hits = 0
+        for q in questions:
+            engine.memory.clear()   # every question is a first turn
+            cache.invalidate()
+            for kind in ("uncached", "cached"):
+                hits_before = cache.hits
+                ttft, total = ask(q["question"])
+                timings[kind][0].append(ttft)
+                timings[kind][1].append(total)
+                if kind == "cached":
+                    cache_hits += cache.hits - hits_before
+                engine.memory.clear()
+        report["query"] = {
+            "time_to_first_token": percentiles(timings["uncached"][0]),
+            "total": percentiles(timings["uncached"][1]),
+            "llm_requests": ollama.requests,
+            "tokens_per_second": args.tokens_per_second,
+        }
+        report["query_cached"] = {
+            "time_to_first_token": percentiles(timings["cached"][0]),
+            "total": percentiles(timings["cached"][1]),
+            "hit_rate": round(cache_hits / len(questions), 3) if questions else None,
+        }
+
+    if not args.keep and not args.workdir:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Timings that got slower than baseline by more than `tolerance` (fraction)"""
+    regressions = []
+
+    def _walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict) and isinstance(previous[key], dict):
+                _walk(value, previous[key], path + [key])
+            elif isinstance(value, (int, float)) and isinstance(previous[key], (int, float)) and previous[key]:
+                slower = key.endswith("_ms") or key == "seconds"
+                faster_is_better = key.endswith("_per_s")
+                change = (value - previous[key]) / previous[key]
+                if (slower and change > tolerance) or (faster_is_better and -change > tolerance):
+                    regressions.append({
+                        "metric": ".".join(path + [key]),
+                        "baseline": previous[key],
+                        "current": value,
+                        "change_pct": round(change * 100, 1),
+                    })
+
+    _walk({k: v for k, v in report.items() if k != "meta"}, baseline, [])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAGEngine end-to-end benchmark")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging")
+    parser.add_argument("--files-per-format", type=int, default=2)
+    parser.add_argument("--records-per-file", type=int, default=40)
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--model", default="qwen2.5:7b", help="name sent to the fake server")
+    parser.add_argument("--index-type", default=None)
+    parser.add_argument("--embed-backend", default=None, help="RAG_EMBED_BACKEND for this run")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--workdir", help="keep corpus and vectors here instead of a temp dir")
+    parser.add_argument("--keep", action="store_true", help="do not delete the temp dir")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    report = run(args)
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"[BENCH] Wrote {output}")
+    if report.get("regressions"):
+        print(f"[BENCH] {len(report['regressions'])} regression(s) beyond {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
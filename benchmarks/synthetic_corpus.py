@@ -0,0 +1,217 @@
+"""
+Deterministic synthetic corpus in every format RAGEngine loads.
+
+Each file describes a set of parts (PRT-xxxx) with owners, statuses and error
+codes, so generated questions have exact answers and exercise both keyword and
+semantic retrieval. Formats whose writer library is missing (xlsx: openpyxl,
+png: pillow) are skipped with a note.
+"""
+import os
+import csv
+import json
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+
+FORMATS = ("txt", "md", "pdf", "docx", "rtf", "csv", "xlsx", "json", "xml", "yaml", "png")
+
+_OWNERS = ["Asha Rao", "Ben Ortiz", "Chen Wei", "Dana Kim", "Elif Demir", "Femi Ade", "Goran Ilic", "Hana Sato"]
+_STATUSES = ["in stock", "on backorder", "discontinued", "under inspection", "shipped"]
+_NOUNS = ["pump", "valve", "bearing", "sensor", "controller", "gasket", "manifold", "actuator", "relay", "filter"]
+_VERBS = ["regulates", "monitors", "seals", "drives", "filters", "protects", "measures", "switches"]
+_OBJECTS = ["coolant flow", "line pressure", "shaft rotation", "intake air", "hydraulic fluid", "supply voltage"]
+
+
+def make_records(rng, count):
+    records = []
+    for _ in range(count):
+        noun = rng.choice(_NOUNS)
+        records.append({
+            "part": f"PRT-{rng.randint(1000, 9999)}",
+            "name": f"{rng.choice(['primary', 'auxiliary', 'backup', 'main', 'secondary'])} {noun}",
+            "owner": rng.choice(_OWNERS),
+            "status": rng.choice(_STATUSES),
+            "error_code": f"ERR-{rng.randint(100, 999)}",
+            "description": f"The {noun} {rng.choice(_VERBS)} {rng.choice(_OBJECTS)} "
+                           f"and is rated for {rng.randint(10, 500)} hours between services.",
+        })
+    return records
+
+
+def _paragraphs(records):
+    return [
+        f"Part {r['part']} ({r['name']}) is owned by {r['owner']} and is currently {r['status']}. "
+        f"{r['description']} Faults are reported as {r['error_code']}."
+        for r in records
+    ]
+
+
+def _write_pdf(path, lines):
+    """Plain single-font PDF with one text line per entry (no dependencies)"""
+    pages = [lines[i:i + 55] for i in range(0, len(lines), 55)] or [[]]
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>", 3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for n, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * n, 5 + 2 * n
+        kids.append(f"{page_id} 0 R")
+        text = "".join(
+            "(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") '\n"
+            for line in page_lines
+        )
+        stream = f"BT /F1 9 Tf 12 TL 40 800 Td\n{text}ET".encode("latin-1", "replace")
+        objects[content_id] = b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = len(out)
+        out += b"%d 0 obj\n" % obj_id + objects[obj_id] + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for obj_id in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[obj_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def _write_docx(path, paragraphs):
+    """Minimal WordprocessingML package (what docx2txt reads)"""
+    body = "".join(f"<w:p><w:r><w:t>{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                   '<Default Extension="xml" ContentType="application/xml"/>'
+                   '<Override PartName="/word/document.xml" ContentType="application/'
+                   'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        z.writestr("_rels/.rels",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                   'relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+        z.writestr("word/document.xml",
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                   f'<w:body>{body}</w:body></w:document>')
+
+
+def _write_png(path, lines):
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1200, 20 * len(lines) + 20), "white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((10, 10 + 20 * i), line, fill="black")
+    image.save(path)
+
+
+def write_file(path, file_type, records):
+    paragraphs = _paragraphs(records)
+    fields = list(records[0])
+    if file_type == "txt":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(paragraphs))
+    elif file_type == "md":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("# Parts catalogue\n\n")
+            for r, p in zip(records, paragraphs):
+                f.write(f"## {r['part']}\n\n{p}\n\n")
+    elif file_type == "pdf":
+        lines = []
+        for p in paragraphs:
+            words = p.split()
+            while words:
+                lines.append(" ".join(words[:14]))
+                words = words[14:]
+            lines.append("")
+        _write_pdf(path, lines)
+    elif file_type == "docx":
+        _write_docx(path, paragraphs)
+    elif file_type == "rtf":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("{\\rtf1\\ansi\\deff0 {\\fonttbl {\\f0 Helvetica;}}\n")
+            for p in paragraphs:
+                f.write(p.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}") + "\\par\\par\n")
+            f.write("}\n")
+    elif file_type == "csv":
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(records)
+    elif file_type == "xlsx":
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.title = "parts"
+        sheet.append(fields)
+        for r in records:
+            sheet.append([r[field] for field in fields])
+        workbook.save(path)
+    elif file_type == "json":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"parts": records}, f, indent=2)
+    elif file_type == "xml":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<parts>\n')
+            for r in records:
+                f.write("  <part>" + "".join(f"<{k}>{escape(v)}</{k}>" for k, v in r.items()) + "</part>\n")
+            f.write("</parts>\n")
+    elif file_type == "yaml":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("parts:\n")
+            for r in records:
+                f.write("".join(
+                    f"{'  - ' if i == 0 else '    '}{k}: {json.dumps(v)}\n" for i, (k, v) in enumerate(r.items())
+                ))
+    elif file_type == "png":
+        _write_png(path, [f"{r['part']} {r['name']} {r['status']} {r['error_code']}" for r in records])
+    else:
+        raise ValueError(f"Unknown format: {file_type}")
+
+
+def generate_corpus(out_dir, files_per_format=2, records_per_file=40, formats=FORMATS, seed=13):
+    """
+    Write the corpus and return {"files": [(path, format)], "records": [...],
+    "skipped": {format: reason}}. The same seed always gives the same bytes
+    (apart from container timestamps in docx/xlsx).
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+    all_records = []
+    skipped = {}
+    for file_type in formats:
+        for n in range(files_per_format):
+            records = make_records(rng, records_per_file)
+            path = os.path.join(out_dir, f"parts_{file_type}_{n:03d}.{file_type}")
+            try:
+                write_file(path, file_type, records)
+            except ImportError as e:
+                skipped[file_type] = f"writer not installed: {e}"
+                break
+            files.append((path, file_type))
+            all_records.extend(records)
+    return {"files": files, "records": all_records, "skipped": skipped}
+
+
+def make_questions(records, count, seed=13):
+    """Questions with a known answer field, alternating identifier and semantic phrasing"""
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        r = rng.choice(records)
+        if i % 3 == 0:
+            questions.append({"question": f"What is the status of part {r['part']}?", "expected": r["status"]})
+        elif i % 3 == 1:
+            questions.append({"question": f"Which part reports error code {r['error_code']}?", "expected": r["part"]})
+        else:
+            questions.append({"question": f"Who owns the {r['name']} that {r['description'].split(' ', 2)[2].split(' and ')[0]}?",
+                              "expected": r["owner"]})
+    return questions
@@ -0,0 +1,122 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from context_builder import count_tokens
+
+
+MEMORY_STRATEGIES = ("buffer", "window", "tokens", "summary")
+
+# One background worker for every session's summaries - they are never urgent
+_summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-summary")
+
+
+class ChatMemory:
+    """
+    Conversation history with bounded growth
+    - buffer:  every turn (the old ConversationBufferMemory behaviour)
+    - window:  the last `max_turns` turns
+    - tokens:  the most recent turns that fit in `max_tokens`
+    - summary: the last `max_turns` turns verbatim plus a rolling summary of
+               older ones, refreshed in the background so answers never wait
+    Drop-in for the load_memory_variables / save_context calls RAGEngine makes.
+    """
+
+    memory_key = "chat_history"
+
+    def __init__(self, strategy="window", max_turns=6, max_tokens=1000, summarizer=None):
+        if strategy not in MEMORY_STRATEGIES:
+            raise ValueError(f"Unknown memory strategy: {strategy} (choose from {', '.join(MEMORY_STRATEGIES)})")
+        if strategy == "summary" and summarizer is None:
+            raise ValueError("The summary strategy needs a summarizer")
+        self.strategy = strategy
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer   # callable(previous_summary, messages) -> str
+        self.summary = ""
+        self._turns = []      # [(HumanMessage, AIMessage)] kept verbatim
+        self._pending = []    # turns handed to the summarizer but not yet folded in
+        self._summarizing = False
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self):
+        with self._lock:
+            return self._history()
+
+    def _history(self):
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        for human, ai in self._pending + self._turns:
+            messages.extend([human, ai])
+        return messages
+
+    def load_memory_variables(self, inputs=None):
+        return {self.memory_key: self.messages}
+
+    def save_context(self, inputs, outputs):
+        human = HumanMessage(content=inputs.get("question", ""))
+        ai = AIMessage(content=outputs.get("answer", ""))
+        with self._lock:
+            self._turns.append((human, ai))
+            self._trim()
+
+    def _trim(self):
+        if self.strategy == "buffer":
+            return
+        if self.strategy == "tokens":
+            used = 0
+            keep = 0
+            for human, ai in reversed(self._turns):
+                used += count_tokens(human.content) + count_tokens(ai.content) + 8
+                if used > self.max_tokens and keep:
+                    break
+                keep += 1
+            self._turns = self._turns[-keep:] if keep else []
+            return
+
+        overflow = len(self._turns) - self.max_turns
+        if overflow <= 0:
+            return
+        dropped, self._turns = self._turns[:overflow], self._turns[overflow:]
+        if self.strategy == "summary":
+            self._pending.extend(dropped)
+            # If the summarizer is failing or behind, fall back to a window:
+            # the oldest unsummarized turns are dropped rather than piling up
+            excess = len(self._pending) - self.max_turns
+            if excess > 0:
+                self._pending = self._pending[excess:]
+            if not self._summarizing:
+                self._summarizing = True
+                _summary_pool.submit(self._refresh_summary)
+
+    def _refresh_summary(self):
+        """Fold pending turns into the rolling summary (runs off the request path)"""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._summarizing = False
+                    return
+                batch = list(self._pending)
+                previous = self.summary
+            try:
+                messages = [m for turn in batch for m in turn]
+                summary = self.summarizer(previous, messages)
+            except Exception as e:
+                print(f"[MEMORY] Summary failed, keeping the last {self.max_turns} older turns verbatim: {e}")
+                with self._lock:
+                    self._summarizing = False
+                return
+            with self._lock:
+                self.summary = summary
+                # _trim may have dropped some of the batch meanwhile, so match by identity
+                done = {id(turn) for turn in batch}
+                self._pending = [turn for turn in self._pending if id(turn) not in done]
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self._turns = []
+            self._pending = []
@@ -0,0 +1,148 @@
+from langchain_core.documents import Document
+
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Token count of `text`. Uses tiktoken's cl100k_base as a stand-in for the
+    Ollama model's tokenizer (close for Qwen/Llama-style BPEs); falls back to
+    ~4 characters per token if tiktoken is unavailable.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _text_overlap(a, b, min_overlap=20, max_overlap=600):
+    """Length of the longest suffix of `a` that is a prefix of `b`"""
+    for size in range(min(len(a), len(b), max_overlap), min_overlap - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def merge_chunks(docs):
+    """
+    Collapse retrieved chunks that repeat each other.
+    Chunks of the same source/page are merged when they overlap (by
+    `start_index` when the splitter recorded it, else by matching text);
+    exact and contained duplicates are dropped. Rank order of first
+    appearance is kept.
+    """
+    groups = {}
+    order = []
+    for doc in docs:
+        key = (doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("sheet"))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(doc)
+
+    merged = []
+    for key in order:
+        group = groups[key]
+        if all("start_index" in doc.metadata for doc in group):
+            group = sorted(group, key=lambda doc: doc.metadata["start_index"])
+        pieces = []   # [text, start or None, metadata]
+        for doc in group:
+            text = doc.page_content
+            start = doc.metadata.get("start_index")
+            if pieces:
+                last = pieces[-1]
+                if text in last[0]:
+                    continue
+                if start is not None and last[1] is not None:
+                    last_end = last[1] + len(last[0])
+                    if start <= last_end:
+                        last[0] += text[last_end - start:]
+                        continue
+                else:
+                    overlap = _text_overlap(last[0], text)
+                    if overlap:
+                        last[0] += text[overlap:]
+                        continue
+            pieces.append([text, start, dict(doc.metadata)])
+        for text, _, metadata in pieces:
+            merged.append(Document(page_content=text, metadata=metadata))
+    return merged
+
+
+class ContextBuilder:
+    """
+    Fits a prompt into the model's context window:
+    budget = num_ctx - num_predict - safety margin. The fixed template and
+    question are always kept, then history (trimmed oldest-first), then
+    merged chunks in rank order (the last one truncated to fit).
+    """
+
+    def __init__(self, num_ctx=2048, num_predict=256, safety_margin=64):
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.safety_margin = safety_margin
+
+    @property
+    def budget(self):
+        return self.num_ctx - self.num_predict - self.safety_margin
+
+    def fit_history(self, messages, fixed_text):
+        """Drop the oldest messages until `fixed_text` + history fits the budget"""
+        available = self.budget - count_tokens(fixed_text)
+        kept = []
+        used = 0
+        for message in reversed(messages):
+            tokens = count_tokens(message.content) + 4
+            if used + tokens > available:
+                break
+            kept.append(message)
+            used += tokens
+        return list(reversed(kept))
+
+    def pack(self, docs, fixed_text, separator="\n\n"):
+        """
+        Merge and select chunks for the context.
+        Returns (packed_docs, stats); `fixed_text` is the rendered prompt
+        without context.
+        """
+        fixed_tokens = count_tokens(fixed_text)
+        available = self.budget - fixed_tokens
+        merged = merge_chunks(docs)
+
+        packed = []
+        used = 0
+        separator_tokens = count_tokens(separator)
+        for doc in merged:
+            tokens = count_tokens(doc.page_content) + (separator_tokens if packed else 0)
+            if used + tokens <= available:
+                packed.append(doc)
+                used += tokens
+                continue
+            remaining = available - used - (separator_tokens if packed else 0)
+            if remaining > 50:
+                # Keep the head of the chunk that no longer fits whole
+                ratio = remaining / tokens
+                text = doc.page_content[:int(len(doc.page_content) * ratio)]
+                while text and count_tokens(text) > remaining:
+                    text = text[:int(len(text) * 0.9)]
+                if text:
+                    packed.append(Document(page_content=text, metadata=dict(doc.metadata, truncated=True)))
+                    used += count_tokens(text) + (separator_tokens if len(packed) > 1 else 0)
+            break
+
+        stats = {
+            "retrieved_chunks": len(docs),
+            "merged_chunks": len(merged),
+            "packed_chunks": len(packed),
+            "context_tokens": used,
+            "prompt_tokens": fixed_tokens + used,
+            "budget": self.budget,
+        }
+        return packed, stats
@@ -0,0 +1,337 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+# RAG_EMBED_BACKEND picks how chunks are encoded (same MiniLM weights in each):
+# - hf:        HuggingFaceEmbeddings / sentence-transformers, fixed batches of 32
+# - torch:     PyTorch with length-bucketed, token-budgeted batches
+# - onnx:      ONNX Runtime (CPU), bucketed batches
+# - onnx-int8: ONNX Runtime with int8 dynamically quantised weights (fastest on CPU)
+EMBEDDER_BACKENDS = ("hf", "torch", "onnx", "onnx-int8")
+ONNX_DIR = os.path.join("vectors", "onnx")
+
+_export_lock = threading.Lock()
+
+
+def length_batches(lengths, max_batch_tokens=16384, max_batch_size=256):
+    """
+    Indices grouped into batches of similar length: sorted by token count and
+    cut whenever the padded size (rows x longest row) would pass max_batch_tokens.
+    Short CSV rows then travel in big batches and long chunks in small ones.
+    """
+    batches = []
+    batch = []
+    for index in np.argsort(lengths, kind="stable"):
+        # Sorted ascending, so the current item is the longest in the batch
+        if batch and (len(batch) >= max_batch_size or lengths[index] * (len(batch) + 1) > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(int(index))
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class BucketedEmbedder(Embeddings):
+    """
+    Sentence embedder for MiniLM-style models (mean pooling + L2 norm, as the
+    sentence-transformers pipeline does) that tokenizes once, buckets texts by
+    token count and sizes every batch by padded tokens rather than a fixed count.
+    Subclasses supply the forward pass.
+    """
+
+    backend = None
+
+    def __init__(self, model_name, max_seq_length=256, max_batch_tokens=None, max_batch_size=256):
+        from transformers import AutoTokenizer
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_seq_length = max_seq_length
+        self.max_batch_tokens = max_batch_tokens or int(os.getenv("RAG_EMBED_BATCH_TOKENS", "16384"))
+        self.max_batch_size = max_batch_size
+        # Padding overhead = padded_tokens / tokens
+        self.stats = {"texts": 0, "batches": 0, "tokens": 0, "padded_tokens": 0, "seconds": 0.0}
+
+    def _forward(self, input_ids, attention_mask):
+        """Token embeddings (last hidden state), float32 [batch, seq, dim]"""
+        raise NotImplementedError
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        start_time = time.perf_counter()
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_seq_length)["input_ids"]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        pad_id = self.tokenizer.pad_token_id or 0
+        output = None
+        batches = length_batches(lengths, self.max_batch_tokens, self.max_batch_size)
+        for batch in batches:
+            width = int(lengths[batch].max())
+            input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, index in enumerate(batch):
+                ids = encoded[index]
+                input_ids[row, :len(ids)] = ids
+                attention_mask[row, :len(ids)] = 1
+
+            hidden = self._forward(input_ids, attention_mask)
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if output is None:
+                output = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            output[batch] = pooled
+            self.stats["padded_tokens"] += input_ids.size
+
+        self.stats["texts"] += len(texts)
+        self.stats["batches"] += len(batches)
+        self.stats["tokens"] += int(lengths.sum())
+        self.stats["seconds"] += time.perf_counter() - start_time
+        return output.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class TorchEmbedder(BucketedEmbedder):
+    backend = "torch"
+
+    def __init__(self, model_name, device=None, **kwargs):
+        super().__init__(model_name, **kwargs)
+        import torch
+        from transformers import AutoModel
+        self._torch = torch
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = AutoModel.from_pretrained(model_name).to(self.device).eval()
+
+    def _forward(self, input_ids, attention_mask):
+        torch = self._torch
+        with torch.inference_mode():
+            output = self.model(
+                input_ids=torch.from_numpy(input_ids).to(self.device),
+                attention_mask=torch.from_numpy(attention_mask).to(self.device),
+            )
+        return output.last_hidden_state.float().cpu().numpy()
+
+
+def export_onnx(model_name, quantize=True, model_dir=ONNX_DIR):
+    """
+    Export `model_name` to ONNX once (and an int8 copy with dynamic
+    quantisation); later calls reuse the files. Returns the model path.
+    """
+    target = os.path.join(model_dir, model_name.replace("/", "__"))
+    fp32_path = os.path.join(target, "model.onnx")
+    int8_path = os.path.join(target, "model.int8.onnx")
+    path = int8_path if quantize else fp32_path
+    with _export_lock:
+        if os.path.exists(path):
+            return path
+        os.makedirs(target, exist_ok=True)
+        if not os.path.exists(fp32_path):
+            import torch
+            from transformers import AutoModel, AutoTokenizer
+            print(f"[EMBED] Exporting {model_name} to ONNX...")
+            model = AutoModel.from_pretrained(model_name).eval()
+            sample = AutoTokenizer.from_pretrained(model_name)(["an export sample"], return_tensors="pt")
+            names = ["input_ids", "attention_mask", "token_type_ids"]
+            axes = {name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]}
+            tmp_path = os.path.join(target, "model.tmp.onnx")
+            torch.onnx.export(
+                model, tuple(sample[name] for name in names), tmp_path,
+                input_names=names, output_names=["last_hidden_state"],
+                dynamic_axes=axes, opset_version=14
+            )
+            os.replace(tmp_path, fp32_path)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"[EMBED] Quantizing {model_name} to int8...")
+            tmp_path = os.path.join(target, "model.int8.tmp.onnx")
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+    return path
+
+
+class OnnxEmbedder(BucketedEmbedder):
+    def __init__(self, model_name, quantize=True, threads=None, model_dir=ONNX_DIR, **kwargs):
+        super().__init__(model_name, **kwargs)
+        import onnxruntime as ort
+        self.backend = "onnx-int8" if quantize else "onnx"
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = threads or int(os.getenv("RAG_EMBED_THREADS", "0"))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            export_onnx(model_name, quantize, model_dir), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+    def _forward(self, input_ids, attention_mask):
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        return self.session.run(["last_hidden_state"], feed)[0]
+
+
+def create_embedder(model_name, backend=None, workers=None):
+    """
+    Base (uncached) embedder for `backend`; falls back to hf if its runtime is
+    missing. workers > 1 (RAG_EMBED_WORKERS) wraps it in a ShardedEmbedder.
+    """
+    backend = backend or os.getenv("RAG_EMBED_BACKEND", "hf")
+    workers = int(os.getenv("RAG_EMBED_WORKERS", "0")) if workers is None else workers
+    embedder = _create_local(model_name, backend)
+    if workers > 1:
+        return ShardedEmbedder(model_name, embedder, workers)
+    return embedder
+
+
+def _create_local(model_name, backend):
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend} (choose from {', '.join(EMBEDDER_BACKENDS)})")
+    try:
+        if backend == "torch":
+            return TorchEmbedder(model_name)
+        if backend in ("onnx", "onnx-int8"):
+            return OnnxEmbedder(model_name, quantize=backend == "onnx-int8")
+    except ImportError as e:
+        print(f"[EMBED] {backend} backend unavailable ({e}), using hf")
+
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    print(f"[RAG] Using device: {device.upper()}")
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': device},
+        encode_kwargs={'normalize_embeddings': True, 'batch_size': 32}
+    )
+
+
+def backend_name(embedder):
+    return getattr(embedder, "backend", None) or "hf"
+
+
+# -- multi-process sharding ----------------------------------------------
+
+_worker_embedder = None   # set in each pool process by _init_worker
+
+
+def _init_worker(model_name, backend, threads):
+    """Pool initializer: load one model copy, limited to its share of the cores"""
+    global _worker_embedder
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["RAG_EMBED_THREADS"] = str(threads)
+    # Spawned workers inherit RAG_EMBED_WORKERS; they must not shard again
+    os.environ["RAG_EMBED_WORKERS"] = "0"
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_embedder = _create_local(model_name, backend)
+
+
+def _embedding_dim():
+    return len(_worker_embedder.embed_query("dimension probe"))
+
+
+def _embed_shard(shm_name, shape, indices, texts):
+    """Encode one shard and write its rows straight into the shared output array"""
+    from multiprocessing import shared_memory
+    vectors = np.asarray(_worker_embedder.embed_documents(texts), dtype=np.float32)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        output = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        output[indices] = vectors
+        del output   # the buffer cannot close while a view is alive
+    finally:
+        shm.close()
+    return len(texts)
+
+
+class ShardedEmbedder(Embeddings):
+    """
+    Spreads large embed_documents() calls over a pool of processes, each with
+    its own model copy and cores // workers threads, so tokenization and
+    pooling are no longer bound to one Python process. Texts are sorted by
+    length and dealt out in shards (longest first, for balance); workers
+    write their rows into one shared-memory float32 array, so results come
+    back in order without pickling vectors. Queries and small batches use the
+    in-process `local` embedder.
+    """
+
+    def __init__(self, model_name, local, workers, min_texts=None):
+        self.model_name = model_name
+        self.local = local
+        self.backend = backend_name(local)
+        self.workers = workers
+        self.min_texts = min_texts or int(os.getenv("RAG_EMBED_SHARD_MIN", "256"))
+        self._pool = None
+        self._dim = None
+        self._lock = threading.Lock()
+
+    def _ensure_pool(self):
+        with self._lock:
+            if self._pool is None:
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                print(f"[EMBED] Starting {self.workers} embedding workers ({threads} threads each)...")
+                # spawn: forking a process that already holds torch/OpenMP threads can deadlock
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker, initargs=(self.model_name, self.backend, threads)
+                )
+                self._dim = self._pool.submit(_embedding_dim).result()
+            return self._pool
+
+    def embed_documents(self, texts):
+        if len(texts) < self.min_texts:
+            return self.local.embed_documents(texts)
+        from multiprocessing import shared_memory
+        try:
+            pool = self._ensure_pool()
+        except BrokenProcessPool as e:
+            print(f"[EMBED] Worker pool failed to start ({e}), embedding in-process")
+            self.close()
+            return self.local.embed_documents(texts)
+
+        start_time = time.perf_counter()
+        shape = (len(texts), self._dim)
+        shm = shared_memory.SharedMemory(create=True, size=len(texts) * self._dim * 4)
+        try:
+            order = np.argsort([len(text) for text in texts], kind="stable")[::-1]
+            shards = [shard for shard in np.array_split(order, self.workers * 4) if len(shard)]
+            futures = [
+                pool.submit(_embed_shard, shm.name, shape, shard, [texts[i] for i in shard])
+                for shard in shards
+            ]
+            for future in futures:
+                future.result()
+            vectors = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        except BrokenProcessPool as e:
+            print(f"[EMBED] Embedding worker died ({e}), embedding in-process")
+            self.close()
+            return self.local.embed_documents(texts)
+        finally:
+            shm.close()
+            shm.unlink()
+        elapsed = time.perf_counter() - start_time
+        print(f"[EMBED] {len(texts)} texts on {self.workers} workers in {elapsed:.2f}s "
+              f"({len(texts) / elapsed:.0f}/s)")
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.local.embed_query(text)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
@@ -0,0 +1,190 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import metrics
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache (SQLite)
+    - Keyed by sha256 of model settings + chunk text
+    - Size-capped with least-recently-used eviction
+    """
+
+    # SQLite limits the number of bound parameters per statement
+    _BATCH = 500
+
+    def __init__(self, path, max_entries=200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        return self._count
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), self._BATCH):
+                batch = keys[i:i + self._BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs, evicting the least recently used beyond the cap"""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                print(f"[CACHE] Evicted {overflow} least recently used embeddings")
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only encodes chunks missing from the cache.
+    Queries are passed straight through (they are rarely repeated verbatim).
+    Safe to share between threads: calls into the model are serialised, since
+    HF fast tokenizers raise "Already borrowed" under concurrent use. Documents
+    are encoded in sub-batches of `encode_batch` texts and waiting queries go
+    first between them, so a large ingest does not hold up interactive search.
+    """
+
+    def __init__(self, embeddings, cache, model_key, encode_batch=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_key = model_key
+        encode_batch = encode_batch or int(os.getenv("RAG_ENCODE_BATCH", "256"))
+        # A sharded embedder only fans out calls of at least min_texts per worker
+        sharded = getattr(embeddings, "min_texts", 0) * getattr(embeddings, "workers", 1)
+        self.encode_batch = max(encode_batch, sharded)
+        self._turn = threading.Condition()
+        self._busy = False
+        self._queries_waiting = 0
+
+    @contextmanager
+    def _encoding(self, query=False):
+        """Exclusive use of the model; queries are admitted before waiting document batches"""
+        with self._turn:
+            if query:
+                self._queries_waiting += 1
+            try:
+                while self._busy or (not query and self._queries_waiting):
+                    self._turn.wait()
+            finally:
+                if query:
+                    self._queries_waiting -= 1
+            self._busy = True
+        try:
+            yield
+        finally:
+            with self._turn:
+                self._busy = False
+                self._turn.notify_all()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_key}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        vectors = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # Encode each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.encode_batch):
+            batch_keys = missing_keys[start:start + self.encode_batch]
+            with self._encoding():
+                new_vectors = self.embeddings.embed_documents([missing[key] for key in batch_keys])
+            new_items = list(zip(batch_keys, new_vectors))
+            self.cache.put_many(new_items)
+            vectors.update(new_items)
+
+        metrics.inc("embedding_cache_lookups", len(texts) - len(missing), result="hit")
+        metrics.inc("embedding_cache_lookups", len(missing), result="miss")
+        print(f"[CACHE] {len(texts)} chunks: {len(texts) - len(missing)} cached, {len(missing)} encoded")
+        return [list(vectors[key]) for key in keys]
+
+    def embed_query(self, text):
+        with self._encoding(query=True):
+            return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        """Several queries in one encode call (uncached, like embed_query)"""
+        with self._encoding(query=True):
+            return self.embeddings.embed_documents(list(texts))
@@ -0,0 +1,475 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+
+MANIFEST = "manifest.json"
+# 1: every snapshot carries its own chunks.sqlite
+# 2: one append-only chunk store per namespace, plus a journal of vector changes
+FORMAT_VERSION = 2
+KEEP_SNAPSHOTS = 2
+# Incremental saves append to the chunk store and journal; the FAISS index is
+# only written again once the journal holds this many changes or is this old
+SNAPSHOT_EVERY = int(os.getenv("RAG_SNAPSHOT_EVERY", "50000"))
+SNAPSHOT_INTERVAL = float(os.getenv("RAG_SNAPSHOT_INTERVAL", "900"))
+
+# Files written by FAISS.save_local before snapshots existed
+LEGACY_FILES = ("index.faiss", "index.pkl")
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Read-only docstore over a chunk store (or a format 1 snapshot's chunks.sqlite).
+    Chunks are fetched on demand, so nothing is unpickled or held in RAM.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        self.shared = "removed" in columns   # a chunk store rather than a snapshot copy
+
+    def search(self, search):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, metadata FROM chunks WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts):
+        raise NotImplementedError("Snapshot docstores are read-only; call make_writable() first")
+
+    def delete(self, ids):
+        raise NotImplementedError("Snapshot docstores are read-only; call make_writable() first")
+
+    def index_map(self):
+        """{faiss position: docstore id} (format 1 snapshots)"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT position, id FROM chunks").fetchall())
+
+    def source_rows(self):
+        """(id, source, file_hash) of every live chunk, without decoding any chunk text"""
+        query = "SELECT id, source, file_hash FROM chunks"
+        query += " WHERE removed IS NULL" if self.shared else " ORDER BY position"
+        with self._lock:
+            return self._conn.execute(query).fetchall()
+
+    def journal(self, after_seq):
+        """Journaled (op, id, vector) changes newer than a snapshot, oldest first"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT op, id, vector FROM journal WHERE seq > ? ORDER BY seq", (after_seq,)
+            ).fetchall()
+
+
+class OverlayDocstore(Docstore, AddableMixin):
+    """
+    Writable docstore on top of a SQLiteDocstore: added chunks are held in RAM
+    and deleted ids are masked until the next save writes them to the chunk
+    store; everything else is still read from SQLite on demand.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.added = {}
+        self.deleted = set()
+
+    def search(self, search):
+        if search in self.added:
+            return self.added[search]
+        if search in self.deleted:
+            return f"ID {search} not found."
+        return self.base.search(search)
+
+    def add(self, texts):
+        overlapping = set(texts).intersection(self.added)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self.added.update(texts)
+
+    def delete(self, ids):
+        for doc_id in ids:
+            if self.added.pop(doc_id, None) is None:
+                self.deleted.add(doc_id)
+
+    def source_rows(self):
+        rows = [row for row in self.base.source_rows() if row[0] not in self.deleted]
+        rows.extend(
+            (doc_id, doc.metadata.get("source"), doc.metadata.get("file_hash"))
+            for doc_id, doc in self.added.items()
+        )
+        return rows
+
+
+def read_manifest(vector_dir):
+    path = os.path.join(vector_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(vector_dir, manifest):
+    tmp_manifest = os.path.join(vector_dir, f"{MANIFEST}.tmp")
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, os.path.join(vector_dir, MANIFEST))
+
+
+def has_legacy_index(vector_dir):
+    return all(os.path.exists(os.path.join(vector_dir, name)) for name in LEGACY_FILES)
+
+
+def _open_store(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(
+        "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL,"
+        " source TEXT, file_hash TEXT, removed INTEGER);"
+        "CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL,"
+        " id TEXT NOT NULL, vector BLOB);"
+    )
+    return conn
+
+
+def _journal_seq(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+    return row[0] if row else 0
+
+
+def _chunk_row(doc_id, doc):
+    metadata = doc.metadata or {}
+    return (doc_id, doc.page_content, json.dumps(metadata, default=str),
+            metadata.get("source"), metadata.get("file_hash"))
+
+
+def _insert_chunks(conn, rows):
+    conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?, NULL)", rows)
+
+
+def _store_path(vector_dir, manifest):
+    return os.path.join(vector_dir, manifest["chunks"])
+
+
+def _on_store(vectorstore, vector_dir, manifest):
+    """True if the docstore already reads from this namespace's current chunk store"""
+    if not manifest or manifest.get("format") != FORMAT_VERSION:
+        return False
+    base = getattr(vectorstore.docstore, "base", vectorstore.docstore)
+    return (isinstance(base, SQLiteDocstore) and base.shared
+            and os.path.abspath(base.path) == os.path.abspath(_store_path(vector_dir, manifest)))
+
+
+def _journal_changes(conn, vectorstore, changes):
+    """
+    Append vector changes to the journal and write the matching chunk rows,
+    all in the caller's transaction. Returns the journal's last seq.
+    """
+    for change in changes:
+        if change[0] == "add":
+            _, ids, vectors = change
+            vectors = np.asarray(vectors, dtype=np.float32)
+            conn.executemany(
+                "INSERT INTO journal (op, id, vector) VALUES ('add', ?, ?)",
+                [(doc_id, vector.tobytes()) for doc_id, vector in zip(ids, vectors)]
+            )
+        else:
+            conn.executemany("INSERT INTO journal (op, id) VALUES ('delete', ?)", [(doc_id,) for doc_id in change[1]])
+    seq = _journal_seq(conn)
+
+    docstore = vectorstore.docstore
+    if isinstance(docstore, OverlayDocstore):
+        _insert_chunks(conn, [_chunk_row(doc_id, doc) for doc_id, doc in docstore.added.items()])
+        deleted = list(docstore.deleted)
+        for start in range(0, len(deleted), 500):
+            batch = deleted[start:start + 500]
+            conn.execute(
+                f"UPDATE chunks SET removed = ? WHERE id IN ({','.join('?' * len(batch))})", [seq] + batch
+            )
+    return seq
+
+
+def _clear_overlay(vectorstore):
+    """The overlay's changes are in the chunk store now; reads can go to SQLite"""
+    if isinstance(vectorstore.docstore, OverlayDocstore):
+        vectorstore.docstore.added.clear()
+        vectorstore.docstore.deleted.clear()
+
+
+def save_changes(vector_dir, vectorstore, changes, extra=None):
+    """
+    Incremental save: new and removed chunks go to the chunk store and their
+    vectors to the journal, in one transaction. The FAISS index is only
+    snapshotted again when the journal is big or old enough (or the docstore
+    is not on the chunk store yet). `changes` - [("add", ids, vectors)
+    | ("delete", ids)] in order - is emptied once written. Returns the version.
+    """
+    manifest = read_manifest(vector_dir)
+    if not _on_store(vectorstore, vector_dir, manifest):
+        return save_snapshot(vector_dir, vectorstore, extra, changes)
+
+    conn = _open_store(_store_path(vector_dir, manifest))
+    try:
+        with conn:
+            _journal_changes(conn, vectorstore, changes)
+        del changes[:]
+        _clear_overlay(vectorstore)
+        pending = conn.execute("SELECT COUNT(*) FROM journal WHERE seq > ?", (manifest["journal_seq"],)).fetchone()[0]
+    finally:
+        conn.close()
+
+    if pending >= SNAPSHOT_EVERY or (pending and time.time() - manifest["created"] >= SNAPSHOT_INTERVAL):
+        return save_snapshot(vector_dir, vectorstore, extra)
+    manifest.update(extra or {})
+    manifest.update(count=len(vectorstore.index_to_docstore_id), journal=pending, updated=time.time())
+    _write_manifest(vector_dir, manifest)
+    return manifest["version"]
+
+
+def save_snapshot(vector_dir, vectorstore, extra=None, changes=None):
+    """
+    Write the FAISS index (and re-scoring vectors) as a new immutable snapshot,
+    then atomically point the manifest at it. Readers of an older snapshot keep
+    working until they reload.
+    Chunks already in the namespace's chunk store are not rewritten; a docstore
+    that is not on the store (new corpus, older format) gets a fresh store.
+    """
+    import faiss
+
+    os.makedirs(vector_dir, exist_ok=True)
+    previous = read_manifest(vector_dir) or {}
+    version = previous.get("version", 0) + 1
+    name = f"v{version:06d}"
+    snapshots_dir = os.path.join(vector_dir, "snapshots")
+    tmp_dir = os.path.join(snapshots_dir, f"{name}.tmp")
+    snap_dir = os.path.join(snapshots_dir, name)
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    from ann_index import next_position
+
+    # One entry per index position; "" marks a removed one (HNSW tombstone, IVF gap)
+    slots = next_position(vectorstore)
+    positions = np.full(slots, "", dtype=object)
+    for position, doc_id in vectorstore.index_to_docstore_id.items():
+        positions[position] = doc_id
+    ids = [doc_id for _, doc_id in sorted(vectorstore.index_to_docstore_id.items())]
+    on_store = _on_store(vectorstore, vector_dir, previous)
+    store_name = previous["chunks"] if on_store else f"chunks-{name}.sqlite"
+    conn = _open_store(os.path.join(vector_dir, store_name))
+    try:
+        with conn:
+            if on_store:
+                seq = _journal_changes(conn, vectorstore, changes or [])
+            else:
+                # A fresh store: only the new manifest will point at it
+                conn.execute("DELETE FROM chunks")
+                conn.execute("DELETE FROM journal")
+                rows = []
+                for doc_id in ids:
+                    rows.append(_chunk_row(doc_id, vectorstore.docstore.search(doc_id)))
+                    if len(rows) >= 10_000:
+                        _insert_chunks(conn, rows)
+                        rows = []
+                _insert_chunks(conn, rows)
+                seq = _journal_seq(conn)
+        if changes:
+            del changes[:]
+
+        faiss.write_index(vectorstore.index, os.path.join(tmp_dir, "index.faiss"))
+        np.save(os.path.join(tmp_dir, "ids.npy"), positions.astype(str))
+        full_vectors = getattr(vectorstore, "full_vectors", None)
+        if full_vectors is not None:
+            # Full-precision copy for exact re-scoring; memory-mapped on load
+            np.save(os.path.join(tmp_dir, "vectors.npy"), np.asarray(full_vectors[:slots], dtype=np.float32))
+        os.replace(tmp_dir, snap_dir)
+
+        manifest = {
+            "format": FORMAT_VERSION,
+            "version": version,
+            "snapshot": os.path.join("snapshots", name),
+            "chunks": store_name,
+            "journal_seq": seq,
+            "journal": 0,
+            "created": time.time(),
+            "count": len(ids),
+            "dim": vectorstore.index.d,
+        }
+        manifest.update(extra or {})
+        _write_manifest(vector_dir, manifest)
+
+        if on_store:
+            # Only the previous snapshot may still be open elsewhere: drop what it cannot need
+            with conn:
+                conn.execute("DELETE FROM journal WHERE seq <= ?", (previous["journal_seq"],))
+                conn.execute("DELETE FROM chunks WHERE removed <= ?", (previous["journal_seq"],))
+    finally:
+        conn.close()
+
+    if on_store:
+        _clear_overlay(vectorstore)
+    else:
+        # Serve chunks from the new store instead of holding them in RAM
+        vectorstore.docstore = OverlayDocstore(SQLiteDocstore(os.path.join(vector_dir, store_name)))
+    _prune_snapshots(snapshots_dir, keep=KEEP_SNAPSHOTS)
+    _prune_stores(vector_dir, keep={store_name, previous.get("chunks")})
+    for legacy in LEGACY_FILES:
+        legacy_path = os.path.join(vector_dir, legacy)
+        if os.path.exists(legacy_path):
+            os.unlink(legacy_path)
+    return version
+
+
+def _prune_snapshots(snapshots_dir, keep):
+    names = sorted(n for n in os.listdir(snapshots_dir) if n.startswith("v") and not n.endswith(".tmp"))
+    for name in names[:-keep]:
+        # Unlinking is safe on POSIX even while another process has it mmap'd
+        shutil.rmtree(os.path.join(snapshots_dir, name), ignore_errors=True)
+
+
+def _prune_stores(vector_dir, keep):
+    for name in os.listdir(vector_dir):
+        base = name.split(".sqlite")[0] + ".sqlite"
+        if name.startswith("chunks-") and ".sqlite" in name and base not in keep:
+            try:
+                os.unlink(os.path.join(vector_dir, name))
+            except OSError:
+                pass
+
+
+def load_snapshot(vector_dir, embeddings):
+    """
+    Open the current snapshot: the FAISS index (IVF lists as well as flat and
+    HNSW codes) is memory-mapped read-only, so pages load on first touch, and
+    chunks stay in SQLite. Journaled changes newer than the snapshot are
+    replayed (which loads the index into RAM); a format 1 snapshot is upgraded.
+    Returns (vectorstore, manifest) or (None, None) if there is no snapshot.
+    """
+    import faiss
+    from ann_index import RescoringFAISS
+
+    manifest = read_manifest(vector_dir)
+    if manifest is None:
+        return None, None
+
+    snap_dir = os.path.join(vector_dir, manifest["snapshot"])
+    index_path = os.path.join(snap_dir, "index.faiss")
+    # IO_FLAG_MMAP only maps IVF lists; MMAP_IFC (newer faiss) maps every code array
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        index = faiss.read_index(index_path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # Not every index type can be mapped; fall back to a regular read
+        index = faiss.read_index(index_path)
+
+    upgrade = manifest.get("format", 1) < FORMAT_VERSION
+    if upgrade:
+        docstore = SQLiteDocstore(os.path.join(snap_dir, "chunks.sqlite"))
+        index_map = docstore.index_map()
+    else:
+        docstore = SQLiteDocstore(_store_path(vector_dir, manifest))
+        index_map = {
+            position: doc_id
+            for position, doc_id in enumerate(np.load(os.path.join(snap_dir, "ids.npy")).tolist()) if doc_id
+        }
+    vectorstore = RescoringFAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_map,
+    )
+    vectorstore.index_path = index_path
+    vectorstore.buffer_dir = vector_dir
+    vectors_path = os.path.join(snap_dir, "vectors.npy")
+    if os.path.exists(vectors_path):
+        vectorstore.full_vectors = np.load(vectors_path, mmap_mode="r")
+        vectorstore.rescore_factor = manifest.get("index", {}).get("rescore_factor", 4)
+
+    if upgrade:
+        print("[STORE] Upgrading snapshot to the chunk store format...")
+        save_snapshot(vector_dir, vectorstore, extra={"index": manifest.get("index", {})})
+        return load_snapshot(vector_dir, embeddings)
+    manifest["replayed"] = _replay_journal(vectorstore, manifest["journal_seq"])
+    return vectorstore, manifest
+
+
+def _replay_journal(vectorstore, after_seq):
+    """Re-apply journaled adds/deletes in order; returns how many were applied"""
+    from ann_index import add_vectors, delete_ids
+
+    rows = vectorstore.docstore.journal(after_seq)
+    if not rows:
+        return 0
+    start_time = time.time()
+    make_writable(vectorstore)
+    n = 0
+    while n < len(rows):
+        op = rows[n][0]
+        end = n
+        while end < len(rows) and rows[end][0] == op:
+            end += 1
+        ids = [doc_id for _, doc_id, _ in rows[n:end]]
+        if op == "add":
+            vectors = np.frombuffer(b"".join(vector for _, _, vector in rows[n:end]), dtype=np.float32)
+            vectors = vectors.reshape(len(ids), vectorstore.index.d)
+            add_vectors(vectorstore, vectors, ids)
+        else:
+            delete_ids(vectorstore, ids)
+        n = end
+    # The chunk store already reflects every journaled change
+    _clear_overlay(vectorstore)
+    print(f"[STORE] Replayed {len(rows)} journaled changes in {time.time() - start_time:.2f}s")
+    return len(rows)
+
+
+def is_writable(vectorstore):
+    return getattr(vectorstore, "index_path", None) is None and not isinstance(vectorstore.docstore, SQLiteDocstore)
+
+
+def make_writable(vectorstore):
+    """
+    Prepare a mapped snapshot for its first modification. Only the FAISS index
+    is loaded into RAM; chunks stay in SQLite behind an OverlayDocstore and the
+    full-precision vectors stay mapped until they are actually changed.
+    """
+    if is_writable(vectorstore):
+        return
+    start_time = time.time()
+    if getattr(vectorstore, "index_path", None) is not None:
+        vectorstore.index = _writable_index(vectorstore)
+        vectorstore.index_path = None
+    if isinstance(vectorstore.docstore, SQLiteDocstore):
+        vectorstore.docstore = OverlayDocstore(vectorstore.docstore)
+    print(f"[STORE] Loaded snapshot index into memory for writing in {time.time() - start_time:.2f}s")
+
+
+def _writable_index(vectorstore):
+    """
+    An in-RAM copy of a mapped index. Mapped codes and IVF lists cannot be
+    cloned, so the snapshot file is read again without mapping (or, if it has
+    been pruned meanwhile, the mapped index is serialized and read back).
+    """
+    import faiss
+    from ann_index import apply_search_params, search_params
+
+    index_path = getattr(vectorstore, "index_path", None)
+    if index_path is None:
+        return faiss.clone_index(vectorstore.index)
+    if os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+    else:
+        index = faiss.deserialize_index(faiss.serialize_index(vectorstore.index))
+    # nprobe / efSearch may have been tuned since the snapshot was loaded
+    apply_search_params(index, search_params(vectorstore.index))
+    return index
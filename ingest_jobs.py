@@ -0,0 +1,340 @@
+"""
+Background ingestion owned by the server process, not by a Streamlit run.
+
+Uploads are copied into vectors/jobs/<job id>/ and recorded in SQLite, so a
+browser refresh (or a server restart) does not lose them; one worker thread
+works through queued jobs file by file, while files below the streaming
+threshold are parsed ahead on a process pool. Chunks are searchable as soon as
+each micro-batch is indexed, so a workspace can be queried while a large upload
+is still embedding. Sessions poll jobs() for progress and may cancel().
+"""
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from rag_engine import RAGEngine, iter_upload_blocks, load_and_split
+
+
+JOBS_DIR = os.path.join("vectors", "jobs")
+# jobs: queued -> running -> done | failed | cancelled
+# files: queued -> running -> done | skipped (already indexed) | failed | cancelled
+# A long job saves its snapshot at least this often, so a crash loses little
+SAVE_INTERVAL = float(os.getenv("RAG_JOB_SAVE_INTERVAL", "60"))
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    """Durable job + per-file state (SQLite, WAL)"""
+
+    def __init__(self, path=os.path.join(JOBS_DIR, "jobs.sqlite")):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, namespace TEXT NOT NULL,"
+                " model TEXT NOT NULL, status TEXT NOT NULL, cancel INTEGER NOT NULL DEFAULT 0,"
+                " created REAL NOT NULL, started REAL, finished REAL, error TEXT);"
+                "CREATE TABLE IF NOT EXISTS job_files (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id TEXT NOT NULL, name TEXT NOT NULL, path TEXT NOT NULL, file_hash TEXT NOT NULL,"
+                " size INTEGER NOT NULL, status TEXT NOT NULL, chunks INTEGER NOT NULL DEFAULT 0,"
+                " seconds REAL, error TEXT);"
+                "CREATE INDEX IF NOT EXISTS job_files_job ON job_files (job_id);"
+                "CREATE INDEX IF NOT EXISTS jobs_namespace ON jobs (namespace, created);"
+            )
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def create(self, job_id, namespace, model, files):
+        """files: [(name, path, sha256, size)]"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, namespace, model, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, namespace, model, time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO job_files (job_id, name, path, file_hash, size, status) VALUES (?, ?, ?, ?, ?, 'queued')",
+                [(job_id, name, path, file_hash, size) for name, path, file_hash, size in files]
+            )
+
+    def requeue_interrupted(self):
+        """Jobs that were running when the process died start over (finished files stay done)"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE job_files SET status = 'queued', chunks = 0 WHERE status = 'running'")
+            return self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+
+    def next_queued(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+        return dict(row) if row else None
+
+    def files(self, job_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM job_files WHERE job_id = ? ORDER BY id", (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_job(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {columns} WHERE id = ?", list(fields.values()) + [job_id])
+
+    def set_file(self, file_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE job_files SET {columns} WHERE id = ?", list(fields.values()) + [file_id])
+
+    def request_cancel(self, job_id):
+        """Flag a job; a queued one is cancelled at once. Returns False if it already ended."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["status"] not in ("queued", "running"):
+                return False
+            self._conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,))
+            if row["status"] == "queued":
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ?", (time.time(), job_id)
+                )
+                self.cancel_pending(job_id)
+            return True
+
+    def cancel_pending(self, job_id):
+        """Mark a job's not-yet-started files cancelled"""
+        self._execute("UPDATE job_files SET status = 'cancelled' WHERE job_id = ? AND status = 'queued'", (job_id,))
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel"])
+
+    def jobs(self, namespace, limit=5):
+        """Most recent jobs of a namespace, newest first, each with its files"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE namespace = ? ORDER BY created DESC LIMIT ?", (namespace, limit)
+            ).fetchall()
+        jobs = [dict(row) for row in rows]
+        for job in jobs:
+            job["files"] = self.files(job["id"])
+        return jobs
+
+
+class IngestQueue:
+    """
+    Process-wide queue: submit() returns a job id immediately and a single
+    worker thread ingests jobs in order (index writes are serialised anyway).
+    """
+
+    def __init__(self, store=None):
+        self.store = store or JobStore()
+        self._wake = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+        # Guards which namespace the worker is ingesting; notified when a job ends
+        self._idle = threading.Condition()
+        self._running = None
+        resumed = self.store.requeue_interrupted()
+        if resumed:
+            print(f"[JOBS] Resuming {resumed} interrupted job(s)")
+        if resumed or self.store.next_queued():
+            self._ensure_worker()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ingest-jobs", daemon=True)
+                self._worker.start()
+        self._wake.set()
+
+    def submit(self, namespace, uploaded_files, model="qwen2.5:7b"):
+        """Copy the uploads into the job directory and queue them; returns the job id"""
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(JOBS_DIR, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        files = []
+        try:
+            for n, uploaded_file in enumerate(uploaded_files):
+                path = os.path.join(job_dir, f"{n:04d}_{os.path.basename(uploaded_file.name)}")
+                digest = hashlib.sha256()
+                size = 0
+                with open(path, "wb") as f:
+                    for block in iter_upload_blocks(uploaded_file):
+                        digest.update(block)
+                        f.write(block)
+                        size += len(block)
+                files.append((uploaded_file.name, path, digest.hexdigest(), size))
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        self.store.create(job_id, namespace, model, files)
+        print(f"[JOBS] Queued {job_id}: {len(files)} file(s) for '{namespace}'")
+        self._ensure_worker()
+        return job_id
+
+    def cancel(self, job_id):
+        return self.store.request_cancel(job_id)
+
+    def cancel_namespace(self, namespace, timeout=60):
+        """
+        Cancel every queued or running job of a namespace and wait until the
+        worker has let go of its index (call before clearing it).
+        Returns False if a job was still running after `timeout` seconds.
+        """
+        deadline = time.time() + timeout
+        with self._idle:
+            for job in self.active(namespace):
+                self.store.request_cancel(job["id"])
+            while self._running == namespace:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def jobs(self, namespace, limit=5):
+        return self.store.jobs(namespace, limit)
+
+    def active(self, namespace):
+        return [job for job in self.store.jobs(namespace, limit=20) if job["status"] in ("queued", "running")]
+
+    def _run(self):
+        while True:
+            with self._idle:
+                # Picked under the same lock cancel_namespace() cancels under
+                job = self.store.next_queued()
+                self._running = job["namespace"] if job else None
+            if job is None:
+                self._wake.wait(timeout=5)
+                self._wake.clear()
+                continue
+            try:
+                self._run_job(job)
+            except Exception as e:
+                print(f"[JOBS] Job {job['id']} failed: {e}")
+                self.store.set_job(job["id"], status="failed", error=str(e), finished=time.time())
+            finally:
+                with self._idle:
+                    self._running = None
+                    self._idle.notify_all()
+
+    def _parsed(self, future, job_id):
+        """A pool result, checking for cancellation while the file is still parsing"""
+        while True:
+            try:
+                return future.result(timeout=1)
+            except FutureTimeout:
+                if self.store.cancel_requested(job_id):
+                    raise JobCancelled()
+
+    def _run_job(self, job):
+        job_id = job["id"]
+        start_time = time.time()
+        self.store.set_job(job_id, status="running", started=start_time)
+        engine = RAGEngine(model=job["model"], namespace=job["namespace"])
+        entries = self.store.files(job_id)
+        pending = [entry for entry in entries if entry["status"] in ("queued", "running")]
+        last_save = time.time()
+        dirty = False
+        cancelled = False
+        failures = 0
+
+        # Files below the streaming threshold are parsed ahead on worker processes
+        # (as process_uploaded_files does); larger ones stream in bounded batches
+        threshold = engine.stream_threshold_mb * 1024 * 1024
+        small = [entry for entry in pending if entry["size"] < threshold]
+        workers = min(engine.ingest_workers, len(small))
+        pool = None
+        if workers > 1:
+            # spawn: forking a process that already holds torch/OpenMP threads can deadlock
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            print(f"[JOBS] Parsing {len(small)} file(s) on {workers} workers")
+        ahead = iter(small)
+        futures = {}
+
+        def _fill():
+            # At most two parsed files per worker wait for the embedder
+            for entry in ahead:
+                futures[entry["id"]] = pool.submit(load_and_split, entry["path"], entry["name"], entry["file_hash"])
+                if len(futures) >= 2 * workers:
+                    break
+
+        try:
+            for entry in pending:
+                if self.store.cancel_requested(job_id):
+                    cancelled = True
+                    break
+                self.store.set_file(entry["id"], status="running", chunks=0)
+
+                def on_batch(file_name, chunks_done, batches_done, file_id=entry["id"]):
+                    self.store.set_file(file_id, chunks=chunks_done)
+                    if self.store.cancel_requested(job_id):
+                        raise JobCancelled()
+
+                file_start = time.time()
+                try:
+                    if pool is not None and entry["size"] < threshold:
+                        _fill()
+                        parsed, _ = self._parsed(futures.pop(entry["id"]), job_id)
+                        chunks = engine.ingest_chunks(parsed, entry["name"], entry["file_hash"],
+                                                      progress_callback=on_batch, save=False)
+                    else:
+                        chunks = engine.ingest_path(entry["path"], entry["name"], entry["file_hash"],
+                                                    progress_callback=on_batch, save=False)
+                    self.store.set_file(entry["id"], status="done" if chunks else "skipped",
+                                        chunks=chunks, seconds=time.time() - file_start)
+                    dirty = dirty or bool(chunks)
+                except JobCancelled:
+                    self.store.set_file(entry["id"], status="cancelled", chunks=0, seconds=time.time() - file_start)
+                    cancelled = True
+                    break
+                except Exception as e:
+                    failures += 1
+                    self.store.set_file(entry["id"], status="failed", error=str(e), seconds=time.time() - file_start)
+                    print(f"[JOBS] {entry['name']} failed: {e}")
+                if os.path.exists(entry["path"]):
+                    os.unlink(entry["path"])
+                if dirty and time.time() - last_save >= SAVE_INTERVAL:
+                    engine._save_vectorstore()
+                    last_save = time.time()
+                    dirty = False
+        finally:
+            if pool is not None:
+                for future in futures.values():
+                    future.cancel()
+                pool.shutdown(wait=False)
+
+        if dirty:
+            engine._save_vectorstore()
+        if cancelled:
+            self.store.cancel_pending(job_id)
+            status = "cancelled"
+        else:
+            status = "failed" if failures and failures == len(entries) else "done"
+        self.store.set_job(job_id, status=status, finished=time.time())
+        shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+        print(f"[JOBS] {job_id} {status} in {time.time() - start_time:.2f}s")
+
+
+def get_ingest_queue():
+    """The process-wide ingest queue (created, and interrupted jobs resumed, on first use)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestQueue()
+        return _queue
@@ -0,0 +1,172 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+
+
+# Identifiers keep their inner punctuation (ERR-4021, A12.B/3, user_id) and are
+# also indexed by their parts, so "4021" and "err-4021" both match
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./:#][a-z0-9]+)*")
+_PART_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were what when where which who why will with how do does".split()
+)
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.append(token)
+        tokens.extend(part for part in parts if part not in _STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk text, kept in SQLite next to the FAISS
+    snapshots and updated in place as chunks are added or removed.
+    Documents are keyed by docstore id, so hits resolve through the vectorstore.
+    """
+
+    def __init__(self, path, k1=1.2, b=0.75, max_df=0.5):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        # Terms in more than this share of chunks barely move BM25 but have the
+        # longest posting lists; they are skipped when rarer query terms exist
+        self.max_df = max_df
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self, create=False):
+        if self._conn is None:
+            if not os.path.exists(self.path):
+                if not create:
+                    return None
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL,"
+                " PRIMARY KEY (term, doc_id)) WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);"
+                "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+                "INSERT OR IGNORE INTO stats VALUES ('docs', 0), ('length', 0);"
+            )
+        return self._conn
+
+    def count(self):
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return 0
+            return conn.execute("SELECT value FROM stats WHERE key = 'docs'").fetchone()[0]
+
+    def add(self, ids, texts):
+        """Index (id, text) pairs in one transaction"""
+        with self._lock:
+            conn = self._connect(create=True)
+            docs = []
+            postings = []
+            df = Counter()
+            total_length = 0
+            for doc_id, text in zip(ids, texts):
+                tokens = tokenize(text)
+                counts = Counter(tokens)
+                docs.append((doc_id, len(tokens)))
+                postings.extend((term, doc_id, tf) for term, tf in counts.items())
+                df.update(counts.keys())
+                total_length += len(tokens)
+            with conn:
+                conn.executemany("INSERT INTO docs VALUES (?, ?)", docs)
+                conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+                conn.executemany(
+                    "INSERT INTO terms VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                    df.items()
+                )
+                conn.execute("UPDATE stats SET value = value + ? WHERE key = 'docs'", (len(docs),))
+                conn.execute("UPDATE stats SET value = value + ? WHERE key = 'length'", (total_length,))
+
+    def delete(self, ids):
+        with self._lock:
+            conn = self._connect()
+            if conn is None or not ids:
+                return
+            with conn:
+                for start in range(0, len(ids), 500):
+                    batch = list(ids[start:start + 500])
+                    marks = ",".join("?" * len(batch))
+                    rows = conn.execute(
+                        f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs WHERE id IN ({marks})", batch
+                    ).fetchone()
+                    conn.execute(
+                        f"UPDATE terms SET df = df - (SELECT COUNT(*) FROM postings"
+                        f" WHERE postings.term = terms.term AND doc_id IN ({marks}))"
+                        f" WHERE term IN (SELECT term FROM postings WHERE doc_id IN ({marks}))",
+                        batch + batch
+                    )
+                    conn.execute(f"DELETE FROM postings WHERE doc_id IN ({marks})", batch)
+                    conn.execute(f"DELETE FROM docs WHERE id IN ({marks})", batch)
+                    conn.execute("UPDATE stats SET value = value - ? WHERE key = 'docs'", (rows[0],))
+                    conn.execute("UPDATE stats SET value = value - ? WHERE key = 'length'", (rows[1],))
+                conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def search(self, query, k=6):
+        """Top-k (doc_id, bm25 score), best first; scoring and top-k run inside SQLite"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            conn = self._connect()
+            if conn is None or not terms:
+                return []
+            n_docs, total_length = [
+                value for _, value in conn.execute("SELECT key, value FROM stats ORDER BY key").fetchall()
+            ]
+            if not n_docs:
+                return []
+            avg_length = total_length / n_docs
+            marks = ",".join("?" * len(terms))
+            dfs = dict(conn.execute(f"SELECT term, df FROM terms WHERE term IN ({marks})", terms).fetchall())
+            if not dfs:
+                return []
+            selective = {term: df for term, df in dfs.items() if df <= self.max_df * n_docs}
+            idf = {
+                term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for term, df in (selective or dfs).items()
+            }
+            values = ", ".join("(?, ?)" for _ in idf)
+            # CROSS JOIN keeps the query terms as the outer loop (posting list lookups by term)
+            return conn.execute(
+                f"WITH q(term, idf) AS (VALUES {values})"
+                f" SELECT p.doc_id, SUM(q.idf * p.tf * ? / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS score"
+                f" FROM q CROSS JOIN postings p ON p.term = q.term CROSS JOIN docs d ON d.id = p.doc_id"
+                f" GROUP BY p.doc_id ORDER BY score DESC LIMIT ?",
+                [value for item in idf.items() for value in item]
+                + [self.k1 + 1, self.k1, self.b, self.b, avg_length, k]
+            ).fetchall()
+
+    def clear(self):
+        """Close and delete the index files (the namespace is being reset)"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.unlink(self.path + suffix)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked key lists: score = sum(1 / (k + rank)). Returns keys best first."""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] += 1.0 / (k + rank)
+    return [key for key, _ in scores.most_common()]
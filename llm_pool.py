@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# One set of context/generation settings for every chat model, so answers
+# (and the context budget) do not change shape after a model switch.
+# RAG_NUM_CTX / RAG_NUM_PREDICT / RAG_NUM_GPU override them globally.
+DEFAULT_PROFILE = {
+    "temperature": 0.2,
+    "num_ctx": 2048,
+    "num_predict": 256,
+    "timeout": 120,
+    "keep_alive": "10m",
+}
+
+# Per-model adjustments on top of DEFAULT_PROFILE (prefix match on the model name)
+MODEL_PROFILES = {
+    "deepseek-r1": {"num_predict": 512},   # emits its reasoning before the answer
+    "qwen3": {"num_predict": 512},
+}
+
+_lock = threading.Lock()
+_clients = {}      # (base_url, timeout, client_kwargs) -> (ollama.Client, ollama.AsyncClient)
+_llms = {}         # (model, profile items) -> ChatOllama
+_warm_state = {}   # model -> {"status", "seconds", "error"}
+_warm_futures = {}
+_warm_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ollama-warm-up")
+
+
+def base_url():
+    return os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+
+def model_profile(model, **overrides):
+    """Settings for `model`: defaults, then per-model, then env, then call overrides"""
+    profile = dict(DEFAULT_PROFILE)
+    for prefix, settings in MODEL_PROFILES.items():
+        if model.startswith(prefix):
+            profile.update(settings)
+    for key, env in (("num_ctx", "RAG_NUM_CTX"), ("num_predict", "RAG_NUM_PREDICT"), ("num_gpu", "RAG_NUM_GPU")):
+        if os.getenv(env):
+            profile[key] = int(os.getenv(env))
+    profile.update(overrides)
+    return profile
+
+
+def _shared_clients(url, timeout=None, client_kwargs=None):
+    """
+    One pooled HTTP client pair per Ollama server and client settings, shared
+    by every ChatOllama that uses the same timeout and client_kwargs
+    """
+    if timeout is None:
+        timeout = DEFAULT_PROFILE["timeout"]
+    client_kwargs = dict(client_kwargs or {})
+    key = (url, timeout, repr(sorted(client_kwargs.items())))
+    with _lock:
+        if key not in _clients:
+            from ollama import AsyncClient, Client
+            _clients[key] = (
+                Client(host=url, timeout=timeout, **client_kwargs),
+                AsyncClient(host=url, timeout=timeout, **client_kwargs),
+            )
+        return _clients[key]
+
+
+def get_llm(model, **overrides):
+    """Cached, configured ChatOllama for `model` (created once per model + settings)"""
+    profile = model_profile(model, **overrides)
+    url = base_url()
+    key = (url, model, repr(sorted(profile.items())))
+    with _lock:
+        llm = _llms.get(key)
+    if llm is not None:
+        return llm
+
+    from langchain_ollama import ChatOllama
+    llm = ChatOllama(model=model, base_url=url, **profile)
+    client, async_client = _shared_clients(url, profile.get("timeout"), profile.get("client_kwargs"))
+    # ChatOllama opens its own connection pool per instance; reuse one with the same settings
+    if hasattr(llm, "_client"):
+        llm._client = client
+    if hasattr(llm, "_async_client"):
+        llm._async_client = async_client
+    with _lock:
+        return _llms.setdefault(key, llm)
+
+
+def warm_up_model(model):
+    """
+    Ask Ollama to load `model` now (an empty prompt only loads it), with the
+    same num_ctx the chat client will use - a different value would reload it.
+    """
+    profile = model_profile(model)
+    state = {"status": "loading", "started": time.time()}
+    _warm_state[model] = state
+    try:
+        client, _ = _shared_clients(base_url(), profile["timeout"], profile.get("client_kwargs"))
+        options = {"num_ctx": profile["num_ctx"]}
+        if "num_gpu" in profile:
+            options["num_gpu"] = profile["num_gpu"]
+        client.generate(model=model, prompt="", keep_alive=profile["keep_alive"], options=options)
+        state.update(status="ready", seconds=time.time() - state["started"])
+        print(f"[LLM] {model} loaded in {state['seconds']:.2f}s")
+    except Exception as e:
+        state.update(status="error", error=str(e))
+        print(f"[LLM] Could not warm up {model}: {e}")
+    return state
+
+
+def warm_up_model_async(model):
+    """Start (or join) a background load of `model`; returns a Future"""
+    with _lock:
+        future = _warm_futures.get(model)
+        state = _warm_state.get(model) or {}
+        # A loaded model stays resident for keep_alive; re-send well before that lapses
+        fresh = state.get("status") == "ready" and time.time() - state["started"] < 300
+        if future is not None and (not future.done() or fresh):
+            return future
+        future = _warm_pool.submit(warm_up_model, model)
+        _warm_futures[model] = future
+        return future
+
+
+def warm_state(model):
+    """{"status": "loading" | "ready" | "error", ...} or None if never warmed"""
+    return _warm_state.get(model)
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+# Seconds; covers cache hits (ms) up to slow CPU generations (a minute)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + list(extra or [])
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Trace:
+    """
+    Stage timings of one request (a query or an ingest), e.g.
+    condense -> embed -> retrieve -> prompt -> llm_prefill -> llm_decode.
+    Every stage is also recorded in the process-wide histograms.
+    """
+
+    def __init__(self, registry, kind, **attributes):
+        self.registry = registry
+        self.kind = kind
+        self.id = uuid.uuid4().hex[:12]
+        self.attributes = attributes
+        self.stages = []   # [(stage, seconds)] in completion order
+        self.start = time.time()
+        self.seconds = None
+
+    @contextmanager
+    def stage(self, name, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time, **labels)
+
+    def add(self, name, seconds, **labels):
+        self.stages.append((name, seconds))
+        self.registry.observe(f"{self.kind}_stage_seconds", seconds, stage=name, **labels)
+        self.registry.emit({"event": "span", "trace": self.id, "kind": self.kind, "stage": name,
+                            "seconds": round(seconds, 6), **labels})
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        if self.seconds is not None:
+            return self
+        self.seconds = time.time() - self.start
+        self.registry.observe(f"{self.kind}_seconds", self.seconds)
+        self.registry.finish_trace(self)
+        return self
+
+    def as_dict(self):
+        return {
+            "trace": self.id,
+            "kind": self.kind,
+            "start": self.start,
+            "seconds": self.seconds,
+            "stages": [{"stage": name, "seconds": round(seconds, 6)} for name, seconds in self.stages],
+            **self.attributes,
+        }
+
+
+class Metrics:
+    """
+    In-process metrics: counters, gauges, histograms and recent traces.
+    - prometheus_text() renders the Prometheus text exposition format
+    - sinks receive every span/trace as a dict (JSON log lines by default);
+      add_sink() plugs in anything else
+    Stages called while a trace is active (see current_trace) attach to it.
+    """
+
+    def __init__(self, prefix="rag", keep_traces=50):
+        self.prefix = prefix
+        self._counters = {}     # name -> {label_key: value}
+        self._gauges = {}
+        self._histograms = {}   # name -> {label_key: [bucket counts..., sum, count]}
+        self._traces = {}       # kind -> deque of finished traces
+        self._keep_traces = keep_traces
+        self._sinks = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # -- recording -------------------------------------------------------
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = [0] * len(BUCKETS) + [0.0, 0]
+            row = series[key]
+            index = bisect.bisect_left(BUCKETS, seconds)
+            if index < len(BUCKETS):
+                row[index] += 1
+            row[-2] += seconds
+            row[-1] += 1
+
+    @property
+    def current_trace(self):
+        return getattr(self._local, "trace", None)
+
+    @contextmanager
+    def trace(self, kind, **attributes):
+        """Start a trace for this thread; stages recorded via span() join it"""
+        with self.attach(Trace(self, kind, **attributes)) as trace:
+            yield trace
+
+    @contextmanager
+    def attach(self, trace):
+        """Make an existing trace current in this thread (e.g. inside an executor job)"""
+        previous = self.current_trace
+        self._local.trace = trace
+        try:
+            yield trace
+        finally:
+            self._local.trace = previous
+
+    @contextmanager
+    def span(self, stage, kind=None, **labels):
+        """Time a stage; recorded on the current trace, else as a standalone histogram sample"""
+        trace = self.current_trace
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            if trace is not None and (kind is None or kind == trace.kind):
+                trace.add(stage, seconds, **labels)
+            else:
+                kind = kind or "query"
+                self.observe(f"{kind}_stage_seconds", seconds, stage=stage, **labels)
+                self.emit({"event": "span", "kind": kind, "stage": stage, "seconds": round(seconds, 6), **labels})
+
+    def finish_trace(self, trace):
+        with self._lock:
+            self._traces.setdefault(trace.kind, deque(maxlen=self._keep_traces)).append(trace)
+        self.emit(dict(trace.as_dict(), event="trace"))
+
+    # -- export ----------------------------------------------------------
+
+    def add_sink(self, sink):
+        """sink(record: dict) is called for every span and finished trace"""
+        self._sinks.append(sink)
+
+    def emit(self, record):
+        if not self._sinks:
+            return
+        record = dict(record, ts=round(time.time(), 6))
+        for sink in list(self._sinks):
+            try:
+                sink(record)
+            except Exception as e:
+                print(f"[METRICS] Sink failed: {e}")
+
+    def recent_traces(self, kind, limit=10):
+        with self._lock:
+            return [trace.as_dict() for trace in list(self._traces.get(kind, ()))[-limit:]]
+
+    def last_trace(self, kind):
+        traces = self.recent_traces(kind, limit=1)
+        return traces[0] if traces else None
+
+    def stage_summary(self, kind):
+        """{stage: {"count", "avg_seconds"}} from the histograms"""
+        with self._lock:
+            series = dict(self._histograms.get(f"{kind}_stage_seconds", {}))
+        summary = {}
+        for key, row in series.items():
+            stage = dict(key).get("stage")
+            entry = summary.setdefault(stage, {"count": 0, "total_seconds": 0.0})
+            entry["count"] += row[-1]
+            entry["total_seconds"] += row[-2]
+        return {
+            stage: {"count": entry["count"], "avg_seconds": entry["total_seconds"] / entry["count"]}
+            for stage, entry in summary.items() if entry["count"]
+        }
+
+    def snapshot(self):
+        """Everything as plain JSON-able data"""
+        with self._lock:
+            def _series(table):
+                return {
+                    name: [dict(labels=dict(key), value=value) for key, value in series.items()]
+                    for name, series in table.items()
+                }
+            return {
+                "counters": _series(self._counters),
+                "gauges": _series(self._gauges),
+                "histograms": {
+                    name: [
+                        dict(labels=dict(key), count=row[-1], sum=row[-2],
+                             buckets=dict(zip(map(str, BUCKETS), row[:len(BUCKETS)])))
+                        for key, row in series.items()
+                    ]
+                    for name, series in self._histograms.items()
+                },
+            }
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value}")
+            for name, series in sorted(self._gauges.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} gauge")
+                for key, value in series.items():
+                    lines.append(f"{metric}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for key, row in series.items():
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, row):
+                        cumulative += count
+                        lines.append(f"{metric}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{metric}_bucket{_format_labels(key, [('le', '+Inf')])} {row[-1]}")
+                    lines.append(f"{metric}_sum{_format_labels(key)} {row[-2]:.6f}")
+                    lines.append(f"{metric}_count{_format_labels(key)} {row[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Atomic write for node_exporter's textfile collector"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+class JsonLogSink:
+    """One JSON object per line, to a file or stdout"""
+
+    def __init__(self, target="stdout"):
+        self.target = target
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            if self.target in ("stdout", "-"):
+                print(line, flush=True)
+            else:
+                with open(self.target, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+
+# Process-wide registry; RAG_METRICS_LOG=stdout|<path> turns on JSON logs
+metrics = Metrics()
+if os.getenv("RAG_METRICS_LOG"):
+    metrics.add_sink(JsonLogSink(os.getenv("RAG_METRICS_LOG")))
+
+# RAG_METRICS_PROM_FILE=<path> rewrites a Prometheus textfile after every request
+if os.getenv("RAG_METRICS_PROM_FILE"):
+    def _write_prom_file(record, _path=os.getenv("RAG_METRICS_PROM_FILE")):
+        if record.get("event") == "trace":
+            metrics.write_prometheus(_path)
+
+    metrics.add_sink(_write_prom_file)
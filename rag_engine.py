@@ -1,30 +1,534 @@
 import os
+import re
 import time
+import asyncio
+import uuid
+import hashlib
 import tempfile
-from langchain_ollama import ChatOllama
-from langchain_huggingface import HuggingFaceEmbeddings
+import importlib.util
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import asynccontextmanager
+
+# Heavy modules (torch, format loaders, the Ollama client) are imported on first
+# use so that importing this module - in the app or in ingest workers - is cheap
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
-
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    Docx2txtLoader,
-    TextLoader,
-    CSVLoader,
-    UnstructuredExcelLoader,
-    JSONLoader,
-    UnstructuredXMLLoader,
-    UnstructuredRTFLoader
-)
-
-try:
-    from langchain_community.document_loaders import UnstructuredImageLoader
-    IMAGE_SUPPORT = True
-except ImportError:
-    IMAGE_SUPPORT = False
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import PromptTemplate, format_document
+from langchain_core.documents import Document
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from embedders import create_embedder, backend_name
+import index_store
+import ann_index
+from context_builder import ContextBuilder
+from answer_cache import SemanticAnswerCache
+from chat_memory import ChatMemory, MEMORY_STRATEGIES
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from tabular import COLUMN_INDEX, TABULAR_TYPES, ColumnIndex, chunk_cells, iter_table_chunks
+from metrics import metrics, Trace
+from llm_pool import get_llm, warm_up_model_async
+
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# How follow-up questions are turned into a retrieval query (all skip when there is no history)
+# - llm:      full rewrite with the chat model (most accurate, one extra LLM round-trip)
+# - fast_llm: rewrite with a small model (RAG_CONDENSE_MODEL)
+# - concat:   no LLM - search with recent user turns + the question
+# - none:     search with the question as typed
+CONDENSE_STRATEGIES = ("llm", "fast_llm", "concat", "none")
+# hybrid: MiniLM vectors + BM25 keywords fused by reciprocal rank (finds exact IDs/codes)
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+DEFAULT_NAMESPACE = "default"
+DEFAULT_VECTOR_DIR = os.path.join("vectors", "faiss_index")
+_NAMESPACE_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# FIXED: Better prompt that asks to use ALL context
+QA_PROMPT = PromptTemplate.from_template("""You are answering questions based on provided document context. Use ALL the context below to give a complete answer.
+
+Context from documents:
+{context}
+
+Question: {question}
+
+Instructions:
+- Read through ALL the context carefully
+- If listing items (like questions), list ALL of them that appear in the context
+- If information is incomplete, say so
+- Answer based ONLY on the context above
+
+Answer:""")
+# Follow-up rewrite for the llm / fast_llm strategies
+CONDENSE_PROMPT = PromptTemplate.from_template("""Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
+
+Chat History:
+{chat_history}
+Follow Up Input: {question}
+Standalone question:""")
+# How each packed chunk is rendered into {context}
+DOCUMENT_PROMPT = PromptTemplate.from_template("{page_content}")
+DOCUMENT_SEPARATOR = "\n\n"
+
+# Process-wide resources shared by every RAGEngine (i.e. every Streamlit session)
+_shared_lock = threading.RLock()
+_shared_embeddings = None
+_shared_reranker = None
+_shared_indexes = {}   # vector_dir -> SharedIndex
+
+
+@asynccontextmanager
+async def _no_gate():
+    yield
+
+
+def _has_history(memory):
+    """True once a conversation has turns (follow-ups bypass the answer cache)"""
+    return bool(memory and memory.load_memory_variables({}).get("chat_history"))
+
+
+class SharedIndex:
+    """
+    One namespace's vectorstore plus its source bookkeeping, shared by every
+    engine attached to that namespace. `lock` serialises index writes against
+    searches.
+    """
+    
+    def __init__(self, vector_dir):
+        self.vector_dir = vector_dir
+        self.vectorstore = None
+        self.source_ids = {}      # source name -> docstore ids of its chunks
+        self.source_hashes = {}   # source name -> sha256 of the uploaded file
+        self.version = 0          # manifest version of the snapshot on disk
+        self.generation = 0       # bumped on every add/delete; keys the answer cache
+        self.changes = []         # [("add", ids, vectors) | ("delete", ids)] not saved yet
+        self.snapshot_due = False  # next save writes the whole index, not just the changes
+        self.compacting = False   # a background ann_index.Compaction is running
+        self.index_config = {"index_type": "flat"}   # ANN type + build/search params
+        self.lock = threading.RLock()
+        # BM25 index over the same chunks, updated alongside the vectors
+        self.lexical = LexicalIndex(os.path.join(vector_dir, "lexical.sqlite"))
+        # Exact cell values of spreadsheet chunks -> chunk ids (tabular.py)
+        self.columns = ColumnIndex(os.path.join(vector_dir, "columns.sqlite"))
+        # Shared by every session on this namespace; keyed on generation
+        self.answer_cache = SemanticAnswerCache(
+            threshold=float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("RAG_ANSWER_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("RAG_ANSWER_CACHE_SIZE", "512"))
+        )
+    
+    def track(self, chunks, ids):
+        """Record which docstore ids belong to which source file"""
+        for chunk, doc_id in zip(chunks, ids):
+            source = chunk.metadata.get('source', 'Unknown')
+            self.source_ids.setdefault(source, []).append(doc_id)
+            if chunk.metadata.get('file_hash'):
+                self.source_hashes[source] = chunk.metadata['file_hash']
+    
+    def rebuild_source_map(self):
+        """Rebuild the source -> ids map from a loaded vectorstore"""
+        self.source_ids = {}
+        self.source_hashes = {}
+        docstore = self.vectorstore.docstore
+        if hasattr(docstore, "source_rows"):
+            # Chunk store: read the columns directly instead of decoding every chunk
+            for doc_id, source, file_hash in docstore.source_rows():
+                source = source or 'Unknown'
+                self.source_ids.setdefault(source, []).append(doc_id)
+                if file_hash:
+                    self.source_hashes[source] = file_hash
+            return
+        ids = list(self.vectorstore.index_to_docstore_id.values())
+        docs = [docstore.search(doc_id) for doc_id in ids]
+        self.track(docs, ids)
+    
+    def rebuild_lexical(self):
+        """Re-index every chunk for BM25 (index missing or out of step with the snapshot)"""
+        start_time = time.time()
+        self.lexical.clear()
+        docstore = self.vectorstore.docstore
+        ids = list(self.vectorstore.index_to_docstore_id.values())
+        for start in range(0, len(ids), 5000):
+            batch = ids[start:start + 5000]
+            self.lexical.add(batch, [docstore.search(doc_id).page_content for doc_id in batch])
+        print(f"[RAG] Built keyword index over {len(ids)} chunks in {time.time() - start_time:.2f}s")
+    
+    def table_ids(self):
+        """Docstore ids of the chunks of spreadsheet sources"""
+        return [
+            doc_id for source, ids in self.source_ids.items()
+            if detect_file_type(source) in TABULAR_TYPES for doc_id in ids
+        ]
+    
+    def rebuild_columns(self):
+        """Re-index spreadsheet cell values from the stored chunks (index missing or out of step)"""
+        start_time = time.time()
+        self.columns.clear()
+        docstore = self.vectorstore.docstore
+        ids = self.table_ids()
+        for start in range(0, len(ids), 5000):
+            batch = ids[start:start + 5000]
+            self.columns.add(batch, [chunk_cells(docstore.search(doc_id)) for doc_id in batch])
+        print(f"[RAG] Built column index over {len(ids)} table chunks in {time.time() - start_time:.2f}s")
+    
+    def corpus_changed(self):
+        """Chunks were added or removed: cached answers may be stale"""
+        self.generation += 1
+        self.answer_cache.invalidate()
+    
+    def reset(self):
+        self.corpus_changed()
+        self.lexical.clear()
+        self.columns.clear()
+        self.vectorstore = None
+        self.source_ids = {}
+        self.source_hashes = {}
+        self.version = 0
+        self.changes = []
+        self.snapshot_due = False
+        self.index_config = {"index_type": "flat"}
+
+
+def namespace_dir(namespace):
+    """On-disk index directory of a tenant/session namespace"""
+    if namespace == DEFAULT_NAMESPACE:
+        return DEFAULT_VECTOR_DIR
+    if not _NAMESPACE_RE.match(namespace or ""):
+        raise ValueError(f"Invalid namespace: {namespace!r} (use letters, digits, '-' or '_')")
+    return os.path.join("vectors", "tenants", namespace, "faiss_index")
+
+
+def get_shared_embeddings():
+    """Load the embedding model once per process"""
+    global _shared_embeddings
+    with _shared_lock:
+        if _shared_embeddings is not None:
+            return _shared_embeddings
+        
+        print("[RAG] Loading embeddings...")
+        base_embeddings = create_embedder(EMBEDDING_MODEL)
+        backend = backend_name(base_embeddings)
+        
+        # Cache lives outside faiss_index so clearing documents keeps prior work
+        embedding_cache = EmbeddingCache(
+            os.path.join("vectors", "embedding_cache.sqlite"),
+            max_entries=int(os.getenv("RAG_EMBED_CACHE_MAX", "200000"))
+        )
+        _shared_embeddings = CachedEmbeddings(
+            base_embeddings,
+            embedding_cache,
+            # hf keeps the original key so existing cache entries stay valid
+            model_key=f"{EMBEDDING_MODEL}|normalize=True" + (f"|backend={backend}" if backend != "hf" else "")
+        )
+        print(f"[RAG] Embedding backend: {backend}")
+        return _shared_embeddings
+
+
+def get_shared_reranker():
+    """Load the cross-encoder once per process (CPU; it only sees a few dozen pairs per query)"""
+    global _shared_reranker
+    with _shared_lock:
+        if _shared_reranker is None:
+            from reranker import CrossEncoderReranker
+            _shared_reranker = CrossEncoderReranker(
+                cache_size=int(os.getenv("RAG_RERANK_CACHE_SIZE", "20000"))
+            )
+        return _shared_reranker
+
+
+def get_shared_index(vector_dir, embeddings):
+    """Return the process-wide SharedIndex for a directory, loading it from disk once"""
+    with _shared_lock:
+        if vector_dir in _shared_indexes:
+            return _shared_indexes[vector_dir]
+        
+        shared = SharedIndex(vector_dir)
+        _shared_indexes[vector_dir] = shared
+        if not os.path.exists(vector_dir):
+            return shared
+        
+        try:
+            start_time = time.time()
+            print("[RAG] Loading existing vectorstore...")
+            shared.vectorstore, manifest = index_store.load_snapshot(vector_dir, embeddings)
+            if manifest:
+                shared.version = manifest["version"]
+                # Journal replayed into RAM: checkpoint it with the next save
+                shared.snapshot_due = bool(manifest.get("replayed"))
+                shared.index_config = manifest.get("index", shared.index_config)
+                ann_index.apply_search_params(shared.vectorstore.index, shared.index_config)
+            elif index_store.has_legacy_index(vector_dir):
+                # One-time migration away from the pickled FAISS.save_local format
+                from langchain_community.vectorstores import FAISS
+                print("[RAG] Migrating pickled index to snapshot format...")
+                shared.vectorstore = FAISS.load_local(
+                    vector_dir, 
+                    embeddings, 
+                    allow_dangerous_deserialization=True
+                )
+                shared.version = index_store.save_snapshot(
+                    vector_dir, shared.vectorstore, extra={"index": shared.index_config}
+                )
+                shared.vectorstore, _ = index_store.load_snapshot(vector_dir, embeddings)
+            
+            if shared.vectorstore:
+                shared.rebuild_source_map()
+                if shared.lexical.count() != len(shared.vectorstore.index_to_docstore_id):
+                    shared.rebuild_lexical()
+                if COLUMN_INDEX and shared.columns.doc_ids() != set(shared.table_ids()):
+                    shared.rebuild_columns()
+                print(f"[RAG] Loaded saved vectors ✅ ({len(shared.source_ids)} files, "
+                      f"v{shared.version}, {shared.index_config['index_type']}, "
+                      f"{time.time() - start_time:.2f}s)")
+        except Exception as e:
+            print(f"[RAG] Could not load vectors: {e}")
+            shared.reset()
+        return shared
+
+
+def warm_up(namespace=DEFAULT_NAMESPACE, model=None):
+    """
+    Pre-load everything a first query needs: the embedding model (plus one
+    encode to initialise torch kernels), the saved index and the Ollama client.
+    With `model`, Ollama is asked to load it at the same time.
+    """
+    start_time = time.time()
+    if model:
+        warm_up_model_async(model)
+    embeddings = get_shared_embeddings()
+    embeddings.embed_query("warm up")
+    shared = get_shared_index(namespace_dir(namespace), embeddings)
+    import langchain_ollama  # noqa: F401
+    if os.getenv("RAG_RERANK", "0") == "1":
+        get_shared_reranker()
+    print(f"[RAG] Warm-up finished in {time.time() - start_time:.2f}s")
+    return shared.vectorstore is not None
+
+
+def detect_file_type(file_name):
+    return os.path.splitext(file_name)[1].lower().lstrip('.')
+
+
+# Large files are streamed: uploads are copied in blocks and plain text is read
+# in blocks, so no step needs the whole file in memory at once
+UPLOAD_BLOCK_SIZE = 4 * 1024 * 1024
+TEXT_BLOCK_CHARS = 1_000_000
+TEXT_TYPES = ('txt', 'md', 'yaml', 'yml')
+IMAGE_TYPES = ('png', 'jpg', 'jpeg', 'bmp', 'tiff', 'gif')
+
+
+def iter_upload_blocks(uploaded_file, block_size=UPLOAD_BLOCK_SIZE):
+    """Yield an upload's bytes in fixed-size blocks"""
+    if hasattr(uploaded_file, "read") and hasattr(uploaded_file, "seek"):
+        uploaded_file.seek(0)
+        while True:
+            block = uploaded_file.read(block_size)
+            if not block:
+                break
+            yield block
+        uploaded_file.seek(0)
+    else:
+        data = memoryview(uploaded_file.getvalue())
+        for start in range(0, len(data), block_size):
+            yield data[start:start + block_size]
+
+
+def spill_upload(uploaded_file, block_size=UPLOAD_BLOCK_SIZE):
+    """Copy an upload to a temp file block by block; returns (path, sha256)"""
+    digest = hashlib.sha256()
+    suffix = f".{detect_file_type(uploaded_file.name)}"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        try:
+            for block in iter_upload_blocks(uploaded_file, block_size):
+                digest.update(block)
+                tmp_file.write(block)
+        except Exception:
+            tmp_file.close()
+            os.unlink(tmp_file.name)
+            raise
+    return tmp_file.name, digest.hexdigest()
+
+
+def _read_text_blocks(file_path, block_chars=TEXT_BLOCK_CHARS):
+    """Yield a text file as Documents of about `block_chars`, cut at line breaks"""
+    offset = 0
+    carry = ""
+    with open(file_path, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(block_chars)
+            text = carry + block
+            if not block:
+                if text.strip():
+                    yield Document(page_content=text, metadata={"source": file_path, "offset": offset})
+                return
+            # Prefer a paragraph break in the second half, then a line break
+            cut = text.rfind("\n\n", len(text) // 2)
+            if cut < 0:
+                cut = text.rfind("\n", len(text) // 2)
+            cut = len(text) if cut < 0 else cut + 1
+            yield Document(page_content=text[:cut], metadata={"source": file_path, "offset": offset})
+            carry = text[cut:]
+            offset += cut
+
+
+def _document_loader(file_path):
+    """LangChain loader for the file's extension, or None if there is none"""
+    file_type = detect_file_type(file_path)
+    
+    # Each loader is imported only when its format is first seen
+    if file_type == 'pdf':
+        from langchain_community.document_loaders import PyPDFLoader
+        return PyPDFLoader(file_path)
+    elif file_type in ['docx', 'doc']:
+        from langchain_community.document_loaders import Docx2txtLoader
+        return Docx2txtLoader(file_path)
+    elif file_type == 'rtf':
+        from langchain_community.document_loaders import UnstructuredRTFLoader
+        return UnstructuredRTFLoader(file_path)
+    elif file_type == 'csv':
+        from langchain_community.document_loaders import CSVLoader
+        return CSVLoader(file_path, encoding='utf-8')
+    elif file_type in ['xlsx', 'xls', 'ods']:
+        from langchain_community.document_loaders import UnstructuredExcelLoader
+        return UnstructuredExcelLoader(file_path, mode="elements")
+    elif file_type == 'json':
+        from langchain_community.document_loaders import JSONLoader
+        return JSONLoader(file_path=file_path, jq_schema='.', text_content=False)
+    elif file_type == 'xml':
+        from langchain_community.document_loaders import UnstructuredXMLLoader
+        return UnstructuredXMLLoader(file_path)
+    elif file_type in IMAGE_TYPES:
+        try:
+            from langchain_community.document_loaders import UnstructuredImageLoader
+        except ImportError:
+            return None
+        return UnstructuredImageLoader(file_path)
+    return None
+
+
+def lazy_load_document(file_path):
+    """
+    Yield a file's Documents one at a time (a page, a row, a text block).
+    Loaders without a real lazy_load() still parse the whole file first.
+    """
+    file_type = detect_file_type(file_path)
+    file_name = os.path.basename(file_path)
+    if file_type in TEXT_TYPES:
+        yield from _read_text_blocks(file_path)
+        return
+    loader = _document_loader(file_path)
+    if loader is None:
+        label = f"Image: {file_name}" if file_type in IMAGE_TYPES else f"Unsupported: {file_type}"
+        yield Document(page_content=f"[{label}]", metadata={"source": file_name})
+        return
+    yield from loader.lazy_load()
+
+
+def load_document(file_path):
+    """Load a file into Documents using the loader for its extension"""
+    try:
+        return list(lazy_load_document(file_path))
+    except Exception as e:
+        file_name = os.path.basename(file_path)
+        print(f"[RAG] Error loading {file_name}: {e}")
+        return [Document(page_content=f"[Error: {file_name}]", metadata={"source": file_name})]
+
+
+def _text_splitter():
+    # FIXED: Larger chunks with more overlap to keep questions together
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1200,  # Larger chunks to keep related content together
+        chunk_overlap=300,  # More overlap to prevent splitting questions
+        separators=["\n\n\n", "\n\n", "\n", ". ", " ", ""],
+        length_function=len,
+        add_start_index=True  # lets the context builder merge overlapping neighbours exactly
+    )
+
+
+def split_documents(documents, file_name, file_hash):
+    """Split loaded Documents into chunks tagged with their source file"""
+    chunks = _text_splitter().split_documents(documents)
+    
+    for chunk in chunks:
+        # Text read in blocks: make start_index relative to the whole file
+        offset = chunk.metadata.pop('offset', None)
+        if offset is not None and 'start_index' in chunk.metadata:
+            chunk.metadata['start_index'] += offset
+        chunk.metadata['source'] = file_name
+        chunk.metadata['file_hash'] = file_hash
+    return chunks
+
+
+# Modules pandas needs to read each spreadsheet type (csv needs none extra)
+TABULAR_READERS = {'xlsx': 'openpyxl', 'xlsm': 'openpyxl', 'xls': 'xlrd', 'ods': 'odf'}
+
+
+def _use_tabular(file_path):
+    """Spreadsheets take the row-batch path when pandas and the format's reader are installed"""
+    file_type = detect_file_type(file_path)
+    if file_type not in TABULAR_TYPES:
+        return False
+    modules = ["pandas"] + ([TABULAR_READERS[file_type]] if file_type in TABULAR_READERS else [])
+    return all(importlib.util.find_spec(module) is not None for module in modules)
+
+
+def iter_chunks(file_path, file_name, file_hash):
+    """Yield a file's chunks lazily"""
+    if _use_tabular(file_path):
+        chunks = iter_table_chunks(file_path, file_name, file_hash)
+        try:
+            first = next(chunks, None)
+        except Exception as e:
+            # Nothing yielded yet, so the generic loader can still take over;
+            # a failure later on propagates (ingest_path drops the partial file)
+            print(f"[RAG] Tabular load failed for {file_name}, using the generic loader: {e}")
+        else:
+            if first is not None:
+                yield first
+                yield from chunks
+            return
+    for document in lazy_load_document(file_path):
+        yield from split_documents([document], file_name, file_hash)
+
+
+def iter_chunk_batches(file_path, file_name, file_hash, max_chunks=256, max_chars=8_000_000):
+    """
+    Load and split a file lazily, yielding lists of chunks capped by count and
+    total text, so a batch can be embedded and indexed before the next is read.
+    """
+    batch = []
+    chars = 0
+    for chunk in iter_chunks(file_path, file_name, file_hash):
+        batch.append(chunk)
+        chars += len(chunk.page_content)
+        if len(batch) >= max_chunks or chars >= max_chars:
+            yield batch
+            batch = []
+            chars = 0
+    if batch:
+        yield batch
+
+
+def _pop_table_cells(chunks):
+    """Take the column-index payload out of the metadata before it reaches the docstore"""
+    return [chunk.metadata.pop("table_cells", None) for chunk in chunks]
+
+
+def load_and_split(file_path, file_name, file_hash):
+    """Worker entry point: parse and chunk one file (runs in a child process)"""
+    start_time = time.time()
+    if _use_tabular(file_path):
+        try:
+            return list(iter_table_chunks(file_path, file_name, file_hash)), time.time() - start_time
+        except Exception as e:
+            print(f"[RAG] Tabular load failed for {file_name}, using the generic loader: {e}")
+    documents = load_document(file_path)
+    if not documents:
+        return [], time.time() - start_time
+    chunks = split_documents(documents, file_name, file_hash)
+    return chunks, time.time() - start_time
 
 
 class RAGEngine:
@@ -35,91 +539,103 @@ class RAGEngine:
     - Better prompting
     """
     
-    def __init__(self, model="qwen2.5:7b"):
-        print(f"[RAG] Initializing with {model}")
+    def __init__(self, model="qwen2.5:7b", ingest_workers=None, namespace=DEFAULT_NAMESPACE,
+                 index_type=None, recall_target=0.95, index_params=None,
+                 vector_storage=None, rescore=None, condense_strategy=None, memory_strategy=None,
+                 retrieval_mode=None, retrieval_k=None, rerank=None, rerank_candidates=None):
+        print(f"[RAG] Initializing with {model} (namespace: {namespace})")
         self.model = model
-        self.vectorstore = None
-        self.chain = None
-        self.llm = None
+        self.namespace = namespace
+        self.ingest_workers = ingest_workers or int(os.getenv("RAG_INGEST_WORKERS", "0")) or os.cpu_count() or 1
+        # ANN index: "auto" picks flat/hnsw/ivf_flat/ivf_pq from the chunk count
+        self.index_type = index_type or os.getenv("RAG_INDEX_TYPE", "auto")
+        self.recall_target = recall_target
+        self.index_params = index_params or {}
+        # Optional float16/int8 vectors in the index, re-scored against float32 kept on disk
+        self.vector_storage = vector_storage or os.getenv("RAG_VECTOR_STORAGE", "float32")
+        self.rescore = rescore if rescore is not None else os.getenv("RAG_RESCORE", "0") == "1"
+        self.condense_strategy = condense_strategy or os.getenv("RAG_CONDENSE_STRATEGY", "llm")
+        self.condense_model = os.getenv("RAG_CONDENSE_MODEL", "qwen2.5:0.5b")
+        self._condense_llm = None
+        self.condense_stats = {}   # strategy -> [calls, total seconds]
+        self.retrieval_mode = retrieval_mode or os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {self.retrieval_mode} (choose from {', '.join(RETRIEVAL_MODES)})")
+        self.retrieval_k = retrieval_k or int(os.getenv("RAG_RETRIEVAL_K", "6"))
+        self.retrieval_stats = {}   # retriever -> [calls, total seconds]
+        self.last_trace = None      # stage breakdown of this session's latest query
+        # Optional cross-encoder pass: over-fetch candidates, keep the best k
+        self.rerank = os.getenv("RAG_RERANK", "0") == "1" if rerank is None else rerank
+        self.rerank_candidates = rerank_candidates or int(os.getenv("RAG_RERANK_CANDIDATES", "20"))
+        self.rerank_budget = float(os.getenv("RAG_RERANK_BUDGET_MS", "500")) / 1000
+        # Files above the threshold are ingested in bounded micro-batches (ingest_file_streaming)
+        self.stream_threshold_mb = float(os.getenv("RAG_STREAM_THRESHOLD_MB", "50"))
+        self.ingest_memory_mb = float(os.getenv("RAG_INGEST_MEMORY_MB", "256"))
+        self.ingest_batch = int(os.getenv("RAG_INGEST_BATCH", "512"))
+        # Chat history kept per session: buffer/window/tokens/summary (see chat_memory.py)
+        self.memory_strategy = memory_strategy or os.getenv("RAG_MEMORY_STRATEGY", "window")
+        self.memory_turns = int(os.getenv("RAG_MEMORY_TURNS", "6"))
+        self.memory_tokens = int(os.getenv("RAG_MEMORY_TOKENS", "1000"))
+        self.llm = None   # set by setup_chain() once there are documents to ask about
         self.memory = None
         self.processed_documents = []
         
-        print("[RAG] Loading embeddings...")
-        import torch
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        print(f"[RAG] Using device: {device.upper()}")
-        
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': device},
-            encode_kwargs={'normalize_embeddings': True, 'batch_size': 32}
-        )
+        # One embedder per process; one index per namespace, shared across sessions
+        self.embeddings = get_shared_embeddings()
+        self.embedding_cache = self.embeddings.cache
+        self.vector_dir = namespace_dir(namespace)
+        self._index = get_shared_index(self.vector_dir, self.embeddings)
         
-        self.vector_dir = os.path.join("vectors", "faiss_index")
-        if os.path.exists(self.vector_dir):
-            try:
-                print("[RAG] Loading existing vectorstore...")
-                self.vectorstore = FAISS.load_local(
-                    self.vector_dir, 
-                    self.embeddings, 
-                    allow_dangerous_deserialization=True
-                )
-                print(f"[RAG] Loaded saved vectors ✅")
-            except Exception as e:
-                print(f"[RAG] Could not load vectors: {e}")
+        # A saved index is immediately queryable
+        if self.vectorstore:
+            self.setup_chain()
         
         print("[RAG] Ready!")
     
+    @property
+    def vectorstore(self):
+        return self._index.vectorstore
+    
+    @vectorstore.setter
+    def vectorstore(self, value):
+        self._index.vectorstore = value
+    
+    @property
+    def _source_ids(self):
+        return self._index.source_ids
+    
+    @property
+    def _source_hashes(self):
+        return self._index.source_hashes
+    
     def _detect_file_type(self, file_name):
-        return os.path.splitext(file_name)[1].lower().lstrip('.')
+        return detect_file_type(file_name)
     
     def _load_document_by_type(self, file_path):
-        file_type = self._detect_file_type(file_path)
-        file_name = os.path.basename(file_path)
-        
-        try:
-            if file_type == 'pdf':
-                return PyPDFLoader(file_path).load()
-            elif file_type in ['docx', 'doc']:
-                return Docx2txtLoader(file_path).load()
-            elif file_type in ['txt', 'md']:
-                return TextLoader(file_path, encoding='utf-8').load()
-            elif file_type == 'rtf':
-                return UnstructuredRTFLoader(file_path).load()
-            elif file_type == 'csv':
-                return CSVLoader(file_path, encoding='utf-8').load()
-            elif file_type in ['xlsx', 'xls', 'ods']:
-                return UnstructuredExcelLoader(file_path, mode="elements").load()
-            elif file_type == 'json':
-                return JSONLoader(file_path=file_path, jq_schema='.', text_content=False).load()
-            elif file_type == 'xml':
-                return UnstructuredXMLLoader(file_path).load()
-            elif file_type in ['yaml', 'yml']:
-                return TextLoader(file_path, encoding='utf-8').load()
-            elif file_type in ['png', 'jpg', 'jpeg', 'bmp', 'tiff', 'gif']:
-                if IMAGE_SUPPORT:
-                    return UnstructuredImageLoader(file_path).load()
-                else:
-                    from langchain.schema import Document
-                    return [Document(page_content=f"[Image: {file_name}]", metadata={"source": file_name})]
-            else:
-                from langchain.schema import Document
-                return [Document(page_content=f"[Unsupported: {file_type}]", metadata={"source": file_name})]
-        except Exception as e:
-            print(f"[RAG] Error loading {file_name}: {e}")
-            from langchain.schema import Document
-            return [Document(page_content=f"[Error: {file_name}]", metadata={"source": file_name})]
+        return load_document(file_path)
+    
+    def file_fingerprint(self, uploaded_file):
+        """SHA-256 of an uploaded file's content"""
+        digest = hashlib.sha256()
+        for block in iter_upload_blocks(uploaded_file):
+            digest.update(block)
+        return digest.hexdigest()
+    
+    def is_file_indexed(self, file_name, file_hash):
+        """True if this exact file content is already in the vectorstore"""
+        return self._source_hashes.get(file_name) == file_hash
+    
+    def indexed_files(self):
+        """Names of all files currently in the vectorstore"""
+        return sorted(self._source_ids)
     
     def process_uploaded_file(self, uploaded_file):
         """Process uploaded file - BETTER CHUNKING"""
         file_name = uploaded_file.name
-        file_type = self._detect_file_type(file_name)
         
         tmp_path = None
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            tmp_path, file_hash = spill_upload(uploaded_file)
             
             documents = self._load_document_by_type(tmp_path)
             
@@ -129,18 +645,7 @@ class RAGEngine:
             if not documents:
                 return []
             
-            # FIXED: Larger chunks with more overlap to keep questions together
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1200,  # Larger chunks to keep related content together
-                chunk_overlap=300,  # More overlap to prevent splitting questions
-                separators=["\n\n\n", "\n\n", "\n", ". ", " ", ""],
-                length_function=len
-            )
-            
-            chunks = text_splitter.split_documents(documents)
-            
-            for chunk in chunks:
-                chunk.metadata['source'] = file_name
+            chunks = split_documents(documents, file_name, file_hash)
             
             self.processed_documents.append(file_name)
             print(f"[RAG] {file_name}: {len(chunks)} chunks (larger size for better context)")
@@ -152,6 +657,193 @@ class RAGEngine:
             print(f"[RAG] Error processing {file_name}: {e}")
             raise
     
+    def process_uploaded_files(self, uploaded_files, max_workers=None, progress_callback=None):
+        """
+        Load and split many files on a process pool.
+        Returns (chunks, errors); a failing file never aborts the batch.
+        progress_callback(file_name, done, total, error) is called once per file.
+        """
+        max_workers = max_workers or self.ingest_workers
+        total = len(uploaded_files)
+        start_time = time.time()
+        
+        results = {}
+        errors = {}
+        done = 0
+        
+        def _finish(file_name, chunks=None, error=None, elapsed=0.0):
+            nonlocal done
+            done += 1
+            if error is None:
+                results[file_name] = chunks
+                metrics.observe("ingest_stage_seconds", elapsed, stage="load_split", format=detect_file_type(file_name))
+                metrics.inc("ingest_files", status="ok")
+                metrics.inc("ingest_chunks", len(chunks))
+                print(f"[RAG] {file_name}: {len(chunks)} chunks in {elapsed:.2f}s")
+            else:
+                errors[file_name] = error
+                metrics.inc("ingest_files", status="error")
+                print(f"[RAG] Error processing {file_name}: {error}")
+            if progress_callback:
+                progress_callback(file_name, done, total, error)
+        
+        # Uploads live in this process, so spill them to disk before fanning out
+        jobs = []
+        for uploaded_file in uploaded_files:
+            file_name = uploaded_file.name
+            try:
+                tmp_path, file_hash = spill_upload(uploaded_file)
+                jobs.append((tmp_path, file_name, file_hash))
+            except Exception as e:
+                _finish(file_name, error=str(e))
+        
+        try:
+            if max_workers <= 1 or len(jobs) <= 1:
+                for tmp_path, file_name, file_hash in jobs:
+                    try:
+                        chunks, elapsed = load_and_split(tmp_path, file_name, file_hash)
+                        _finish(file_name, chunks, elapsed=elapsed)
+                    except Exception as e:
+                        _finish(file_name, error=str(e))
+            else:
+                # spawn: forking a process that already holds torch/OpenMP threads can deadlock
+                context = multiprocessing.get_context("spawn")
+                workers = min(max_workers, len(jobs))
+                print(f"[RAG] Loading {len(jobs)} files on {workers} workers...")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    futures = {
+                        pool.submit(load_and_split, tmp_path, file_name, file_hash): file_name
+                        for tmp_path, file_name, file_hash in jobs
+                    }
+                    for future in as_completed(futures):
+                        file_name = futures[future]
+                        try:
+                            chunks, elapsed = future.result()
+                            _finish(file_name, chunks, elapsed=elapsed)
+                        except Exception as e:
+                            _finish(file_name, error=str(e))
+        finally:
+            for tmp_path, _, _ in jobs:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        
+        # Merge in upload order so chunk order is deterministic
+        all_chunks = []
+        for uploaded_file in uploaded_files:
+            if uploaded_file.name in results:
+                all_chunks.extend(results[uploaded_file.name])
+                self.processed_documents.append(uploaded_file.name)
+        
+        print(f"[RAG] Loaded {len(results)}/{total} files -> {len(all_chunks)} chunks in {time.time() - start_time:.2f}s")
+        return all_chunks, errors
+    
+    def should_stream(self, uploaded_file):
+        """True if the upload is big enough for ingest_file_streaming"""
+        size = getattr(uploaded_file, "size", None)
+        if size is None:
+            size = len(uploaded_file.getvalue())
+        return size >= self.stream_threshold_mb * 1024 * 1024
+    
+    def _stream_batch_limits(self):
+        """(max chunks, max chars) per micro-batch under the ingest memory ceiling"""
+        budget = int(self.ingest_memory_mb * 1024 * 1024)
+        # Per chunk: its text (~4 bytes/char as str, loader page and chunk copies)
+        # plus float32 vectors from the model, the cache and the index append
+        per_chunk = 1200 * 4 + 384 * 4 * 3   # MiniLM: 384 dims
+        max_chunks = max(16, min(self.ingest_batch, budget // per_chunk))
+        return max_chunks, max(1_000_000, budget // 8)
+    
+    def ingest_file_streaming(self, uploaded_file, progress_callback=None):
+        """
+        Memory-bounded ingest of one (large) upload: copy it to disk in blocks,
+        then ingest_path(). Returns the number of chunks indexed.
+        """
+        tmp_path, file_hash = spill_upload(uploaded_file)
+        try:
+            return self.ingest_path(tmp_path, uploaded_file.name, file_hash, progress_callback)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    
+    def ingest_path(self, file_path, file_name, file_hash, progress_callback=None, save=True):
+        """
+        Load a file page by page / row by row and embed + index micro-batches as
+        they fill; each batch is searchable as soon as it is added. The snapshot
+        is saved once at the end (save=False leaves that to the caller).
+        Returns the number of chunks indexed (0 if the file was already indexed).
+        progress_callback(file_name, chunks_done, batches_done) runs after each
+        batch; an exception it raises aborts the file, removing its partial chunks.
+        """
+        if self.is_file_indexed(file_name, file_hash):
+            print(f"[RAG] {file_name} already indexed")
+            return 0
+        max_chunks, max_chars = self._stream_batch_limits()
+        print(f"[RAG] Streaming {file_name} ({os.path.getsize(file_path) / 1e6:.1f} MB) "
+              f"in batches of <= {max_chunks} chunks")
+        batches = iter_chunk_batches(file_path, file_name, file_hash, max_chunks, max_chars)
+        return self._ingest_batches(batches, file_name, progress_callback, save, stage="stream")
+    
+    def ingest_chunks(self, chunks, file_name, file_hash, progress_callback=None, save=True):
+        """ingest_path() for a file already split elsewhere (e.g. by load_and_split on a worker process)"""
+        if self.is_file_indexed(file_name, file_hash):
+            print(f"[RAG] {file_name} already indexed")
+            return 0
+        max_chunks, _ = self._stream_batch_limits()
+        batches = (chunks[start:start + max_chunks] for start in range(0, len(chunks), max_chunks))
+        return self._ingest_batches(batches, file_name, progress_callback, save, stage="index")
+    
+    def _ingest_batches(self, batches, file_name, progress_callback, save, stage):
+        """
+        Index one file's chunk batches. An older version of the file stays
+        searchable until the new one is complete and is only then removed; if
+        indexing fails or is cancelled the new chunks are dropped instead.
+        """
+        start_time = time.time()
+        with self._index.lock:
+            old_ids = list(self._source_ids.get(file_name, []))
+            old_hash = self._source_hashes.get(file_name)
+        total = 0
+        batches_done = 0
+        try:
+            for batch in batches:
+                self.add_documents(batch, save=False)
+                total += len(batch)
+                batches_done += 1
+                metrics.inc("ingest_chunks", len(batch))
+                if progress_callback:
+                    progress_callback(file_name, total, batches_done)
+        except BaseException:
+            # A half-indexed file would look indexed (its hash is tracked) - drop it
+            metrics.inc("ingest_files", status="error")
+            with self._index.lock:
+                keep = set(old_ids)
+                new_ids = [doc_id for doc_id in self._source_ids.get(file_name, []) if doc_id not in keep]
+                self._source_ids.pop(file_name, None)
+                self._source_hashes.pop(file_name, None)
+                if old_ids:
+                    self._source_ids[file_name] = old_ids
+                if old_hash:
+                    self._source_hashes[file_name] = old_hash
+                self._remove_ids(new_ids)
+            raise
+        if total:
+            if old_ids:
+                with self._index.lock:
+                    doomed = set(old_ids)
+                    self._source_ids[file_name] = [
+                        doc_id for doc_id in self._source_ids.get(file_name, []) if doc_id not in doomed
+                    ]
+                    self._remove_ids(old_ids)
+                print(f"[RAG] Replaced the previous version of {file_name} ({len(old_ids)} chunks)")
+            if save:
+                self._save_vectorstore()
+            self.processed_documents.append(file_name)
+        metrics.observe("ingest_stage_seconds", time.time() - start_time, stage=stage,
+                        format=detect_file_type(file_name))
+        metrics.inc("ingest_files", status="ok")
+        print(f"[RAG] {file_name}: {total} chunks in {batches_done} batches, {time.time() - start_time:.2f}s")
+        return total
+    
     def create_vectorstore(self, chunks):
         """Create FAISS vectorstore"""
         print(f"[RAG] Creating vectorstore from {len(chunks)} chunks...")
@@ -160,131 +852,291 @@ class RAGEngine:
         if not chunks:
             raise ValueError("No chunks provided")
         
-        self.vectorstore = FAISS.from_documents(chunks, embedding=self.embeddings)
-        
-        elapsed = time.time() - start_time
-        print(f"[RAG] Vectorstore created in {elapsed:.2f}s")
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        cells = _pop_table_cells(chunks)
+        with metrics.span("embed", kind="ingest"):
+            vectors = np.asarray(
+                self.embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32
+            )
+        config = self._resolve_index_config(len(chunks), vectors.shape[1])
+        with metrics.span("index", kind="ingest", index_type=config["index_type"]):
+            vectorstore = self._new_vectorstore(ann_index.build_index(vectors, config), chunks, ids)
+        if config["rescore"]:
+            vectorstore.full_vectors = vectors
+            vectorstore.rescore_factor = config["rescore_factor"]
         
+        with self._index.lock:
+            self._index.reset()
+            self.vectorstore = vectorstore
+            self._index.index_config = config
+            self._index.track(chunks, ids)
+            with metrics.span("lexical_index", kind="ingest"):
+                self._index.lexical.add(ids, [chunk.page_content for chunk in chunks])
+            if any(pairs is not None for pairs in cells):
+                with metrics.span("column_index", kind="ingest"):
+                    self._index.columns.add(ids, cells)
+            metrics.set_gauge("index_chunks", len(ids), namespace=self.namespace)
+            
+            elapsed = time.time() - start_time
+            print(f"[RAG] Vectorstore created in {elapsed:.2f}s")
+            
+            self._save_vectorstore()
+    
+    def _resolve_index_config(self, n_vectors, dim, index_type=None, **index_params):
+        return ann_index.resolve_config(
+            n_vectors, dim, index_type or self.index_type, self.recall_target,
+            dict(self.index_params, **index_params),
+            storage=self.vector_storage, rescore=self.rescore
+        )
+    
+    def _new_vectorstore(self, index, chunks, ids):
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        vectorstore = ann_index.RescoringFAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+            index_to_docstore_id=dict(enumerate(ids)),
+        )
+        vectorstore.buffer_dir = self.vector_dir
+        return vectorstore
+    
+    def rebuild_index(self, index_type=None, **index_params):
+        """Rebuild the ANN index from the stored vectors (e.g. to change type or nlist)"""
+        if not self.vectorstore:
+            raise ValueError("Vectorstore not initialized")
+        with self._index.lock:
+            self._rebuild_index(index_type, index_params)
+            self._save_vectorstore()
+    
+    def _rebuild_index(self, index_type, index_params):
+        index_store.make_writable(self.vectorstore)
+        ids, buffer = ann_index.live_vectors(self.vectorstore)
+        vectors = buffer.rows
+        config = self._resolve_index_config(len(ids), self.vectorstore.index.d, index_type, **index_params)
+        print(f"[RAG] Rebuilding {len(ids)} vectors as {config['index_type']}/{config['storage']}...")
+        self.vectorstore.index = ann_index.build_index(vectors, config)
+        self.vectorstore.index_to_docstore_id = dict(enumerate(ids))
+        self.vectorstore.full_vectors = vectors if config["rescore"] else None
+        self.vectorstore.rescore_factor = config["rescore_factor"]
+        self.vectorstore.positions_changed()
+        self._index.index_config = config
+        self._index.snapshot_due = True
+    
+    def _maybe_compact(self):
+        """Drop HNSW tombstones / stale re-scoring rows in the background once too many pile up"""
+        if self._index.compacting or ann_index.dead_fraction(self.vectorstore) < ann_index.COMPACT_FRACTION:
+            return
+        job = ann_index.Compaction(self.vectorstore)
+        self._index.compacting = True
+        threading.Thread(target=self._compact, args=(job,), name="rag-compact", daemon=True).start()
+    
+    def _compact(self, job):
+        shared = self._index
+        try:
+            job.build()
+            with shared.lock:
+                if shared.vectorstore is not None and job.apply(shared.vectorstore):
+                    shared.snapshot_due = True
+        except Exception as e:
+            print(f"[RAG] Compaction failed: {e}")
+        finally:
+            shared.compacting = False
+    
+    def quantization_report(self, storage=None, sample_size=100_000):
+        """Memory saved and recall lost by quantizing the current corpus (float16/int8)"""
+        if not self.vectorstore:
+            raise ValueError("Vectorstore not initialized")
+        with self._index.lock:
+            vectors = ann_index.live_vectors(self.vectorstore)[1].rows
+        if len(vectors) > sample_size:
+            vectors = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        config = self._resolve_index_config(len(vectors), vectors.shape[1])
+        config["storage"] = storage or self.vector_storage
+        return ann_index.quantization_report(vectors, config)
+    
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Tune recall vs latency of IVF (nprobe) / HNSW (ef_search) searches"""
+        if not self.vectorstore:
+            raise ValueError("Vectorstore not initialized")
+        with self._index.lock:
+            if nprobe is not None:
+                self._index.index_config["nprobe"] = nprobe
+            if ef_search is not None:
+                self._index.index_config["ef_search"] = ef_search
+            ann_index.apply_search_params(self.vectorstore.index, self._index.index_config)
+    
+    def _maybe_upgrade_index(self):
+        """In auto mode, move to the next index type once the corpus outgrows the current one"""
+        if self.index_type != "auto":
+            return
+        wanted = ann_index.choose_index_type(len(self.vectorstore.index_to_docstore_id), self.recall_target)
+        if wanted != self._index.index_config.get("index_type"):
+            self._rebuild_index(wanted, {})
+    
+    def _save_vectorstore(self):
+        """
+        Persist the changes since the last save: appended to the chunk store and
+        vector journal, with a full index snapshot only when one is due
+        """
         os.makedirs(self.vector_dir, exist_ok=True)
         try:
-            self.vectorstore.save_local(self.vector_dir)
-            print(f"[RAG] Vectorstore saved ✅")
+            with self._index.lock, metrics.span("save", kind="ingest"):
+                extra = {"index": self._index.index_config}
+                if self._index.snapshot_due:
+                    self._index.version = index_store.save_snapshot(
+                        self.vector_dir, self.vectorstore, extra, self._index.changes
+                    )
+                    self._index.snapshot_due = False
+                else:
+                    self._index.version = index_store.save_changes(
+                        self.vector_dir, self.vectorstore, self._index.changes, extra
+                    )
+            print(f"[RAG] Vectorstore saved ✅ (v{self._index.version})")
         except Exception as e:
             print(f"[RAG] Could not save vectorstore: {e}")
     
-    def setup_chain(self):
-        """Setup chain - MORE CHUNKS RETRIEVED"""
+    def add_documents(self, chunks, save=True):
+        """Embed and append chunks to the existing vectorstore"""
+        if not chunks:
+            return
         if not self.vectorstore:
-            raise ValueError("Vectorstore not initialized")
-        
-        print(f"[RAG] Setting up chain with {self.model}...")
+            self.create_vectorstore(chunks)
+            return
         
-        # Faster settings for qwen2.5:7b
-        self.llm = ChatOllama(
-            model=self.model,
-            temperature=0.2,
-            num_predict=256,      # ← Reduce from 512 to 256
-            num_ctx=2048,         # ← Reduce from 4096 to 2048
-            timeout=120,
-            keep_alive="10m",
-            num_gpu=1             # ← Add this line
-        )
-        
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            output_key="answer"
-        )
+        start_time = time.time()
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        cells = _pop_table_cells(chunks)
+        # Embed outside the lock so searches keep running meanwhile
+        with metrics.span("embed", kind="ingest"):
+            embeddings = np.asarray(
+                self.embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32
+            )
+        with self._index.lock:
+            with metrics.span("index", kind="ingest", index_type=self._index.index_config["index_type"]):
+                index_store.make_writable(self.vectorstore)
+                # RescoringFAISS also appends the re-scoring rows
+                self.vectorstore.add_embeddings(
+                    list(zip([chunk.page_content for chunk in chunks], embeddings)),
+                    metadatas=[chunk.metadata for chunk in chunks],
+                    ids=ids
+                )
+            self._index.changes.append(("add", ids, embeddings))
+            self._index.track(chunks, ids)
+            self._index.corpus_changed()
+            with metrics.span("lexical_index", kind="ingest"):
+                self._index.lexical.add(ids, [chunk.page_content for chunk in chunks])
+            if any(pairs is not None for pairs in cells):
+                with metrics.span("column_index", kind="ingest"):
+                    self._index.columns.add(ids, cells)
+            metrics.set_gauge("index_chunks", len(self.vectorstore.index_to_docstore_id), namespace=self.namespace)
+            print(f"[RAG] Added {len(chunks)} chunks in {time.time() - start_time:.2f}s")
+            self._maybe_upgrade_index()
+            
+            if save:
+                self._save_vectorstore()
+    
+    def _delete_source(self, source):
+        """Drop a file's chunks from the index without saving"""
+        with self._index.lock:
+            ids = self._source_ids.pop(source, [])
+            self._source_hashes.pop(source, None)
+            removed = self._remove_ids(ids)
+        if removed:
+            print(f"[RAG] Removed {source}: {removed} chunks")
+        return removed
+    
+    def _remove_ids(self, ids):
+        """Drop chunks from every index (source bookkeeping is the caller's job)"""
+        with self._index.lock:
+            if not ids or not self.vectorstore:
+                return 0
+            
+            with metrics.span("delete", kind="ingest"):
+                index_store.make_writable(self.vectorstore)
+                ann_index.delete_ids(self.vectorstore, ids)
+                self._index.lexical.delete(ids)
+                self._index.columns.delete(ids)
+            self._index.changes.append(("delete", ids))
+            self._index.corpus_changed()
+            self._maybe_compact()
+            metrics.set_gauge("index_chunks", len(self.vectorstore.index_to_docstore_id), namespace=self.namespace)
+            return len(ids)
+    
+    def remove_source(self, source):
+        """Remove every chunk of a file from the vectorstore"""
+        with self._index.lock:
+            removed = self._delete_source(source)
+            if removed:
+                self._save_vectorstore()
+        if source in self.processed_documents:
+            self.processed_documents.remove(source)
+        return removed
+    
+    def replace_source(self, source, chunks):
+        """Swap a file's chunks for a new version, re-embedding only that file (no chunks removes it)"""
+        if not chunks:
+            return self.remove_source(source)
+        stray = {chunk.metadata.get('source', 'Unknown') for chunk in chunks} - {source}
+        if stray:
+            raise ValueError(f"Chunks for {source} include other sources: {', '.join(sorted(stray))}")
+        self._replace_sources([source], chunks)
+        return len(chunks)
+    
+    def update_vectorstore(self, chunks):
+        """Incrementally apply chunks: each source in `chunks` replaces its old version"""
+        if not chunks:
+            raise ValueError("No chunks provided")
+        self._replace_sources({chunk.metadata.get('source', 'Unknown') for chunk in chunks}, chunks)
+    
+    def _replace_sources(self, sources, chunks):
+        """Delete every source in `sources`, then add `chunks`, in one locked step"""
+        if not self.vectorstore:
+            self.create_vectorstore(chunks)
+            return
         
-        # FIXED: Better prompt that asks to use ALL context
-        qa_prompt = PromptTemplate(
-            template="""You are answering questions based on provided document context. Use ALL the context below to give a complete answer.
-
-Context from documents:
-{context}
-
-Question: {question}
-
-Instructions:
-- Read through ALL the context carefully
-- If listing items (like questions), list ALL of them that appear in the context
-- If information is incomplete, say so
-- Answer based ONLY on the context above
-
-Answer:""",
-            input_variables=["context", "question"]
-        )
+        print(f"[RAG] Updating vectorstore: {len(sources)} files, {len(chunks)} chunks...")
+        # Warm the embedding cache first so the locked section only does index work
+        with metrics.span("embed", kind="ingest"):
+            self.embeddings.embed_documents([chunk.page_content for chunk in chunks])
+        with self._index.lock:
+            for source in sources:
+                self._delete_source(source)
+            self.add_documents(chunks, save=False)
+            
+            self._save_vectorstore()
+    
+    def setup_chain(self, condense_strategy=None):
+        """Get the LLM and a fresh chat memory ready for questions"""
+        if not self.vectorstore:
+            raise ValueError("Vectorstore not initialized")
+        self.set_condense_strategy(condense_strategy or self.condense_strategy)
         
-        # FIXED: Retrieve MORE chunks to get complete information
-        self.chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=self.vectorstore.as_retriever(
-                search_type="similarity",  # Simple similarity works better for lists
-                search_kwargs={
-                    "k": 6  # Get 6 chunks instead of 3 (more complete info)
-                }
-            ),
-            memory=self.memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": qa_prompt},
-            verbose=False
-        )
+        print(f"[RAG] Setting up chain with {self.model}...")
+        # Settings come from the shared model profile (llm_pool.DEFAULT_PROFILE)
+        self.llm = get_llm(self.model)
+        self.memory = self._new_memory(self.memory_strategy)
         
-        print(f"[RAG] Chain ready with 6-chunk retrieval ✅")
+        print(f"[RAG] Chain ready with {self.retrieval_k}-chunk {self.retrieval_mode} retrieval ✅")
     
-    def switch_model(self, new_model):
-        """Switch model"""
+    def switch_model(self, new_model, condense_strategy=None):
+        """Switch model (the client is cached and usually already loaded by warm_up_model_async)"""
         if not self.vectorstore:
             raise ValueError("No documents processed")
+        if condense_strategy:
+            self.set_condense_strategy(condense_strategy)
+        if self.memory is None:
+            self.memory = self._new_memory(self.memory_strategy)
         
         print(f"[RAG] Switching to {new_model}...")
-        
-        self.llm = ChatOllama(
-            model=new_model,
-            temperature=0.2,
-            num_predict=512,
-            num_ctx=4096,
-            timeout=120,
-            keep_alive="10m"
-        )
-        
-        qa_prompt = PromptTemplate(
-            template="""You are answering questions based on provided document context. Use ALL the context below to give a complete answer.
-
-Context from documents:
-{context}
-
-Question: {question}
-
-Instructions:
-- Read through ALL the context carefully
-- If listing items (like questions), list ALL of them that appear in the context
-- If information is incomplete, say so
-- Answer based ONLY on the context above
-
-Answer:""",
-            input_variables=["context", "question"]
-        )
-        
-        self.chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=self.vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 6}
-            ),
-            memory=self.memory,
-            return_source_documents=True,
-            combine_docs_chain_kwargs={"prompt": qa_prompt},
-            verbose=False
-        )
+        self.llm = get_llm(new_model)
         
         self.model = new_model
         print(f"[RAG] Switched to {new_model} ✅")
     
     def ask_question(self, question):
         """Ask question with timing and debug info"""
-        if not self.chain:
-            raise ValueError("Chain not initialized")
+        if self.llm is None:
+            raise ValueError("No documents processed")
         
         print(f"\n{'='*60}")
         print(f"[QUERY] {question}")
@@ -293,12 +1145,25 @@ Answer:""",
         total_start = time.time()
         
         try:
-            response = self.chain.invoke({"question": question})
+            with metrics.trace("query", namespace=self.namespace, model=self.model) as trace:
+                query = self._prepare_query(question)
+                sources = query["source_documents"]
+                
+                if query["cached"]:
+                    answer = query["cached"]["answer"]
+                else:
+                    llm_start = time.time()
+                    response = self.llm.invoke(query["prompt"])
+                    answer = response.content
+                    self._record_generation(trace, response.response_metadata, time.time() - llm_start)
+                    self._remember_answer(query, answer)
+                if self.memory:
+                    self.memory.save_context({"question": question}, {"answer": answer})
+                self.last_trace = trace.finish().as_dict()
             
             total_time = time.time() - total_start
             
-            sources = response.get("source_documents", [])
-            print(f"\n[INFO] Retrieved {len(sources)} chunks in {total_time:.2f}s")
+            print(f"\n[INFO] Retrieved {len(sources)} chunks in {query['retrieval_time']:.2f}s")
             print(f"[INFO] Total response time: {total_time:.2f}s")
             
             # Show what was retrieved (for debugging)
@@ -309,7 +1174,7 @@ Answer:""",
             print(f"{'='*60}\n")
             
             return {
-                "answer": response["answer"],
+                "answer": answer,
                 "source_documents": sources
             }
             
@@ -319,18 +1184,532 @@ Answer:""",
             traceback.print_exc()
             raise
     
+    def _prepare_query(self, question):
+        """
+        Everything before generation: condense, embed once, consult the answer
+        cache and - on a miss - retrieve and render the prompt.
+        """
+        start_time = time.time()
+        with metrics.span("condense"):
+            standalone_question, prompt_question = self._condense_question(question)
+        with metrics.span("embed"):
+            embedding = self.embeddings.embed_query(standalone_question)
+        return self._query_context(standalone_question, prompt_question, embedding, start_time,
+                                   use_cache=not _has_history(self.memory))
+    
+    def _answer_settings(self):
+        """Everything besides the model and corpus that changes which answer a question gets"""
+        return (self.retrieval_mode, self.retrieval_k, self.rerank,
+                self.rerank_candidates if self.rerank else None,
+                self.condense_strategy, self.memory_strategy)
+    
+    def _query_context(self, standalone_question, prompt_question, embedding, start_time, use_cache=True):
+        """
+        The part of _prepare_query after embedding: cache lookup, then retrieval
+        + prompt. Follow-ups (use_cache=False) neither read nor fill the cache,
+        since their answer also depends on the conversation.
+        """
+        # Captured up front so an answer built while chunks change is not cached as current
+        generation = self._index.generation
+        settings = self._answer_settings()
+        cached = None
+        if use_cache:
+            with metrics.span("cache_lookup"):
+                cached = self._index.answer_cache.lookup(embedding, self.model, generation, settings)
+            metrics.inc("answer_cache_lookups", result="hit" if cached else "miss")
+        trace = metrics.current_trace
+        if trace:
+            trace.set(cached=bool(cached))
+        if cached:
+            print(f"[CACHE] Answer cache hit (similarity {cached['similarity']:.3f}): {cached['question']}")
+            return {
+                "standalone_question": standalone_question,
+                "embedding": embedding,
+                "generation": generation,
+                "settings": settings,
+                "use_cache": True,
+                "cached": cached,
+                "source_documents": cached["source_documents"],
+                "prompt": None,
+                "retrieval_time": time.time() - start_time,
+            }
+        
+        with metrics.span("retrieve"):
+            sources = self._retrieve(standalone_question, embedding)
+        with metrics.span("prompt"):
+            prompt, packed, prompt_stats = self._build_prompt(prompt_question, sources)
+        metrics.inc("retrieved_chunks", len(sources))
+        metrics.inc("prompt_tokens", prompt_stats["prompt_tokens"])
+        if trace:
+            trace.set(retrieved_chunks=len(sources), packed_chunks=len(packed),
+                      prompt_tokens=prompt_stats["prompt_tokens"])
+        return {
+            "standalone_question": standalone_question,
+            "embedding": embedding,
+            "generation": generation,
+            "settings": settings,
+            "use_cache": use_cache,
+            "cached": None,
+            "source_documents": packed,
+            "prompt": prompt,
+            "prompt_stats": prompt_stats,
+            "retrieval_time": time.time() - start_time,
+        }
+    
+    def _record_generation(self, trace, response_metadata, seconds, first_token=None):
+        """
+        Split LLM time into prefill (prompt processing) and decode. Ollama's own
+        durations are used when present; otherwise time-to-first-token marks the split.
+        """
+        metadata = response_metadata or {}
+        prompt_ns = metadata.get("prompt_eval_duration")
+        decode_ns = metadata.get("eval_duration")
+        if prompt_ns is not None and decode_ns is not None:
+            prefill = prompt_ns / 1e9
+            decode = decode_ns / 1e9
+            overhead = max(0.0, seconds - prefill - decode)   # load, network, scheduling
+            if overhead:
+                trace.add("llm_overhead", overhead)
+        elif first_token is not None:
+            prefill, decode = first_token, seconds - first_token
+        else:
+            trace.add("llm", seconds)
+            return
+        trace.add("llm_prefill", prefill)
+        trace.add("llm_decode", decode)
+        if metadata.get("eval_count"):
+            metrics.inc("generated_tokens", metadata["eval_count"])
+            trace.set(generated_tokens=metadata["eval_count"])
+    
+    def _remember_answer(self, query, answer):
+        if not query["use_cache"]:
+            return
+        self._index.answer_cache.store(
+            query["embedding"], self.model, query["generation"],
+            query["standalone_question"], answer, query["source_documents"], query["settings"]
+        )
+    
+    def answer_cache_stats(self):
+        return self._index.answer_cache.stats()
+    
+    def _retrieve(self, question, embedding=None):
+        """
+        Search the namespace index (held against concurrent writers).
+        In hybrid mode vector and BM25 hits (plus exact spreadsheet-cell matches)
+        are fused with reciprocal rank fusion;
+        with re-ranking on, more candidates are fetched and a cross-encoder keeps k.
+        """
+        k = self.retrieval_k
+        fetch_k = max(k, self.rerank_candidates) if self.rerank else k
+        vector_docs = []
+        lexical_docs = []
+        table_docs = []
+        with self._index.lock:
+            if self.retrieval_mode != "lexical":
+                start_time = time.time()
+                if embedding is not None:
+                    # Reuse the query embedding computed for the answer cache
+                    vector_docs = self.vectorstore.similarity_search_by_vector(embedding, k=fetch_k)
+                else:
+                    vector_docs = self.vectorstore.similarity_search(question, k=fetch_k)
+                self._record_retrieval("vector", start_time)
+            if self.retrieval_mode != "vector":
+                start_time = time.time()
+                docstore = self.vectorstore.docstore
+                for doc_id, _ in self._index.lexical.search(question, fetch_k):
+                    doc = docstore.search(doc_id)
+                    if isinstance(doc, Document):
+                        lexical_docs.append(doc)
+                self._record_retrieval("lexical", start_time)
+                # Exact spreadsheet values named in the question (IDs, codes, names)
+                start_time = time.time()
+                for doc_id, _ in self._index.columns.search(question, fetch_k):
+                    doc = docstore.search(doc_id)
+                    if isinstance(doc, Document):
+                        table_docs.append(doc)
+                if table_docs:
+                    self._record_retrieval("column", start_time)
+        
+        result_lists = [docs for docs in (vector_docs, lexical_docs, table_docs) if docs]
+        if len(result_lists) <= 1:
+            candidates = result_lists[0] if result_lists else []
+        else:
+            by_key = {}
+            rankings = []
+            for docs in result_lists:
+                ranking = []
+                for doc in docs:
+                    key = (doc.metadata.get("source"), doc.metadata.get("start_index"), doc.page_content)
+                    by_key.setdefault(key, doc)
+                    ranking.append(key)
+                rankings.append(ranking)
+            candidates = [by_key[key] for key in reciprocal_rank_fusion(rankings)[:fetch_k]]
+        
+        if not self.rerank or len(candidates) <= k:
+            return candidates[:k]
+        start_time = time.time()
+        docs, stats = get_shared_reranker().rerank(question, candidates, k, self.rerank_budget)
+        self._record_retrieval("rerank", start_time)
+        print(f"[RERANK] Kept {len(docs)} of {stats['candidates']} ({stats['scored']} scored, "
+              f"{stats['cached']} cached, {stats['skipped']} over budget) in {stats['seconds']:.2f}s")
+        return docs
+    
+    def _record_retrieval(self, retriever, start_time):
+        elapsed = time.time() - start_time
+        calls = self.retrieval_stats.setdefault(retriever, [0, 0.0])
+        calls[0] += 1
+        calls[1] += elapsed
+        metrics.observe("retriever_seconds", elapsed, retriever=retriever)
+    
+    def retrieval_latency(self):
+        """Average search time per retriever (vector / lexical), in seconds"""
+        return {
+            retriever: {"calls": calls, "avg_seconds": total / calls}
+            for retriever, (calls, total) in self.retrieval_stats.items() if calls
+        }
+    
+    def set_condense_strategy(self, strategy):
+        if strategy not in CONDENSE_STRATEGIES:
+            raise ValueError(f"Unknown condense strategy: {strategy} (choose from {', '.join(CONDENSE_STRATEGIES)})")
+        self.condense_strategy = strategy
+    
+    def _condense_plan(self, question, memory):
+        """
+        Returns (strategy, result, prompt). `result` is the final
+        (search_query, prompt_question) unless an LLM has to rewrite `prompt`;
+        strategy is None when no condensing happens (no history).
+        """
+        history = memory.load_memory_variables({}).get("chat_history", []) if memory else []
+        strategy = self.condense_strategy
+        if not history or strategy == "none":
+            return None, (question, question), None
+        
+        if strategy == "concat":
+            # Cheap local rewrite: recent user turns give the search its missing context
+            recent = [m.content for m in history if m.type == "human"][-2:]
+            return strategy, (" ".join(recent + [question]), question), None
+        
+        condense_prompt = CONDENSE_PROMPT
+        # Oldest turns go first when the history would overflow the window
+        history = self._context_builder().fit_history(
+            history, condense_prompt.format(question=question, chat_history="")
+        )
+        prompt = condense_prompt.format(
+            question=question, chat_history=get_buffer_string(history)
+        )
+        return strategy, None, prompt
+    
+    def _record_condense(self, strategy, start_time):
+        elapsed = time.time() - start_time
+        metrics.observe("condense_seconds", elapsed, strategy=strategy)
+        calls = self.condense_stats.setdefault(strategy, [0, 0.0])
+        calls[0] += 1
+        calls[1] += elapsed
+        print(f"[INFO] Condensed question ({strategy}) in {elapsed:.2f}s")
+    
+    def _condense_question(self, question):
+        """
+        Turn a follow-up into (search_query, prompt_question) using the
+        configured strategy. Without history both are just the question.
+        """
+        start_time = time.time()
+        strategy, result, prompt = self._condense_plan(question, self.memory)
+        if result is None:
+            search_query = self._condenser_llm(strategy).invoke(prompt).content.strip() or question
+            result = (search_query, search_query)
+        if strategy:
+            self._record_condense(strategy, start_time)
+        return result
+    
+    async def _acondense_question(self, question, memory=None, llm_gate=None):
+        """Async _condense_question against a caller-supplied memory"""
+        start_time = time.time()
+        strategy, result, prompt = self._condense_plan(question, memory)
+        if result is None:
+            async with (llm_gate or _no_gate)():
+                response = await self._condenser_llm(strategy).ainvoke(prompt)
+            search_query = response.content.strip() or question
+            result = (search_query, search_query)
+        if strategy:
+            self._record_condense(strategy, start_time)
+        return result
+    
+    def _condenser_llm(self, strategy):
+        if strategy == "llm":
+            return self.llm
+        if self._condense_llm is None or self._condense_llm.model != self.condense_model:
+            self._condense_llm = get_llm(self.condense_model, temperature=0, num_predict=64, timeout=60)
+        return self._condense_llm
+    
+    def _new_memory(self, strategy):
+        if strategy not in MEMORY_STRATEGIES:
+            raise ValueError(f"Unknown memory strategy: {strategy} (choose from {', '.join(MEMORY_STRATEGIES)})")
+        return ChatMemory(
+            strategy=strategy,
+            max_turns=self.memory_turns,
+            max_tokens=self.memory_tokens,
+            summarizer=self._summarize_history if strategy == "summary" else None
+        )
+    
+    def set_memory_strategy(self, strategy):
+        """Switch how chat history is bounded, keeping the turns the new strategy allows"""
+        memory = self._new_memory(strategy)
+        if self.memory:
+            messages = self.memory.messages
+            if messages and messages[0].type == "system":
+                memory.summary = self.memory.summary
+                messages = messages[1:]
+            for human, ai in zip(messages[::2], messages[1::2]):
+                memory.save_context({"question": human.content}, {"answer": ai.content})
+        self.memory_strategy = strategy
+        self.memory = memory
+        print(f"[RAG] Chat memory: {strategy}")
+    
+    def _summarize_history(self, previous_summary, messages):
+        """Fold older turns into the rolling summary (called from the memory's background thread)"""
+        llm = self._condenser_llm("fast_llm" if self.condense_strategy == "fast_llm" else "llm")
+        start_time = time.time()
+        prompt = (
+            "Update the summary of this conversation about the user's documents. "
+            "Keep names, numbers and open questions; at most 5 sentences.\n\n"
+            f"Current summary:\n{previous_summary or '(none)'}\n\n"
+            f"New turns:\n{get_buffer_string(messages)}\n\n"
+            "Updated summary:"
+        )
+        summary = llm.invoke(prompt).content.strip()
+        print(f"[MEMORY] Summary updated in {time.time() - start_time:.2f}s ({len(summary)} chars)")
+        return summary
+    
+    def condense_latency(self):
+        """Average question-condensing time per strategy, in seconds"""
+        return {
+            strategy: {"calls": calls, "avg_seconds": total / calls}
+            for strategy, (calls, total) in self.condense_stats.items() if calls
+        }
+    
+    def _context_builder(self):
+        return ContextBuilder(
+            num_ctx=getattr(self.llm, "num_ctx", None) or 2048,
+            num_predict=getattr(self.llm, "num_predict", None) or 128
+        )
+    
+    def _build_prompt(self, question, docs):
+        """
+        Render the QA prompt with the retrieved chunks merged, de-duplicated and
+        packed into the model's token budget. Returns (prompt, packed_docs, stats).
+        """
+        builder = self._context_builder()
+        
+        packed, stats = builder.pack(
+            docs, QA_PROMPT.format(context="", question=question), DOCUMENT_SEPARATOR
+        )
+        context = DOCUMENT_SEPARATOR.join(format_document(doc, DOCUMENT_PROMPT) for doc in packed)
+        print(f"[INFO] Prompt tokens: {stats['prompt_tokens']}/{stats['budget']} "
+              f"({stats['retrieved_chunks']} chunks -> {stats['merged_chunks']} merged -> "
+              f"{stats['packed_chunks']} packed)")
+        return QA_PROMPT.format(context=context, question=question), packed, stats
+    
+    def ask_question_stream(self, question):
+        """
+        Streaming variant of ask_question.
+        Retrieval runs up front; returns {"answer_stream", "source_documents"} where
+        answer_stream yields tokens as Ollama produces them.
+        """
+        if self.llm is None:
+            raise ValueError("No documents processed")
+        
+        print(f"\n{'='*60}")
+        print(f"[QUERY] {question}")
+        print(f"{'='*60}")
+        
+        total_start = time.time()
+        
+        try:
+            with metrics.trace("query", namespace=self.namespace, model=self.model) as trace:
+                query = self._prepare_query(question)
+        except Exception as e:
+            print(f"[ERROR] Query failed: {e}")
+            import traceback
+            traceback.print_exc()
+            raise
+        sources = query["source_documents"]
+        
+        def _token_stream():
+            first_token_time = None
+            parts = []
+            llm_start = time.time()
+            response_metadata = {}
+            completed = False
+            
+            def _chunks():
+                for chunk in self.llm.stream(query["prompt"]):
+                    if chunk.response_metadata:
+                        response_metadata.update(chunk.response_metadata)
+                    yield chunk.content
+            
+            # The finally also runs when the consumer stops early or the LLM fails,
+            # so the trace is recorded however the stream ends
+            try:
+                tokens = [query["cached"]["answer"]] if query["cached"] else _chunks()
+                for token in tokens:
+                    if not token:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time() - total_start
+                        trace.set(time_to_first_token=first_token_time)
+                    parts.append(token)
+                    yield token
+                completed = True
+            finally:
+                if not query["cached"]:
+                    self._record_generation(
+                        trace, response_metadata, time.time() - llm_start,
+                        first_token=first_token_time - (llm_start - total_start) if first_token_time else None
+                    )
+                if not completed:
+                    trace.set(stream_completed=False)
+                self.last_trace = trace.finish().as_dict()
+            answer = "".join(parts)
+            if not query["cached"]:
+                self._remember_answer(query, answer)
+            if self.memory:
+                self.memory.save_context({"question": question}, {"answer": answer})
+            
+            total_time = time.time() - total_start
+            print(f"\n[INFO] Retrieved {len(sources)} chunks in {query['retrieval_time']:.2f}s")
+            print(f"[INFO] Time to first token: {(first_token_time or total_time):.2f}s")
+            print(f"[INFO] Total response time: {total_time:.2f}s")
+            print(f"{'='*60}\n")
+        
+        return {
+            "answer_stream": _token_stream(),
+            "source_documents": sources
+        }
+    
+    async def _aprepare_query(self, question, trace, memory=None, embedder=None, llm_gate=None):
+        """_prepare_query for the event loop: LLM calls are awaited, CPU work runs in threads"""
+        loop = asyncio.get_event_loop()
+        start_time = time.time()
+        with trace.stage("condense"):
+            standalone_question, prompt_question = await self._acondense_question(question, memory, llm_gate)
+        with trace.stage("embed"):
+            if embedder is not None:
+                embedding = await embedder(standalone_question)
+            else:
+                embedding = await loop.run_in_executor(None, self.embeddings.embed_query, standalone_question)
+        
+        def _context():
+            with metrics.attach(trace):
+                return self._query_context(standalone_question, prompt_question, embedding, start_time,
+                                           use_cache=not _has_history(memory))
+        
+        return await loop.run_in_executor(None, _context)
+    
+    async def aask_question(self, question, memory=None, embedder=None, llm_gate=None):
+        """
+        Async ask_question for the API server.
+        - memory: the caller's conversation (ChatMemory); None = stateless
+        - embedder: async text -> vector, e.g. a micro-batcher
+        - llm_gate: factory of an async context manager bounding Ollama calls
+        """
+        if self.llm is None:
+            raise ValueError("No documents processed")
+        trace = Trace(metrics, "query", namespace=self.namespace, model=self.model)
+        query = await self._aprepare_query(question, trace, memory, embedder, llm_gate)
+        
+        if query["cached"]:
+            answer = query["cached"]["answer"]
+        else:
+            queued_at = time.time()
+            async with (llm_gate or _no_gate)():
+                trace.add("llm_queue", time.time() - queued_at)
+                llm_start = time.time()
+                response = await self.llm.ainvoke(query["prompt"])
+            answer = response.content
+            self._record_generation(trace, response.response_metadata, time.time() - llm_start)
+            self._remember_answer(query, answer)
+        if memory is not None:
+            memory.save_context({"question": question}, {"answer": answer})
+        
+        trace.finish()
+        print(f"[API] Answered in {trace.seconds:.2f}s ({len(query['source_documents'])} chunks)")
+        return {
+            "answer": answer,
+            "source_documents": query["source_documents"],
+            "cached": bool(query["cached"]),
+            "trace": trace.as_dict(),
+        }
+    
+    async def aask_question_stream(self, question, memory=None, embedder=None, llm_gate=None):
+        """
+        Async ask_question_stream: returns {"answer_stream", "source_documents"}
+        where answer_stream is an async generator of tokens.
+        """
+        if self.llm is None:
+            raise ValueError("No documents processed")
+        trace = Trace(metrics, "query", namespace=self.namespace, model=self.model)
+        query = await self._aprepare_query(question, trace, memory, embedder, llm_gate)
+        
+        async def _token_stream():
+            parts = []
+            llm_start = None
+            first_token = None
+            response_metadata = {}
+            completed = False
+            # Finished in the finally so an abandoned or failed stream still records its trace
+            try:
+                if query["cached"]:
+                    parts.append(query["cached"]["answer"])
+                    trace.set(time_to_first_token=time.time() - trace.start)
+                    yield parts[0]
+                else:
+                    queued_at = time.time()
+                    async with (llm_gate or _no_gate)():
+                        trace.add("llm_queue", time.time() - queued_at)
+                        llm_start = time.time()
+                        async for chunk in self.llm.astream(query["prompt"]):
+                            if chunk.response_metadata:
+                                response_metadata.update(chunk.response_metadata)
+                            if not chunk.content:
+                                continue
+                            if first_token is None:
+                                first_token = time.time() - llm_start
+                                trace.set(time_to_first_token=time.time() - trace.start)
+                            parts.append(chunk.content)
+                            yield chunk.content
+                completed = True
+            finally:
+                if llm_start is not None:
+                    self._record_generation(trace, response_metadata, time.time() - llm_start, first_token=first_token)
+                if not completed:
+                    trace.set(stream_completed=False)
+                trace.finish()
+            
+            answer = "".join(parts)
+            if not query["cached"]:
+                self._remember_answer(query, answer)
+            if memory is not None:
+                memory.save_context({"question": question}, {"answer": answer})
+        
+        return {
+            "answer_stream": _token_stream(),
+            "source_documents": query["source_documents"],
+            "cached": bool(query["cached"]),
+        }
+    
     def clear_documents(self):
-        """Clear all"""
-        self.vectorstore = None
-        self.chain = None
+        """Clear all (this namespace only)"""
         self.llm = None
         self.memory = None
         self.processed_documents = []
         
-        # Also clear saved vectors to force reprocessing with new settings
-        if os.path.exists(self.vector_dir):
-            import shutil
-            shutil.rmtree(self.vector_dir)
-            print("[RAG] Cleared vectors directory")
+        with self._index.lock:
+            self._index.reset()
+            
+            # Also clear saved vectors to force reprocessing with new settings
+            if os.path.exists(self.vector_dir):
+                import shutil
+                shutil.rmtree(self.vector_dir)
+                print("[RAG] Cleared vectors directory")
         
         print("[RAG] Cleared completely")
\ No newline at end of file
@@ -0,0 +1,91 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class CrossEncoderReranker:
+    """
+    Second-stage ranking: scores (query, chunk) pairs with a small
+    cross-encoder on CPU and keeps the best few.
+    - Pairs are scored in batches until `time_budget` seconds are spent;
+      whatever is left unscored keeps its first-stage order after the scored ones
+    - Scores are cached (LRU) per query/chunk text, so repeated and
+      follow-up questions mostly skip the model
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, time_budget=0.5, batch_size=16, cache_size=20000):
+        from sentence_transformers import CrossEncoder
+
+        print(f"[RERANK] Loading {model_name} on CPU...")
+        self.model = CrossEncoder(model_name, device="cpu", max_length=512)
+        self.model_name = model_name
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()   # sha1(query, text) -> score
+        self._cache_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    @staticmethod
+    def _key(query, text):
+        return hashlib.sha1(f"{query}\0{text}".encode("utf-8")).hexdigest()
+
+    def rerank(self, query, docs, top_n, time_budget=None):
+        """Returns (best docs, stats)"""
+        start_time = time.time()
+        time_budget = self.time_budget if time_budget is None else time_budget
+        keys = [self._key(query, doc.page_content) for doc in docs]
+        scores = {}
+        with self._cache_lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+        self.hits += len(scores)
+        pending = [i for i in range(len(docs)) if i not in scores]
+        self.misses += len(pending)
+
+        scored_now = 0
+        with self._model_lock:
+            for start in range(0, len(pending), self.batch_size):
+                if time.time() - start_time > time_budget:
+                    break
+                batch = pending[start:start + self.batch_size]
+                batch_scores = self.model.predict(
+                    [(query, docs[i].page_content) for i in batch], batch_size=self.batch_size
+                )
+                for i, score in zip(batch, batch_scores):
+                    scores[i] = float(score)
+                scored_now += len(batch)
+
+        with self._cache_lock:
+            for i in pending[:scored_now]:
+                self._cache[keys[i]] = scores[i]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        ranked = sorted(scores, key=lambda i: scores[i], reverse=True)
+        ranked += [i for i in range(len(docs)) if i not in scores]
+        stats = {
+            "candidates": len(docs),
+            "scored": scored_now,
+            "cached": len(docs) - len(pending),
+            "skipped": len(pending) - scored_now,
+            "seconds": time.time() - start_time,
+        }
+        return [docs[i] for i in ranked[:top_n]], stats
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
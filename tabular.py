@@ -0,0 +1,315 @@
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+# Spreadsheets skip the generic loader -> splitter path: rows are read in
+# batches, formatted column-wise, and packed into chunks that each repeat the
+# header, so a chunk is readable on its own and cites its exact row range.
+TABULAR_TYPES = ('csv', 'xlsx', 'xlsm', 'xls', 'ods')
+BATCH_ROWS = 5000
+# RAG_COLUMN_INDEX=0 skips the exact-lookup index of cell values
+COLUMN_INDEX = os.getenv("RAG_COLUMN_INDEX", "1") == "1"
+MAX_CELL_CHARS = 64   # longer cells are prose, not lookup keys
+
+
+def _clean_columns(names):
+    columns = []
+    for n, name in enumerate(names, 1):
+        name = "" if name is None else str(name).strip()
+        columns.append(name or f"column_{n}")
+    return columns
+
+
+def _iter_csv(file_path, batch_rows):
+    import pandas as pd
+    reader = pd.read_csv(
+        file_path, dtype=str, keep_default_na=False, chunksize=batch_rows,
+        encoding="utf-8", encoding_errors="replace", on_bad_lines="skip"
+    )
+    first_row = 2   # line 1 is the header
+    for frame in reader:
+        frame.columns = _clean_columns(frame.columns)
+        frame.index = np.arange(first_row, first_row + len(frame))
+        first_row += len(frame)
+        yield None, frame
+
+
+def _iter_xlsx(file_path, batch_rows):
+    """openpyxl read-only mode streams rows instead of loading the whole sheet"""
+    import pandas as pd
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            columns = None
+            rows, numbers = [], []
+            for number, row in enumerate(sheet.iter_rows(values_only=True), 1):
+                if columns is None:
+                    if any(value is not None for value in row):
+                        columns = _clean_columns(row)
+                    continue
+                rows.append(row[:len(columns)])
+                numbers.append(number)
+                if len(rows) >= batch_rows:
+                    yield sheet.title, pd.DataFrame(rows, columns=columns, index=numbers)
+                    rows, numbers = [], []
+            if rows:
+                yield sheet.title, pd.DataFrame(rows, columns=columns, index=numbers)
+    finally:
+        workbook.close()
+
+
+def _iter_excel(file_path, batch_rows):
+    """xls/ods have no streaming reader: one sheet at a time, then batched"""
+    import pandas as pd
+    sheets = pd.read_excel(file_path, sheet_name=None, dtype=str, keep_default_na=False)
+    for name, frame in sheets.items():
+        frame.columns = _clean_columns(frame.columns)
+        frame.index = np.arange(2, 2 + len(frame))
+        for start in range(0, len(frame), batch_rows):
+            yield name, frame.iloc[start:start + batch_rows]
+
+
+def iter_row_batches(file_path, batch_rows=BATCH_ROWS):
+    """Yield (sheet or None, DataFrame of str) with the index set to sheet row numbers"""
+    file_type = os.path.splitext(file_path)[1].lower().lstrip('.')
+    if file_type == 'csv':
+        batches = _iter_csv(file_path, batch_rows)
+    elif file_type in ('xlsx', 'xlsm'):
+        batches = _iter_xlsx(file_path, batch_rows)
+    else:
+        batches = _iter_excel(file_path, batch_rows)
+    for sheet, frame in batches:
+        frame = frame.fillna("").astype(str)
+        for column in range(frame.shape[1]):
+            frame.iloc[:, column] = frame.iloc[:, column].str.replace(r"\s+", " ", regex=True).str.strip()
+        yield sheet, frame[(frame != "").any(axis=1)]
+
+
+def _row_lines(frame):
+    """One "v1 | v2 | ..." line per row, built a column at a time"""
+    first = frame.iloc[:, 0]
+    if frame.shape[1] == 1:
+        return first
+    return first.str.cat([frame.iloc[:, n] for n in range(1, frame.shape[1])], sep=" | ")
+
+
+def _table_chunk(frame, lines, header, file_name, file_hash, sheet, with_cells):
+    row_start, row_end = int(frame.index[0]), int(frame.index[-1])
+    metadata = {
+        "source": file_name,
+        "file_hash": file_hash,
+        "row_start": row_start,
+        "row_end": row_end,
+        "rows": f"{row_start}-{row_end}" if row_end != row_start else str(row_start),
+    }
+    if sheet is not None:
+        metadata["sheet"] = sheet
+    if with_cells:
+        columns = list(frame.columns)
+        metadata["table_cells"] = sorted({
+            (columns[n], value)
+            for row in frame.itertuples(index=False, name=None)
+            for n, value in enumerate(row)
+            if value and len(value) <= MAX_CELL_CHARS
+        })
+    return Document(page_content=header + "\n".join(lines), metadata=metadata)
+
+
+def iter_table_chunks(file_path, file_name, file_hash, chunk_chars=1200, batch_rows=BATCH_ROWS,
+                      with_cells=None):
+    """
+    Yield chunk Documents of consecutive rows, each starting with the table
+    header and tagged with row_start/row_end (and sheet for workbooks).
+    With the column index on, metadata["table_cells"] carries the chunk's
+    (column, value) pairs; RAGEngine moves them into ColumnIndex.
+    """
+    import pandas as pd
+    with_cells = COLUMN_INDEX if with_cells is None else with_cells
+    current_sheet = None
+    pending = None   # rows of the last, still-filling chunk
+    header = ""
+
+    def _flush():
+        if pending is not None and len(pending):
+            return _table_chunk(pending, _row_lines(pending), header, file_name, file_hash,
+                                current_sheet, with_cells)
+        return None
+
+    for sheet, frame in iter_row_batches(file_path, batch_rows):
+        if pending is not None and (sheet != current_sheet or list(frame.columns) != list(pending.columns)):
+            chunk = _flush()
+            if chunk is not None:
+                yield chunk
+            pending = None
+        if pending is None:
+            current_sheet = sheet
+            table = f"{file_name} / {sheet}" if sheet is not None else file_name
+            header = f"Table: {table}\nColumns: {' | '.join(frame.columns)}\n"
+        elif len(frame):
+            frame = pd.concat([pending, frame])
+        else:
+            continue
+        if not len(frame):
+            continue
+
+        # Pack rows greedily by text length: a row joins the chunk its start falls in
+        lines = _row_lines(frame)
+        lengths = lines.str.len().to_numpy() + 1
+        budget = max(200, chunk_chars - len(header))
+        groups = (np.cumsum(lengths) - lengths) // budget
+        bounds = np.flatnonzero(np.diff(groups)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(frame)]))
+        for start, end in zip(starts[:-1], ends[:-1]):
+            yield _table_chunk(frame.iloc[start:end], lines.iloc[start:end], header,
+                               file_name, file_hash, current_sheet, with_cells)
+        pending = frame.iloc[starts[-1]:]
+
+    chunk = _flush()
+    if chunk is not None:
+        yield chunk
+
+
+def chunk_cells(doc):
+    """
+    (column, value) pairs of a stored table chunk, read back from its text -
+    the inverse of _table_chunk, for rebuilding ColumnIndex from the docstore.
+    Rows whose cells contain the " | " separator cannot be split and are skipped.
+    """
+    lines = doc.page_content.split("\n")
+    if len(lines) < 3 or not lines[0].startswith("Table: ") or not lines[1].startswith("Columns: "):
+        return []
+    columns = lines[1][len("Columns: "):].split(" | ")
+    cells = set()
+    for line in lines[2:]:
+        values = line.split(" | ")
+        if len(values) != len(columns):
+            continue
+        cells.update(
+            (column, value) for column, value in zip(columns, values)
+            if value and len(value) <= MAX_CELL_CHARS
+        )
+    return sorted(cells)
+
+
+_QUOTED_RE = re.compile(r"[\"']([^\"']{1,64})[\"']")
+_VALUE_RE = re.compile(r"[a-z0-9]+(?:[-_./:#@][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were what when where which who why will with how do does".split()
+)
+
+
+def lookup_values(query):
+    """Candidate cell values in a question: quoted strings and id-like tokens"""
+    text = query.lower()
+    values = [value.strip() for value in _QUOTED_RE.findall(text)]
+    values.extend(token for token in _VALUE_RE.findall(text) if token not in _STOPWORDS)
+    return list(dict.fromkeys(value for value in values if value))
+
+
+class ColumnIndex:
+    """
+    Exact cell-value -> chunk index for tabular sources, in SQLite next to the
+    FAISS snapshots. Answers lookups like "order 88412" or "who is ERR-4021
+    assigned to" that embeddings blur; hits feed the hybrid retriever.
+    """
+
+    def __init__(self, path, max_hits=50):
+        self.path = path
+        self.max_hits = max_hits   # values matching more chunks are not selective
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self, create=False):
+        if self._conn is None:
+            if not os.path.exists(self.path):
+                if not create:
+                    return None
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS cells (value TEXT NOT NULL, col TEXT NOT NULL, doc_id TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS cells_value ON cells (value);"
+                "CREATE INDEX IF NOT EXISTS cells_doc ON cells (doc_id);"
+                # Every table chunk seen, including those without short cell values
+                "CREATE TABLE IF NOT EXISTS chunks (doc_id TEXT PRIMARY KEY) WITHOUT ROWID;"
+            )
+        return self._conn
+
+    def add(self, ids, cells):
+        """Index each chunk's [(column, value)] in one transaction (None: not a table chunk)"""
+        rows = [
+            (value.lower(), column, doc_id)
+            for doc_id, pairs in zip(ids, cells) if pairs
+            for column, value in pairs
+        ]
+        chunks = [(doc_id,) for doc_id, pairs in zip(ids, cells) if pairs is not None]
+        if not chunks:
+            return
+        with self._lock:
+            conn = self._connect(create=True)
+            with conn:
+                conn.executemany("INSERT INTO cells VALUES (?, ?, ?)", rows)
+                conn.executemany("INSERT OR IGNORE INTO chunks VALUES (?)", chunks)
+
+    def doc_ids(self):
+        """Ids of the table chunks this index covers"""
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return set()
+            return {doc_id for doc_id, in conn.execute("SELECT doc_id FROM chunks")}
+
+    def delete(self, ids):
+        with self._lock:
+            conn = self._connect()
+            if conn is None or not ids:
+                return
+            with conn:
+                for start in range(0, len(ids), 500):
+                    batch = list(ids[start:start + 500])
+                    marks = ",".join("?" * len(batch))
+                    conn.execute(f"DELETE FROM cells WHERE doc_id IN ({marks})", batch)
+                    conn.execute(f"DELETE FROM chunks WHERE doc_id IN ({marks})", batch)
+
+    def search(self, query, k=6):
+        """Top-k (doc_id, matched values) for selective values named in `query`"""
+        values = lookup_values(query)
+        with self._lock:
+            conn = self._connect()
+            if conn is None or not values:
+                return []
+            marks = ",".join("?" * len(values))
+            selective = [
+                value for value, docs in conn.execute(
+                    f"SELECT value, COUNT(DISTINCT doc_id) FROM cells WHERE value IN ({marks}) GROUP BY value",
+                    values
+                )
+                if docs <= self.max_hits
+            ]
+            if not selective:
+                return []
+            return conn.execute(
+                f"SELECT doc_id, COUNT(DISTINCT value) AS hits FROM cells WHERE value IN ({','.join('?' * len(selective))})"
+                f" GROUP BY doc_id ORDER BY hits DESC LIMIT ?",
+                selective + [k]
+            ).fetchall()
+
+    def clear(self):
+        """Close and delete the index files (the namespace is being reset)"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.unlink(self.path + suffix)
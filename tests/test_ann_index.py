@@ -0,0 +1,156 @@
+"""
+Deletes on every index type: nothing is re-added, deleted chunks never come
+back from a search, and compaction reclaims HNSW tombstones.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+
+import ann_index  # noqa: E402
+import index_store  # noqa: E402
+
+DIM = 16
+
+
+def _vectors(n, seed):
+    return np.random.default_rng(seed).random((n, DIM), dtype=np.float32)
+
+
+def _vectorstore(index_type, n=2000, rescore=False):
+    vectors = _vectors(n, seed=0)
+    config = ann_index.resolve_config(n, DIM, index_type, rescore=rescore, overrides={"nlist": 16, "nprobe": 16})
+    ids = [f"doc-{i}" for i in range(n)]
+    docs = [Document(page_content=f"chunk {i}") for i in range(n)]
+    vectorstore = ann_index.RescoringFAISS(
+        embedding_function=DeterministicFakeEmbedding(size=DIM),
+        index=ann_index.build_index(vectors, config),
+        docstore=InMemoryDocstore(dict(zip(ids, docs))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+    if rescore:
+        vectorstore.full_vectors = vectors
+    return vectorstore, vectors, config
+
+
+def _found(vectorstore, vectors, k=10):
+    return {
+        doc.page_content
+        for vector in vectors
+        for doc, _ in vectorstore.similarity_search_with_score_by_vector(vector.tolist(), k=k)
+    }
+
+
+def test_hnsw_delete_leaves_tombstones_that_searches_skip():
+    vectorstore, vectors, _ = _vectorstore("hnsw")
+    graph = vectorstore.index
+    doomed = [f"doc-{i}" for i in range(0, 2000, 3)]
+    ann_index.delete_ids(vectorstore, doomed)
+
+    # The graph is neither rebuilt nor shrunk
+    assert vectorstore.index is graph and graph.ntotal == 2000
+    assert len(vectorstore.index_to_docstore_id) == 2000 - len(doomed)
+    found = _found(vectorstore, vectors[:60])
+    assert found and not found & {f"chunk {i}" for i in range(0, 2000, 3)}
+    results = vectorstore.similarity_search_with_score_by_vector(vectors[0].tolist(), k=10)
+    assert len(results) == 10
+
+    added = _vectors(5, seed=3)
+    vectorstore.add_embeddings([(f"new {i}", v) for i, v in enumerate(added)], ids=[f"new-{i}" for i in range(5)])
+    assert graph.ntotal == 2005 and vectorstore.index_to_docstore_id[2004] == "new-4"
+    doc, _ = vectorstore.similarity_search_with_score_by_vector(added[2].tolist(), k=1)[0]
+    assert doc.page_content == "new 2"
+
+
+def test_ivf_pq_delete_removes_entries_without_re_encoding():
+    vectorstore, vectors, _ = _vectorstore("ivf_pq")
+    queries = vectors[1000:1020]
+    before = vectorstore.index.search(queries, 5)
+
+    ann_index.delete_ids(vectorstore, [f"doc-{i}" for i in range(0, 500)])
+    assert vectorstore.index.ntotal == 1500
+    # Surviving codes are untouched: the same neighbours at the same distances
+    after = vectorstore.index.search(queries, 5)
+    for row in range(len(queries)):
+        kept = [(p, d) for d, p in zip(before[0][row], before[1][row]) if p >= 500]
+        assert kept == [(p, d) for d, p in zip(after[0][row], after[1][row])][:len(kept)]
+
+    # New vectors continue after the highest id instead of colliding with one
+    ann_index.delete_ids(vectorstore, ["doc-1999"])
+    added = _vectors(3, seed=4)
+    vectorstore.add_embeddings([(f"new {i}", v) for i, v in enumerate(added)], ids=[f"new-{i}" for i in range(3)])
+    assert [vectorstore.index_to_docstore_id[p] for p in (1999, 2000, 2001)] == ["new-0", "new-1", "new-2"]
+    assert vectorstore.index_to_docstore_id[1998] == "doc-1998"
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id) == 1502
+
+
+def test_ivf_pq_rescoring_rows_follow_positions(tmp_path):
+    vectorstore, vectors, config = _vectorstore("ivf_pq", rescore=True)
+    ann_index.delete_ids(vectorstore, [f"doc-{i}" for i in range(1990, 2000)])
+    added = _vectors(4, seed=5)
+    vectorstore.add_embeddings([(f"new {i}", v) for i, v in enumerate(added)], ids=[f"new-{i}" for i in range(4)])
+    # Rows of the removed tail were reused for the new positions
+    assert len(vectorstore.full_vectors) == 1994
+    np.testing.assert_array_equal(vectorstore.full_vectors[1990:], added)
+    doc, score = vectorstore.similarity_search_with_score_by_vector(added[1].tolist(), k=1)[0]
+    assert doc.page_content == "new 1" and score == pytest.approx(0.0, abs=1e-6)
+
+    index_store.save_snapshot(str(tmp_path), vectorstore, extra={"index": config})
+    reloaded, _ = index_store.load_snapshot(str(tmp_path), vectorstore.embedding_function)
+    assert reloaded.index_to_docstore_id == vectorstore.index_to_docstore_id
+    doc, _ = reloaded.similarity_search_with_score_by_vector(added[1].tolist(), k=1)[0]
+    assert doc.page_content == "new 1"
+
+
+def test_hnsw_tombstones_survive_a_snapshot(tmp_path):
+    vectorstore, vectors, config = _vectorstore("hnsw")
+    ann_index.delete_ids(vectorstore, [f"doc-{i}" for i in range(100)])
+    index_store.save_snapshot(str(tmp_path), vectorstore, extra={"index": config})
+
+    reloaded, manifest = index_store.load_snapshot(str(tmp_path), vectorstore.embedding_function)
+    assert manifest["count"] == 1900 and reloaded.index.ntotal == 2000
+    assert not _found(reloaded, vectors[:20]) & {f"chunk {i}" for i in range(100)}
+
+
+def test_compaction_drops_tombstones_and_catches_up():
+    vectorstore, vectors, _ = _vectorstore("hnsw", rescore=True)
+    ann_index.delete_ids(vectorstore, [f"doc-{i}" for i in range(0, 2000, 2)])
+    assert ann_index.dead_fraction(vectorstore) == pytest.approx(0.5)
+
+    job = ann_index.Compaction(vectorstore)
+    job.build()
+    # Changes made while the compacted index was being built are carried over
+    ann_index.delete_ids(vectorstore, ["doc-1"])
+    added = _vectors(2, seed=6)
+    vectorstore.add_embeddings([(f"new {i}", v) for i, v in enumerate(added)], ids=["new-0", "new-1"])
+    assert job.apply(vectorstore)
+
+    assert len(vectorstore.index_to_docstore_id) == 1001 and vectorstore.index.ntotal == 1002
+    assert len(vectorstore.full_vectors) == 1002
+    assert "doc-1" not in vectorstore.index_to_docstore_id.values()
+    doc, _ = vectorstore.similarity_search_with_score_by_vector(vectors[7].tolist(), k=1)[0]
+    assert doc.page_content == "chunk 7"
+    doc, _ = vectorstore.similarity_search_with_score_by_vector(added[1].tolist(), k=1)[0]
+    assert doc.page_content == "new 1"
+    assert "chunk 1" not in _found(vectorstore, vectors[:5])
+
+
+def test_compaction_is_dropped_after_a_rebuild():
+    vectorstore, vectors, config = _vectorstore("hnsw")
+    ann_index.delete_ids(vectorstore, [f"doc-{i}" for i in range(500)])
+    job = ann_index.Compaction(vectorstore)
+    job.build()
+    vectorstore.index = ann_index.build_index(vectors, config)
+    assert not job.apply(vectorstore)
@@ -0,0 +1,87 @@
+"""
+Semantic answer cache: similarity threshold, TTL, LRU eviction and the
+generation / settings part of the key.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import answer_cache  # noqa: E402
+from answer_cache import SemanticAnswerCache  # noqa: E402
+
+SETTINGS = ("hybrid", 6, False, None, "llm", "window")
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _store(cache, embedding, answer, generation=1, settings=SETTINGS, model="m"):
+    cache.store(embedding, model, generation, f"question for {answer}", answer, [], settings)
+
+
+def test_hit_needs_cosine_above_threshold():
+    cache = SemanticAnswerCache(threshold=0.95)
+    _store(cache, _unit(1, 0, 0), "a")
+
+    hit = cache.lookup(_unit(1, 0.1, 0), "m", 1, SETTINGS)   # cosine ~0.995
+    assert hit["answer"] == "a" and hit["similarity"] == pytest.approx(0.995, abs=1e-3)
+    assert cache.lookup(_unit(1, 0.5, 0), "m", 1, SETTINGS) is None   # cosine ~0.894
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_closest_entry_wins():
+    cache = SemanticAnswerCache(threshold=0.9)
+    _store(cache, _unit(1, 0.2, 0), "near")
+    _store(cache, _unit(1, 0.4, 0), "far")
+    assert cache.lookup(_unit(1, 0.15, 0), "m", 1, SETTINGS)["answer"] == "near"
+
+
+def test_model_generation_and_settings_are_part_of_the_key():
+    cache = SemanticAnswerCache()
+    _store(cache, _unit(0, 1, 0), "a")
+    assert cache.lookup(_unit(0, 1, 0), "other-model", 1, SETTINGS) is None
+    assert cache.lookup(_unit(0, 1, 0), "m", 2, SETTINGS) is None
+    assert cache.lookup(_unit(0, 1, 0), "m", 1, ("vector",) + SETTINGS[1:]) is None
+    assert cache.lookup(_unit(0, 1, 0), "m", 1, ("hybrid", 12) + SETTINGS[2:]) is None
+    assert cache.lookup(_unit(0, 1, 0), "m", 1, SETTINGS)["answer"] == "a"
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    _store(cache, _unit(0, 0, 1), "a")
+
+    now[0] += 59
+    assert cache.lookup(_unit(0, 0, 1), "m", 1, SETTINGS) is not None
+    now[0] += 2
+    assert cache.lookup(_unit(0, 0, 1), "m", 1, SETTINGS) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    _store(cache, _unit(1, 0, 0), "a")
+    _store(cache, _unit(0, 1, 0), "b")
+    assert cache.lookup(_unit(1, 0, 0), "m", 1, SETTINGS)["answer"] == "a"   # a is now newest
+    _store(cache, _unit(0, 0, 1), "c")
+
+    assert len(cache) == 2
+    assert cache.lookup(_unit(0, 1, 0), "m", 1, SETTINGS) is None
+    assert cache.lookup(_unit(1, 0, 0), "m", 1, SETTINGS)["answer"] == "a"
+
+
+def test_invalidate_drops_everything():
+    cache = SemanticAnswerCache()
+    _store(cache, _unit(1, 1, 0), "a")
+    cache.invalidate()
+    assert len(cache) == 0 and cache.lookup(_unit(1, 1, 0), "m", 1, SETTINGS) is None
@@ -0,0 +1,91 @@
+"""
+Batch question answering: stable question ids, error records with their
+exception, and resuming from the output file with a stub engine.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batch_qa  # noqa: E402
+
+
+class StubEngine:
+    """The parts of RAGEngine run_batch uses; the LLM fails on questions listed in `failing`"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.asked = []
+        self.embeddings = SimpleNamespace(embed_queries=lambda texts: [[float(len(t))] for t in texts])
+        self.llm = SimpleNamespace(invoke=self._invoke)
+
+    def _query_context(self, standalone_question, prompt_question, embedding, start_time, use_cache=True):
+        return {"cached": None, "prompt": prompt_question, "source_documents": [], "retrieval_time": 0.0}
+
+    def _invoke(self, prompt):
+        self.asked.append(prompt)
+        if prompt in self.failing:
+            raise TimeoutError("Ollama did not answer")
+        return SimpleNamespace(content=f"answer to {prompt}")
+
+    def _remember_answer(self, query, answer):
+        pass
+
+
+def _records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_ids_come_from_the_file_or_a_hash_of_the_question(tmp_path):
+    path = tmp_path / "questions.jsonl"
+    path.write_text('{"id": 7, "question": "What is the SLA?"}\n"Who owns billing?"\n\n"Who owns billing?"\n',
+                    encoding="utf-8")
+    questions = batch_qa.read_questions(str(path))
+    assert questions[0] == ("7", "What is the SLA?")
+    hashed = questions[1][0]
+    assert hashed.startswith("q-") and questions[2][0] == hashed + "-2"
+
+    # Ids do not depend on line positions
+    path.write_text('"New question"\n"Who owns billing?"\n', encoding="utf-8")
+    assert batch_qa.read_questions(str(path))[1][0] == hashed
+
+    csv_path = tmp_path / "questions.csv"
+    csv_path.write_text("id,question\na,First\na,Second\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="duplicate question id 'a'"):
+        batch_qa.read_questions(str(csv_path))
+
+
+def test_errors_are_recorded_and_retried_on_resume(tmp_path):
+    path = tmp_path / "questions.csv"
+    path.write_text("question\nFirst\nSecond\nThird\n", encoding="utf-8")
+    output = str(tmp_path / "answers.jsonl")
+    questions = batch_qa.read_questions(str(path))
+
+    engine = StubEngine(failing={"Second"})
+    summary = batch_qa.run_batch(engine, questions, output, concurrency=1)
+    assert summary["answered"] == 2 and summary["errors"] == 1
+    error = next(record for record in _records(output) if "error" in record)
+    assert error["question"] == "Second" and error["error_type"] == "TimeoutError"
+    assert error["error"] == "TimeoutError: Ollama did not answer"
+    assert "raise TimeoutError" in error["traceback"]
+
+    # A question inserted before the others does not shift which ones are done
+    path.write_text("question\nZeroth\nFirst\nSecond\nThird\n", encoding="utf-8")
+    engine = StubEngine()
+    summary = batch_qa.run_batch(engine, batch_qa.read_questions(str(path)), output, concurrency=2)
+    assert sorted(engine.asked) == ["Second", "Zeroth"]
+    assert summary["skipped"] == 2 and summary["answered"] == 2
+
+    answered = {record["question"] for record in _records(output) if "error" not in record}
+    assert answered == {"Zeroth", "First", "Second", "Third"}
+    assert batch_qa.run_batch(StubEngine(), batch_qa.read_questions(str(path)), output)["skipped"] == 4
@@ -0,0 +1,124 @@
+"""
+Chat memory strategies: window, token and summary trimming with a stub
+summarizer, and the bound on unsummarized turns while a summary is running.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import SystemMessage  # noqa: E402
+
+import chat_memory  # noqa: E402
+import context_builder  # noqa: E402
+from chat_memory import ChatMemory  # noqa: E402
+
+
+class StubSummarizer:
+    """Records every call and returns "previous+questions"; can be held until released"""
+
+    def __init__(self, hold=False, fail=False):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+        if not hold:
+            self.release.set()
+
+    def __call__(self, previous, messages):
+        self.calls.append((previous, [m.content for m in messages]))
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("model unavailable")
+        questions = [m.content for m in messages[::2]]
+        return "+".join(([previous] if previous else []) + questions)
+
+
+def _save(memory, *turns):
+    for turn in turns:
+        memory.save_context({"question": f"q{turn}"}, {"answer": f"a{turn}"})
+
+
+def _contents(memory):
+    return [m.content for m in memory.messages]
+
+
+def _wait_for_summaries():
+    # The pool has a single worker, so this runs after every queued refresh
+    chat_memory._summary_pool.submit(lambda: None).result(5)
+
+
+def test_window_keeps_the_last_turns():
+    memory = ChatMemory("window", max_turns=2)
+    _save(memory, 0, 1, 2)
+    assert _contents(memory) == ["q1", "a1", "q2", "a2"]
+    memory.clear()
+    assert memory.messages == []
+
+
+def test_tokens_keeps_the_turns_that_fit(monkeypatch):
+    monkeypatch.setattr(context_builder, "_encoding", False)   # ~4 characters per token
+    memory = ChatMemory("tokens", max_tokens=70)
+    for turn in range(3):
+        # 11 + 11 + 8 = 30 tokens per turn
+        memory.save_context({"question": str(turn) * 40}, {"answer": str(turn) * 40})
+    assert [m.content[0] for m in memory.messages] == ["1", "1", "2", "2"]
+
+    # A single turn larger than the budget is still kept
+    memory.save_context({"question": "x" * 400}, {"answer": "y"})
+    assert [m.content[0] for m in memory.messages] == ["x", "y"]
+
+
+def test_summary_folds_older_turns_in_the_background():
+    summarizer = StubSummarizer()
+    memory = ChatMemory("summary", max_turns=2, summarizer=summarizer)
+    _save(memory, 0, 1, 2)
+    _wait_for_summaries()
+
+    assert summarizer.calls == [("", ["q0", "a0"])]
+    messages = memory.messages
+    assert isinstance(messages[0], SystemMessage) and messages[0].content.endswith(": q0")
+    assert _contents(memory)[1:] == ["q1", "a1", "q2", "a2"]
+
+    _save(memory, 3)
+    _wait_for_summaries()
+    assert summarizer.calls[-1] == ("q0", ["q1", "a1"])
+    assert memory.summary == "q0+q1"
+
+
+def test_pending_turns_stay_bounded_while_a_summary_runs():
+    summarizer = StubSummarizer(hold=True)
+    memory = ChatMemory("summary", max_turns=2, summarizer=summarizer)
+    _save(memory, 0, 1, 2)
+    assert summarizer.started.wait(5)
+
+    # q0 is being summarized; later overflow only keeps the newest two pending turns
+    _save(memory, 3, 4, 5, 6)
+    assert _contents(memory) == ["q3", "a3", "q4", "a4", "q5", "a5", "q6", "a6"]
+
+    summarizer.release.set()
+    _wait_for_summaries()
+    # The first summary is kept and the turns that piled up meanwhile are folded in next
+    assert summarizer.calls == [("", ["q0", "a0"]), ("q0", ["q3", "a3", "q4", "a4"])]
+    assert memory.summary == "q0+q3+q4"
+    assert _contents(memory)[1:] == ["q5", "a5", "q6", "a6"]
+    assert not memory._summarizing
+
+
+def test_failing_summarizer_falls_back_to_a_window():
+    summarizer = StubSummarizer(fail=True)
+    memory = ChatMemory("summary", max_turns=1, summarizer=summarizer)
+    _save(memory, 0, 1, 2, 3)
+    _wait_for_summaries()
+
+    assert memory.summary == "" and not memory._summarizing
+    # max_turns verbatim turns plus at most max_turns unsummarized older ones
+    assert _contents(memory) == ["q2", "a2", "q3", "a3"]
@@ -0,0 +1,110 @@
+"""
+Context packing: overlapping chunks are merged, the token budget is never
+exceeded, and the last chunk is truncated or dropped depending on the room
+left. Token counts use the ~4 characters per token fallback so the numbers
+below can be worked out by hand.
+
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+
+import context_builder  # noqa: E402
+from context_builder import ContextBuilder, count_tokens, merge_chunks  # noqa: E402
+
+FIXED = "f" * 40   # 11 tokens
+
+
+@pytest.fixture(autouse=True)
+def no_tiktoken(monkeypatch):
+    monkeypatch.setattr(context_builder, "_encoding", False)
+
+
+def _doc(text, source, **metadata):
+    return Document(page_content=text, metadata=dict(metadata, source=source))
+
+
+def _builder():
+    # budget = 200 - 50 - 10 = 140, 129 of it left after FIXED
+    return ContextBuilder(num_ctx=200, num_predict=50, safety_margin=10)
+
+
+def test_count_tokens_falls_back_without_tiktoken(monkeypatch):
+    monkeypatch.setattr(context_builder, "_encoding", None)
+    monkeypatch.setitem(sys.modules, "tiktoken", None)   # import raises ImportError
+    assert count_tokens("a" * 40) == 11
+    assert count_tokens("") == 1
+    assert context_builder._encoding is False
+
+
+def test_overlapping_chunks_of_a_source_merge_by_start_index():
+    docs = [
+        _doc("fghijklmno", "a.pdf", page=1, start_index=5),
+        _doc("other source", "b.pdf", page=1, start_index=0),
+        _doc("abcdefghij", "a.pdf", page=1, start_index=0),
+        _doc("klmno", "a.pdf", page=1, start_index=10),   # contained, dropped
+        _doc("xyz", "a.pdf", page=2, start_index=5),        # another page stays apart
+    ]
+    merged = merge_chunks(docs)
+    assert [doc.page_content for doc in merged] == ["abcdefghijklmno", "other source", "xyz"]
+    assert merged[0].metadata["source"] == "a.pdf"
+
+
+def test_chunks_without_start_index_merge_on_matching_text():
+    first = "The quick brown fox jumps over the lazy dog"
+    second = "jumps over the lazy dog and runs away"
+    merged = merge_chunks([_doc(first, "a.txt"), _doc(second, "a.txt"), _doc(first, "a.txt")])
+    assert [doc.page_content for doc in merged] == [first + " and runs away"]
+    # A shared run shorter than 20 characters is not treated as overlap
+    merged = merge_chunks([_doc("short tail", "a.txt"), _doc("tail and more", "a.txt")])
+    assert len(merged) == 2
+
+
+def test_last_chunk_is_dropped_when_little_room_is_left():
+    docs = [_doc("x" * 200, f"{i}.txt") for i in range(3)]   # 51 tokens each
+    packed, stats = _builder().pack(docs, FIXED)
+    # 51 + (1 + 51) = 103 used; 25 tokens left for the third chunk is below 50
+    assert [doc.metadata["source"] for doc in packed] == ["0.txt", "1.txt"]
+    assert stats["context_tokens"] == 103 and stats["prompt_tokens"] == 114
+    assert stats["merged_chunks"] == 3 and stats["packed_chunks"] == 2
+
+
+def test_last_chunk_is_truncated_when_enough_room_is_left():
+    docs = [_doc("x" * 200, "0.txt"), _doc("y" * 400, "1.txt"), _doc("z" * 40, "2.txt")]
+    packed, stats = _builder().pack(docs, FIXED)
+    # 77 tokens left for the 101-token second chunk: its head is kept, the rest stops
+    assert len(packed) == 2 and packed[1].metadata["truncated"]
+    assert packed[1].page_content == "y" * 301
+    assert "truncated" not in packed[0].metadata
+    assert stats["context_tokens"] == 51 + 1 + 76
+    assert stats["prompt_tokens"] <= stats["budget"] == 140
+
+
+def test_budget_is_never_exceeded():
+    rng = random.Random(7)
+    builder = _builder()
+    for _ in range(200):
+        docs = [_doc("w" * rng.randint(1, 700), f"{i}.txt") for i in range(rng.randint(1, 8))]
+        fixed = "f" * rng.randint(0, 300)
+        packed, stats = builder.pack(docs, fixed)
+        context = "\n\n".join(doc.page_content for doc in packed)
+        assert stats["prompt_tokens"] <= builder.budget or not packed
+        if packed:
+            assert count_tokens(fixed) + count_tokens(context) <= builder.budget
+
+
+def test_fit_history_keeps_the_newest_messages():
+    messages = [SimpleNamespace(content=str(i) * 160) for i in range(4)]   # 41 + 4 tokens each
+    kept = _builder().fit_history(messages, FIXED)
+    assert [message.content[0] for message in kept] == ["2", "3"]
+    assert _builder().fit_history(messages, "f" * 600) == []
@@ -0,0 +1,74 @@
+"""
+Embedding cache: cached chunks are not re-encoded, and queries are not stuck
+behind a large document batch.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_core")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import EmbeddingCache, CachedEmbeddings  # noqa: E402
+
+
+class RecordingEmbedder:
+    """Returns [len(text), 0] and logs every call; the first document call can be held"""
+
+    def __init__(self):
+        self.calls = []
+        self.hold = None
+
+    def embed_documents(self, texts):
+        self.calls.append(("documents", len(texts)))
+        if self.hold is not None and len(self.calls) == 1:
+            self.hold.wait(5)
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(("query", 1))
+        return [float(len(text)), 1.0]
+
+
+def _cached(tmp_path, encode_batch=4):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    return CachedEmbeddings(RecordingEmbedder(), cache, "stub", encode_batch=encode_batch)
+
+
+def test_only_missing_texts_are_encoded_in_sub_batches(tmp_path):
+    embedder = _cached(tmp_path)
+    texts = [f"text {i}" for i in range(10)]
+    assert embedder.embed_documents(texts[:3]) == [[6.0, 0.0]] * 3
+    embedder.embeddings.calls.clear()
+
+    vectors = embedder.embed_documents(texts + texts[:2])
+    assert len(vectors) == 12 and vectors[-1] == vectors[0]
+    assert embedder.embeddings.calls == [("documents", 4), ("documents", 3)]
+
+
+def test_query_goes_before_the_next_document_batch(tmp_path):
+    embedder = _cached(tmp_path, encode_batch=2)
+    embedder.embeddings.hold = threading.Event()
+    ingest = threading.Thread(target=embedder.embed_documents, args=([f"chunk {i}" for i in range(6)],))
+    ingest.start()
+    while not embedder.embeddings.calls:
+        time.sleep(0.01)
+
+    query = threading.Thread(target=embedder.embed_query, args=("question",))
+    query.start()
+    while embedder._queries_waiting == 0:
+        time.sleep(0.01)
+    embedder.embeddings.hold.set()
+    ingest.join(5)
+    query.join(5)
+
+    assert embedder.embeddings.calls == [
+        ("documents", 2), ("query", 1), ("documents", 2), ("documents", 2)
+    ]
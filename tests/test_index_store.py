@@ -0,0 +1,120 @@
+"""
+Snapshot round trips: save, reload (memory-mapped), then modify the index.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+
+import ann_index  # noqa: E402
+import index_store  # noqa: E402
+
+DIM = 16
+
+
+def _vectors(n, seed):
+    return np.random.default_rng(seed).random((n, DIM), dtype=np.float32)
+
+
+def _vectorstore(index_type, n=2000, rescore=False):
+    vectors = _vectors(n, seed=0)
+    config = ann_index.resolve_config(n, DIM, index_type, rescore=rescore, overrides={"nlist": 16})
+    ids = [f"doc-{i}" for i in range(n)]
+    docs = [Document(page_content=f"chunk {i}", metadata={"source": f"file{i % 4}.txt"}) for i in range(n)]
+    vectorstore = ann_index.RescoringFAISS(
+        embedding_function=DeterministicFakeEmbedding(size=DIM),
+        index=ann_index.build_index(vectors, config),
+        docstore=InMemoryDocstore(dict(zip(ids, docs))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+    if rescore:
+        vectorstore.full_vectors = vectors
+    return vectorstore, vectors, config
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "ivf_pq"])
+def test_reload_then_mutate(tmp_path, index_type):
+    vector_dir = str(tmp_path)
+    vectorstore, vectors, config = _vectorstore(index_type, rescore=index_type == "ivf_pq")
+    index_store.save_snapshot(vector_dir, vectorstore, extra={"index": config})
+
+    loaded, manifest = index_store.load_snapshot(vector_dir, vectorstore.embedding_function)
+    assert manifest["count"] == len(vectors)
+    assert not index_store.is_writable(loaded)
+    ann_index.apply_search_params(loaded.index, {"nprobe": 16, "ef_search": 200})
+
+    index_store.make_writable(loaded)
+    assert index_store.is_writable(loaded)
+    # Chunks and full-precision vectors are not pulled into RAM up front
+    assert isinstance(loaded.docstore, index_store.OverlayDocstore)
+    if loaded.full_vectors is not None:
+        assert isinstance(loaded.full_vectors, np.memmap)
+    if "nprobe" in config:
+        assert faiss.extract_index_ivf(loaded.index).nprobe == 16
+
+    added = _vectors(10, seed=1)
+    new_ids = [f"new-{i}" for i in range(len(added))]
+    loaded.add_embeddings([(f"new {i}", v.tolist()) for i, v in enumerate(added)], ids=new_ids)
+    ann_index.delete_ids(loaded, [f"doc-{i}" for i in range(0, 100)])
+    assert len(loaded.index_to_docstore_id) == len(vectors) + len(added) - 100
+
+    index_store.save_snapshot(vector_dir, loaded, extra={"index": config})
+    reloaded, manifest = index_store.load_snapshot(vector_dir, vectorstore.embedding_function)
+    assert manifest["count"] == len(reloaded.index_to_docstore_id) == len(loaded.index_to_docstore_id)
+    assert reloaded.index_to_docstore_id == loaded.index_to_docstore_id
+    ids = set(reloaded.index_to_docstore_id.values())
+    assert "doc-0" not in ids and "new-0" in ids
+    doc, _ = reloaded.similarity_search_with_score_by_vector(added[3].tolist(), k=1)[0]
+    assert doc.page_content == "new 3"
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_pq"])
+def test_incremental_saves_replay_from_journal(tmp_path, index_type):
+    vector_dir = str(tmp_path)
+    vectorstore, vectors, config = _vectorstore(index_type, rescore=index_type == "ivf_pq")
+    first = index_store.save_snapshot(vector_dir, vectorstore, extra={"index": config})
+
+    loaded, _ = index_store.load_snapshot(vector_dir, vectorstore.embedding_function)
+    index_store.make_writable(loaded)
+    changes = []
+    added = _vectors(10, seed=2)
+    new_ids = [f"new-{i}" for i in range(len(added))]
+    loaded.add_embeddings([(f"new {i}", v.tolist()) for i, v in enumerate(added)], ids=new_ids)
+    changes.append(("add", new_ids, added))
+    doomed = [f"doc-{i}" for i in range(0, 100)] + ["new-0"]
+    ann_index.delete_ids(loaded, doomed)
+    changes.append(("delete", doomed))
+
+    # Only the chunk store and journal are written; the index snapshot stays as it was
+    assert index_store.save_changes(vector_dir, loaded, changes, extra={"index": config}) == first
+    assert changes == []
+    manifest = index_store.read_manifest(vector_dir)
+    assert manifest["journal"] == len(added) + len(doomed)
+    assert manifest["count"] == len(loaded.index_to_docstore_id)
+
+    reloaded, manifest = index_store.load_snapshot(vector_dir, vectorstore.embedding_function)
+    assert manifest["replayed"] == len(added) + len(doomed)
+    assert reloaded.index.ntotal == loaded.index.ntotal
+    assert reloaded.index_to_docstore_id == loaded.index_to_docstore_id
+    live = {doc_id for doc_id, _, _ in reloaded.docstore.source_rows()}
+    assert live == set(loaded.index_to_docstore_id.values())
+    doc, _ = reloaded.similarity_search_with_score_by_vector(added[3].tolist(), k=1)[0]
+    assert doc.page_content == "new 3"
+
+    # A checkpoint folds the journal into a new snapshot
+    assert index_store.save_snapshot(vector_dir, reloaded, extra={"index": config}) == first + 1
+    again, manifest = index_store.load_snapshot(vector_dir, vectorstore.embedding_function)
+    assert manifest["replayed"] == 0
+    assert again.index_to_docstore_id == loaded.index_to_docstore_id
@@ -0,0 +1,93 @@
+"""
+BM25 lexical index: scores against hand-computed values, delete bookkeeping
+(add then delete restores every table exactly), the max_df fallback and
+reciprocal rank fusion.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize  # noqa: E402
+
+# N = 4 chunks, 13 tokens, average length 3.25
+DOCS = {
+    "d1": "apple banana apple zeta",
+    "d2": "banana cherry zeta",
+    "d3": "cherry date egg fig zeta",
+    "d4": "grape",
+}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.sqlite"))
+    index.add(list(DOCS), list(DOCS.values()))
+    return index
+
+
+def _tables(index):
+    conn = index._connect()
+    return {
+        table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall())
+        for table in ("docs", "postings", "terms", "stats")
+    }
+
+
+def test_tokenize_keeps_identifiers_and_their_parts():
+    assert tokenize("What is ERR-4021 in user_id?") == ["err-4021", "err", "4021", "user_id", "user", "id"]
+
+
+def test_bm25_scores_match_hand_computed_values(index):
+    # apple: df 1, idf = ln(1 + 3.5 / 1.5); tf 2 in a 4-token chunk
+    #   1.2528 * 2 * 2.2 / (2 + 1.2 * (0.25 + 0.75 * 4 / 3.25)) = 1.5546
+    [(doc_id, score)] = index.search("apple")
+    assert doc_id == "d1" and score == pytest.approx(1.554565, abs=1e-5)
+
+    # banana, cherry: df 2, idf = ln 2; d2 has both, d1 (4 tokens) beats d3 (5 tokens)
+    results = index.search("banana cherry")
+    assert [doc_id for doc_id, _ in results] == ["d2", "d1", "d3"]
+    assert [score for _, score in results] == pytest.approx([1.431336, 0.633355, 0.568023], abs=1e-5)
+    assert index.search("banana cherry", k=1) == results[:1]
+    assert index.search("unknown words") == []
+
+
+def test_common_terms_are_skipped_unless_nothing_rarer_matches(index):
+    # zeta is in 3 of 4 chunks (> max_df): with apple in the query only apple is scored
+    assert [doc_id for doc_id, _ in index.search("zeta apple")] == ["d1"]
+    # On its own it is used anyway, shortest chunk first
+    results = index.search("zeta")
+    assert [doc_id for doc_id, _ in results] == ["d2", "d1", "d3"]
+    assert [score for _, score in results] == pytest.approx([0.368264, 0.325907, 0.292289], abs=1e-5)
+
+
+def test_delete_updates_terms_and_stats(index):
+    index.delete(["d1", "missing"])
+    tables = _tables(index)
+    assert "apple" not in dict(tables["terms"])
+    assert dict(tables["terms"])["banana"] == 1 and dict(tables["terms"])["zeta"] == 2
+    assert tables["stats"] == [("docs", 3), ("length", 9)]
+    assert index.count() == 3
+    assert index.search("apple") == []
+
+
+def test_add_then_delete_restores_every_table(index):
+    before = _tables(index)
+    # More than one 500-id delete batch, sharing terms with the existing chunks
+    ids = [f"x{i}" for i in range(1200)]
+    index.add(ids, [f"banana zeta new{i % 7} new{i % 7} err-{i}" for i in range(1200)])
+    assert index.count() == 1204
+    index.delete(ids)
+    assert _tables(index) == before
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]])
+    # b: 1/61 + 1/62, c: 1/62 + 1/63, a: 1/61, d: 1/63
+    assert fused == ["b", "c", "a", "d"]
+    assert reciprocal_rank_fusion([["a", "b"], ["b"]], k=0) == ["b", "a"]
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,61 @@
+"""
+Shared Ollama clients: models share a connection pool only when their
+client settings (timeout, client_kwargs) match.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("ollama")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_pool  # noqa: E402
+
+
+class FakeChatOllama:
+    """Accepts the profile like ChatOllama and exposes the client slots get_llm fills"""
+
+    def __init__(self, model, base_url, **settings):
+        self.model = model
+        self.settings = settings
+        self._client = None
+        self._async_client = None
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool(monkeypatch):
+    monkeypatch.setattr(llm_pool, "_clients", {})
+    monkeypatch.setattr(llm_pool, "_llms", {})
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://ollama.test:11434")
+    monkeypatch.setitem(sys.modules, "langchain_ollama", types.SimpleNamespace(ChatOllama=FakeChatOllama))
+
+
+def _timeout(client):
+    return client._client.timeout.read
+
+
+def test_clients_are_shared_only_between_matching_settings():
+    answer = llm_pool.get_llm("qwen2.5:7b")
+    other_model = llm_pool.get_llm("llama3.1:8b")
+    condenser = llm_pool.get_llm("qwen2.5:7b", temperature=0, num_predict=64, timeout=60)
+
+    assert answer._client is other_model._client and answer._async_client is other_model._async_client
+    assert condenser._client is not answer._client
+    assert _timeout(answer._client) == 120 and _timeout(condenser._client) == 60
+    assert llm_pool.get_llm("qwen2.5:7b", temperature=0, num_predict=64, timeout=60) is condenser
+
+
+def test_client_kwargs_are_part_of_the_key():
+    plain = llm_pool._shared_clients("http://ollama.test:11434", 120)
+    headers = {"headers": {"Authorization": "Bearer token"}}
+    with_headers = llm_pool._shared_clients("http://ollama.test:11434", 120, headers)
+
+    assert with_headers is not plain
+    assert with_headers[0]._client.headers["authorization"] == "Bearer token"
+    assert llm_pool._shared_clients("http://ollama.test:11434", 120, dict(headers)) is with_headers
+    assert llm_pool._shared_clients("http://ollama.test:11434") is plain
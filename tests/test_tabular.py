@@ -0,0 +1,125 @@
+"""
+Spreadsheet chunks: the header is repeated in every chunk, row ranges stay
+exact across read batches, failed tabular loads fall back to the generic
+loader, and the column index is rebuilt from the docstore on load.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.embeddings import DeterministicFakeEmbedding  # noqa: E402
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+
+import ann_index  # noqa: E402
+import index_store  # noqa: E402
+import rag_engine  # noqa: E402
+from tabular import chunk_cells, iter_table_chunks  # noqa: E402
+
+HEADER = "Table: orders.csv\nColumns: order_id | customer | note\n"
+
+
+def _write_csv(tmp_path, rows=50):
+    path = tmp_path / "orders.csv"
+    lines = ["order_id,customer,note"]
+    lines += [f"ORD-{i},Customer {i % 7},{'long note ' * (i % 4)}" for i in range(rows)]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def _chunks(path, **kwargs):
+    return list(iter_table_chunks(path, "orders.csv", "hash", chunk_chars=300, **kwargs))
+
+
+def test_every_chunk_repeats_the_header(tmp_path):
+    chunks = _chunks(_write_csv(tmp_path))
+    assert len(chunks) > 3
+    for chunk in chunks:
+        assert chunk.page_content.startswith(HEADER)
+        rows = chunk.page_content[len(HEADER):].split("\n")
+        assert len(rows) == chunk.metadata["row_end"] - chunk.metadata["row_start"] + 1
+
+
+def test_row_ranges_are_exact_across_read_batches(tmp_path):
+    path = _write_csv(tmp_path)
+    for batch_rows in (7, 5000):
+        chunks = _chunks(path, batch_rows=batch_rows)
+        # Line 1 is the header, so data rows are 2..51, covered once and in order
+        starts = [c.metadata["row_start"] for c in chunks]
+        ends = [c.metadata["row_end"] for c in chunks]
+        assert starts[0] == 2 and ends[-1] == 51
+        assert starts[1:] == [end + 1 for end in ends[:-1]]
+        for chunk in chunks:
+            # Sheet row n holds ORD-(n - 2)
+            orders = [line.split(" | ")[0] for line in chunk.page_content[len(HEADER):].split("\n")]
+            rows = range(chunk.metadata["row_start"], chunk.metadata["row_end"] + 1)
+            assert orders == [f"ORD-{row - 2}" for row in rows]
+        if batch_rows == 7:
+            # Some chunk is made of rows from two read batches
+            assert any((start - 2) // 7 != (end - 2) // 7 for start, end in zip(starts, ends))
+
+
+def test_failed_tabular_load_falls_back_to_the_generic_loader(tmp_path, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("unreadable sheet")
+        yield
+
+    monkeypatch.setattr(rag_engine, "iter_table_chunks", broken)
+    path = _write_csv(tmp_path, rows=3)
+    for chunks in (list(rag_engine.iter_chunks(path, "orders.csv", "hash")),
+                   rag_engine.load_and_split(path, "orders.csv", "hash")[0]):
+        assert chunks and "row_start" not in chunks[0].metadata
+        assert "order_id: ORD-0" in chunks[0].page_content
+        assert chunks[0].metadata["source"] == "orders.csv"
+
+
+def test_chunk_cells_reads_back_the_indexed_values(tmp_path):
+    for chunk in _chunks(_write_csv(tmp_path), with_cells=True):
+        assert chunk_cells(chunk) == chunk.metadata["table_cells"]
+    assert chunk_cells(Document(page_content="plain text\nwithout a table")) == []
+
+
+def test_column_index_is_rebuilt_from_the_docstore_on_load(tmp_path, monkeypatch):
+    chunks = _chunks(_write_csv(tmp_path), with_cells=True)
+    for chunk in chunks:
+        chunk.metadata.pop("table_cells")
+    chunks.append(Document(page_content="notes about orders", metadata={"source": "notes.txt"}))
+    ids = [f"doc-{i}" for i in range(len(chunks))]
+    vectors = np.random.default_rng(0).random((len(chunks), 16), dtype=np.float32)
+    config = ann_index.resolve_config(len(chunks), 16, "flat")
+    vectorstore = ann_index.RescoringFAISS(
+        embedding_function=DeterministicFakeEmbedding(size=16),
+        index=ann_index.build_index(vectors, config),
+        docstore=InMemoryDocstore(dict(zip(ids, chunks))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+    vector_dir = str(tmp_path / "vectors")
+    index_store.save_snapshot(vector_dir, vectorstore, extra={"index": config})
+
+    rebuilds = []
+    rebuild = rag_engine.SharedIndex.rebuild_columns
+    monkeypatch.setattr(rag_engine.SharedIndex, "rebuild_columns",
+                        lambda shared: rebuilds.append(1) or rebuild(shared))
+    monkeypatch.setattr(rag_engine, "_shared_indexes", {})
+
+    # No columns.sqlite next to the snapshot: rebuilt from the stored chunks
+    shared = rag_engine.get_shared_index(vector_dir, vectorstore.embedding_function)
+    assert len(rebuilds) == 1
+    assert shared.columns.doc_ids() == set(ids[:-1])
+    [(doc_id, hits)] = shared.columns.search("which customer placed ord-17?")
+    assert "ORD-17 |" in vectorstore.docstore.search(doc_id).page_content and hits == 1
+
+    # In step with the snapshot: loaded as is
+    monkeypatch.setattr(rag_engine, "_shared_indexes", {})
+    rag_engine.get_shared_index(vector_dir, vectorstore.embedding_function)
+    assert len(rebuilds) == 1